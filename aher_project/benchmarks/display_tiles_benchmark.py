@@ -0,0 +1,123 @@
+"""
+Benchmark of rendering compact tile display json with the precomputed
+__arches_node_display_labels lookup against the original nodes /
+cards_x_nodes_x_widgets / cards join, on the tiles of one graph.
+
+    python -m aher_project.benchmarks.display_tiles_benchmark --tiles 5000
+    python -m aher_project.benchmarks.display_tiles_benchmark --graph <graphid> --language en --repeat 5
+
+Without --graph the graph with the most nodes is used, which is where the
+join is most expensive.
+"""
+
+import argparse
+import os
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "aher_project.settings")
+django.setup()
+
+from django.db import connection
+
+# __arches_display_tiledata_compact as it was before the lookup, kept as the baseline: the
+# three-way join, with the display value computed again by the compact filter
+BASELINE_SQL = """
+    SELECT t.tileid, (
+        SELECT json_build_object(
+            c.name ->> %(language)s,
+            jsonb_object_agg(cnw.label ->> %(language)s, __arches_get_node_display_value(t.tiledata, n.nodeid, %(language)s))
+        )
+        FROM nodes n
+            join public.cards_x_nodes_x_widgets cnw on n.nodeid = cnw.nodeid
+            join public.cards c on c.cardid = cnw.cardid
+        WHERE n.nodeid IN (SELECT jsonb_object_keys(t.tiledata)::uuid)
+            AND (
+                NOT %(compact)s
+                OR __arches_get_node_display_value(t.tiledata, n.nodeid, %(language)s) <> ''::text
+            )
+        GROUP BY c.name
+        LIMIT 1
+    )
+    FROM public.tiles t
+    WHERE t.tileid = ANY(%(tileids)s::uuid[])
+"""
+
+LOOKUP_SQL = """
+    SELECT t.tileid, __arches_display_tiledata_compact(t.tiledata, %(language)s, %(compact)s)
+    FROM public.tiles t
+    WHERE t.tileid = ANY(%(tileids)s::uuid[])
+"""
+
+BULK_SQL = """
+    SELECT tileid, display
+    FROM __arches_display_tiledata_compact_bulk(%(tileids)s::uuid[], %(language)s, %(compact)s)
+"""
+
+
+def largest_graph():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT graphid FROM nodes GROUP BY graphid ORDER BY count(*) DESC LIMIT 1")
+        row = cursor.fetchone()
+    return str(row[0]) if row else None
+
+
+def sample_tiles(graphid, count):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT t.tileid FROM tiles t
+                join resource_instances r on r.resourceinstanceid = t.resourceinstanceid
+            WHERE r.graphid = %s
+            LIMIT %s
+            """,
+            [graphid, count],
+        )
+        return [str(row[0]) for row in cursor.fetchall()]
+
+
+def run(name, sql, params, repeat):
+    best = None
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = len(cursor.fetchall())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{name:<36} {best:8.3f}s {len(params['tileids']) / best:10.1f} tiles/s ({rows} rows)")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--graph", help="Graph whose tiles are rendered, defaults to the graph with the most nodes")
+    parser.add_argument("--tiles", type=int, default=2000, help="Number of tiles rendered per run")
+    parser.add_argument("--language", default="en", help="Language code of the labels and values")
+    parser.add_argument("--full", action="store_true", help="Keep empty values, i.e. compact=false")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, the best is reported")
+    args = parser.parse_args()
+
+    graphid = args.graph or largest_graph()
+    if graphid is None:
+        parser.error("No graphs found")
+    tileids = sample_tiles(graphid, args.tiles)
+    if not tileids:
+        parser.error(f"No tiles found for graph {graphid}")
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM nodes WHERE graphid = %s", [graphid])
+        nodes = cursor.fetchone()[0]
+    print(f"Graph {graphid}: {nodes} nodes, {len(tileids)} tiles")
+
+    params = {"tileids": tileids, "language": args.language, "compact": not args.full}
+    baseline = run("three-way join (baseline)", BASELINE_SQL, params, args.repeat)
+    lookup = run("per tile with label lookup", LOOKUP_SQL, params, args.repeat)
+    bulk = run("bulk with label lookup", BULK_SQL, params, args.repeat)
+    print(f"Speed up: per tile {baseline / lookup:.2f}x, bulk {baseline / bulk:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
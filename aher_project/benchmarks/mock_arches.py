@@ -0,0 +1,248 @@
+"""
+Local stand in for the parts of the Arches API the scraper crawls, serving
+synthetic graphs, a paginated resource list and resource documents.
+
+    python -m aher_project.benchmarks.mock_arches --port 8765 --resources 5000 --latency 0.01
+
+Every resource document is about --payload-kb in size and contains the kind of
+ignored keys and empty values the scraper prunes. Responses carry an ETag, and
+requests with a matching If-None-Match get a 304, so incremental crawls can be
+measured too.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+ID_PLACEHOLDER = "00000000-0000-0000-0000-00000000ffff"
+
+
+def _resource_template(graphid: str, payload_kb: float, geometry_kb: float = 0) -> str:
+    '''
+    A resource document, as JSON with ID_PLACEHOLDER for its id, of about payload_kb
+    plus geometry_kb of (pruned) geospatial coordinates
+    '''
+    def name(i):
+        return {
+            "Name": {"@display_value": f"Name {i}", "valueid": str(uuid.UUID(int=i)), "language_id": "en"},
+            "Name Type": {"@display_value": "Primary", "concept_id": str(uuid.UUID(int=i + 1)), "Metatype": "x"},
+            "Name Use": {"@display_value": "null"},
+            "Notes": [{}, {"Note": ""}, {"Note": f"Note {i} " * 4}],
+        }
+
+    document = {
+        "resourceinstanceid": ID_PLACEHOLDER,
+        "graph_id": graphid,
+        "displayname": f"Resource {ID_PLACEHOLDER}",
+        "displaydescription": "Undefined",
+        "legacyid": ID_PLACEHOLDER,
+        "resource": {"Names": [], "Location Data": {"Geospatial Coordinates": {"type": "FeatureCollection", "features": []}}},
+    }
+    i = 0
+    while len(json.dumps(document)) < payload_kb * 1024:
+        document["resource"]["Names"].append(name(i))
+        i += 1
+    # a polygon of about 40 bytes per point
+    points = int(geometry_kb * 1024 / 40)
+    if points:
+        ring = [[-1.5 + j * 1e-6, 52.5 + j * 1e-6] for j in range(points)]
+        document["resource"]["Location Data"]["Geospatial Coordinates"]["features"].append(
+            {"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]}, "properties": {}}
+        )
+    return json.dumps(document)
+
+
+class MockArches:
+    '''
+    The synthetic dataset and the behaviour of the mock server
+    '''
+
+    def __init__(self, resources: int = 1000, page_size: int = 100, graphs: int = 3, payload_kb: float = 4, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, end_status: int = 200, count_endpoint: bool = False, geometry_kb: float = 0, seed: int = 0):
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.end_status = end_status
+        self.count_endpoint = count_endpoint
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.graphids = [str(uuid.UUID(int=(seed << 32) + g + 1)) for g in range(graphs)]
+        self.resourceids = [str(uuid.UUID(int=(seed << 64) + (1 << 48) + r)) for r in range(resources)]
+        self.templates = [_resource_template(graphid, payload_kb, geometry_kb) for graphid in self.graphids]
+        self.requests = 0
+
+    def graphs(self) -> List:
+        graphs = [{"graphid": graphid, "isresource": True, "name": f"Graph {g}", "description": f"Synthetic graph {g}"} for g, graphid in enumerate(self.graphids)]
+        graphs.append({"graphid": str(uuid.UUID(int=0)), "isresource": True, "name": "Arches System Settings", "description": ""})
+        return graphs
+
+    def page(self, page: int) -> Optional[List[str]]:
+        ids = self.resourceids[(page - 1) * self.page_size:page * self.page_size] if page > 0 else []
+        return ids or None
+
+    def resource(self, resourceid: str) -> Optional[bytes]:
+        try:
+            index = int(uuid.UUID(resourceid)) - (int(uuid.UUID(self.resourceids[0])) if self.resourceids else 0)
+        except ValueError:
+            return None
+        if not 0 <= index < len(self.resourceids):
+            return None
+        return self.templates[index % len(self.templates)].replace(ID_PLACEHOLDER, resourceid).encode()
+
+    def delay(self) -> float:
+        with self.random_lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def fails(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self.random_lock:
+            return self.random.random() < self.error_rate
+
+
+def _handler(mock: MockArches):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately, Nagle would hold the body back for the delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, body: bytes, status: int = 200, headers: Optional[dict] = None):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            mock.requests += 1
+            delay = mock.delay()
+            if delay:
+                time.sleep(delay)
+            path, _, query = self.path.partition("?")
+            if path == "/graphs/":
+                return self.send(json.dumps(mock.graphs()).encode())
+            if path == "/resource-count" and mock.count_endpoint:
+                count = len(mock.resourceids)
+                return self.send(json.dumps({"count": count, "page_size": mock.page_size, "pages": -(-count // mock.page_size)}).encode())
+            if path == "/resources/" and query.startswith("page="):
+                try:
+                    ids = mock.page(int(query[len("page="):].split("&")[0]))
+                except ValueError:
+                    ids = None
+                if ids is None:
+                    if mock.end_status == 200:
+                        return self.send(json.dumps({"ldp:contains": []}).encode())
+                    return self.send(json.dumps({"detail": "Invalid page"}).encode(), mock.end_status)
+                host = f"http://{self.headers.get('Host', 'localhost')}"
+                return self.send(json.dumps({"ldp:contains": [f"{host}/resources/{resourceid}" for resourceid in ids]}).encode())
+            if path.startswith("/resources/"):
+                if mock.fails():
+                    return self.send(b'{"detail": "Service unavailable"}', 503)
+                body = mock.resource(path[len("/resources/"):].strip("/"))
+                if body is None:
+                    return self.send(b'{"detail": "Not found"}', 404)
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                return self.send(body, headers={"ETag": etag})
+            self.send(b'{"detail": "Not found"}', 404)
+
+    return Handler
+
+
+class MockArchesServer:
+    '''
+    Runs a MockArches in a background thread
+
+        with MockArchesServer(MockArches(resources=500)) as url:
+            ...
+    '''
+
+    def __init__(self, mock: MockArches, host: str = "127.0.0.1", port: int = 0):
+        self.mock = mock
+        self.server = ThreadingHTTPServer((host, port), _handler(mock))
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-arches", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> str:
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--resources", type=int, default=1000, help="Number of resources listed")
+    parser.add_argument("--page-size", type=int, default=100, help="Resources per page of the resource list")
+    parser.add_argument("--graphs", type=int, default=3, help="Number of resource graphs")
+    parser.add_argument("--payload-kb", type=float, default=4, help="Size of a resource document")
+    parser.add_argument("--geometry-kb", type=float, default=0, help="Size of the geometry added to every resource document, which the scraper prunes")
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Latency varies by up to this many seconds either way")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of the resource requests answered with a 503")
+    parser.add_argument("--end-status", type=int, default=200, help="Status of pages past the end of the list, 200 for an empty list, 500 like older Arches")
+    parser.add_argument("--count-endpoint", action="store_true", help="Serve /resource-count like views/resource_count.py, otherwise the scraper has to probe for the last page")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the ids, latency and errors")
+
+
+def mock_from_arguments(args) -> MockArches:
+    return MockArches(
+        resources=args.resources,
+        page_size=args.page_size,
+        graphs=args.graphs,
+        payload_kb=args.payload_kb,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        end_status=args.end_status,
+        count_endpoint=args.count_endpoint,
+        geometry_kb=args.geometry_kb,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    server = MockArchesServer(mock_from_arguments(args), args.host, args.port)
+    print(f"Serving {args.resources} resources at {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark of the scraper's document pruning against the original recursive
+remove_empty_dict_items, run on raw /resources/<id>?format=json responses.
+
+    python -m aher_project.benchmarks.prune_benchmark --fixtures fixtures/resources --fetch 200
+    python -m aher_project.benchmarks.prune_benchmark --fixtures fixtures/resources --repeat 5
+"""
+
+import argparse
+import json
+import os
+import time
+
+from aher_project.management.commands.util import scraper
+from aher_project.management.commands.util.prune import Pruner
+
+LEGACY_IGNORE_KEYS = [
+        "valueid",
+        "concept_id",
+        "language_id",
+        "valueid",
+        "valuetype_id",
+        "instance_details",
+        "direction",
+        "Geospatial Coordinates",
+        "inverseOntologyProperty",
+        "ontologyProperty",
+        "resourceId",
+        "resourceXresourceId",
+        "legacyid",
+        "map_popup",
+        "concept_details",
+        "@display_value"
+]
+def legacy_remove_empty_dict_items(d):
+    '''
+    remove_empty_dict_items as it was before the Pruner, kept as the baseline
+    '''
+    if not isinstance(d, (dict, list)):
+        return d
+    if isinstance(d, list):
+        return [v for v in (legacy_remove_empty_dict_items(v) for v in d) if v]
+    return {k: v for k, v in ((k, legacy_remove_empty_dict_items(v)) for k, v in d.items()) if v and not k in LEGACY_IGNORE_KEYS and v not in ["null", "Undefined"] and "Metatype" not in str(k)}
+
+
+def fetch_fixtures(path, count):
+    '''
+    Saves the raw JSON of the first count resources listed by the server as fixtures
+    '''
+    os.makedirs(path, exist_ok=True)
+    saved = 0
+    page = 1
+    while saved < count:
+        resourceids = scraper.fetch_resourceids(page)
+        if not resourceids:
+            break
+        for resourceid in resourceids[:count - saved]:
+            response = scraper.fetch_url(f"{scraper.HOST_URL}/resources/{resourceid}?format=json")
+            if response is not None and response.status_code == 200:
+                with open(os.path.join(path, f"{resourceid}.json"), "wb") as f:
+                    f.write(response.content)
+                saved += 1
+        page += 1
+    print(f"Saved {saved} fixtures to {path}")
+
+
+def load_fixtures(path):
+    fixtures = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".json"):
+            with open(os.path.join(path, name), "rb") as f:
+                fixtures.append(f.read())
+    return fixtures
+
+
+def run(name, fn, fixtures, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for raw in fixtures:
+            fn(raw)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    megabytes = sum(len(raw) for raw in fixtures) / (1024 * 1024)
+    print(f"{name:<36} {best:8.3f}s {len(fixtures) / best:10.1f} docs/s {megabytes / best:8.1f} MB/s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", required=True, help="Directory of raw resource JSON files")
+    parser.add_argument("--fetch", type=int, default=0, help="First download this many resources from the server into --fixtures")
+    parser.add_argument("--host", default=scraper.HOST_URL, help="Server to download fixtures from")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, the best is reported")
+    args = parser.parse_args()
+
+    if args.fetch:
+        scraper.set_host(args.host)
+        fetch_fixtures(args.fixtures, args.fetch)
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"No .json fixtures found in {args.fixtures}")
+
+    pruner = Pruner()
+    for raw in fixtures:
+        if legacy_remove_empty_dict_items(json.loads(raw)) != pruner.loads(raw):
+            raise SystemExit("Pruner output differs from remove_empty_dict_items")
+
+    print(f"{len(fixtures)} fixtures, {sum(len(raw) for raw in fixtures) / (1024 * 1024):.1f} MB")
+    baseline = run("json.loads + legacy prune", lambda raw: legacy_remove_empty_dict_items(json.loads(raw)), fixtures, args.repeat)
+    walk = run("json.loads + Pruner.prune", lambda raw: pruner.prune(json.loads(raw)), fixtures, args.repeat)
+    hook = run("Pruner.loads (prune while decoding)", pruner.loads, fixtures, args.repeat)
+    print(f"Speed up: prune {baseline / walk:.2f}x, prune while decoding {baseline / hook:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
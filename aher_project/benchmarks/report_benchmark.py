@@ -0,0 +1,102 @@
+"""
+Load test of the resource report endpoint, to compare the server's requests/s
+with and without pooled database connections. Run it once against a server
+started with DB_POOL=0 and once with DB_POOL=1 (same number of server
+processes / threads), and compare the two reports:
+
+    DB_POOL=0 gunicorn aher_project.wsgi -w 4 --threads 4 &
+    python -m aher_project.benchmarks.report_benchmark --host http://localhost:8000 --label persistent
+    DB_POOL=1 gunicorn aher_project.wsgi -w 4 --threads 4 &
+    python -m aher_project.benchmarks.report_benchmark --host http://localhost:8000 --label pooled
+
+DB_CONN_MAX_AGE=0 with DB_POOL=0 gives the old connection per request baseline.
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+
+import requests
+
+from aher_project.management.commands.util import scraper
+
+REPORT_PATH = "/report/{resourceid}"
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=scraper.HOST_URL, help="Server to load")
+    parser.add_argument("--path", default=REPORT_PATH, help="Report path, {resourceid} is replaced by each resource id")
+    parser.add_argument("--resources", type=int, default=100, help="Number of resources, from the first pages of the resource list, the reports are requested for")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of requests made at once")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run for, after a warm up of a tenth of it")
+    parser.add_argument("--label", default="", help="Label of this run in the report, e.g. pooled")
+    args = parser.parse_args()
+
+    scraper.set_host(args.host)
+    resourceids = []
+    page = 1
+    while len(resourceids) < args.resources:
+        ids = scraper.fetch_resourceids(page)
+        if not ids:
+            break
+        resourceids.extend(ids)
+        page += 1
+    resourceids = resourceids[:args.resources]
+    if not resourceids:
+        parser.error(f"No resources listed by {args.host}")
+
+    urls = cycle(f"{args.host}{args.path.format(resourceid=resourceid)}" for resourceid in resourceids)
+    urls_lock = threading.Lock()
+    local = threading.local()
+    latencies = []
+    errors = 0
+    results_lock = threading.Lock()
+    warm_up_end = time.perf_counter() + args.duration / 10
+    end = warm_up_end + args.duration
+
+    def worker():
+        nonlocal errors
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        while True:
+            with urls_lock:
+                url = next(urls)
+            start = time.perf_counter()
+            if start >= end:
+                return
+            try:
+                ok = session.get(url, timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            if start < warm_up_end:
+                continue
+            with results_lock:
+                latencies.append(time.perf_counter() - start)
+                if not ok:
+                    errors += 1
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(args.concurrency)]:
+            future.result()
+
+    label = f" [{args.label}]" if args.label else ""
+    print(f"{args.host}{args.path}{label}: {len(resourceids)} resources, concurrency {args.concurrency}")
+    print(
+        f"{len(latencies) / args.duration:.1f} requests/s, {errors} errors, "
+        f"p50 {percentile(latencies, 50) * 1000:.1f}ms, p99 {percentile(latencies, 99) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
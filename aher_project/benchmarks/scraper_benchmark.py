@@ -0,0 +1,164 @@
+"""
+Benchmark of the scraper's crawl modes against a local mock Arches server,
+see mock_arches for the synthetic data it serves.
+
+    python -m aher_project.benchmarks.scraper_benchmark --resources 2000 --latency 0.01
+    python -m aher_project.benchmarks.scraper_benchmark --modes threads pipeline --payload-kb 32 --json results.json
+
+Every mode crawls the whole mock dataset in a process of its own, into an empty
+doc store, and reports resources/s, the p50 / p99 latency of its resources and
+of its HTTP requests, its peak RSS and the bytes of documents it wrote. The
+resource latency runs from the start of a resource's fetch to its document being
+written. The request latency is the time to the response headers when resources
+are streamed, and to the end of the body with --buffered. The incremental mode
+crawls twice and reports the second crawl, where every resource is unchanged, so
+no resource latency.
+"""
+
+import argparse
+import json
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from aher_project.benchmarks.mock_arches import MockArchesServer, add_mock_arguments, mock_from_arguments
+from aher_project.management.commands.util.sinks import SHARD_INDEX_FILENAME, SHARD_PREFIX
+
+MODES = {
+    "sequential": {},
+    "threads": {"workers": 8},
+    "pipeline": {"pipeline": True, "workers": 8},
+    "processes": {"processes": 4, "workers": 4},
+    "shards": {"output": "shards", "workers": 8},
+    "shards-gzip": {"output": "shards", "compression": "gzip", "workers": 8},
+    "incremental": {"incremental": True, "workers": 8},
+}
+# the files documents are written to: <resourceid>.json, or shards and their index
+DOCUMENT_FILE = re.compile(rf"^([0-9a-f-]{{36}}\.json|{re.escape(SHARD_PREFIX)}-\d+\.jsonl(\.gz|\.zst)?|{re.escape(SHARD_INDEX_FILENAME)})$")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux and bytes on macOS, the process' worker processes count too
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _bytes_written(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            # not the checkpoint, stats file, graphs or graph cache
+            if DOCUMENT_FILE.match(name):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _ms(seconds) -> str:
+    return f"{seconds * 1000:7.1f}ms" if seconds is not None else "      -  "
+
+
+def run_mode(mode: str, host: str, store: str, result_path: str, buffered: bool = False):
+    '''
+    Crawls the mock server in one mode, run in a process of its own
+    '''
+    from aher_project.management.commands.util import scraper, session
+    from aher_project.management.commands.util.telemetry import TELEMETRY
+
+    scraper.STREAM_RESOURCES = not buffered
+    scraper.set_host(host)
+    scraper.DOC_STORE_PATH = store
+    options = MODES[mode]
+    bytes_before = 0
+    if options.get("incremental"):
+        # the first crawl fills the checkpoint, the second one, of unchanged resources, is measured
+        scraper.main(**options)
+        session.STATS.reset()
+        bytes_before = _bytes_written(store)
+    start = time.perf_counter()
+    scraper.main(**options)
+    telemetry = TELEMETRY.as_dict()
+    result = {
+        "elapsed": time.perf_counter() - start,
+        "stats": session.STATS.as_dict(),
+        "resource_latency_p50": telemetry["resource_latency_p50"],
+        "resource_latency_p99": telemetry["resource_latency_p99"],
+        "peak_rss_mb": _peak_rss_mb(),
+        "bytes_written": _bytes_written(store) - bytes_before,
+    }
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="*", choices=sorted(MODES), default=list(MODES), help="Crawl modes to run")
+    parser.add_argument("--store", default=None, help="Directory the doc stores are written under (default: a temporary directory)")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file, e.g. for CI")
+    parser.add_argument("--buffered", action="store_true", help="Buffer every resource before parsing it even if ijson is installed, to compare peak RSS with streaming")
+    parser.add_argument("--run-mode", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--host", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(args.run_mode, args.host, args.store, args.result, args.buffered)
+        return
+
+    base = args.store or tempfile.mkdtemp(prefix="scraper_benchmark_")
+    results = []
+    with MockArchesServer(mock_from_arguments(args)) as url:
+        print(f"{args.resources} resources of {args.payload_kb}KB, {args.latency * 1000:.1f}ms latency, {args.error_rate:.1%} errors, served at {url}")
+        for mode in args.modes:
+            store = os.path.join(base, mode)
+            shutil.rmtree(store, ignore_errors=True)
+            os.makedirs(store)
+            result_path = os.path.join(base, f"{mode}.result.json")
+            process = subprocess.run(
+                [sys.executable, "-m", "aher_project.benchmarks.scraper_benchmark", "--run-mode", mode, "--host", url, "--store", store, "--result", result_path] + (["--buffered"] if args.buffered else []),
+                stdout=subprocess.DEVNULL,
+            )
+            if process.returncode != 0:
+                print(f"{mode:<12} failed with exit code {process.returncode}")
+                results.append({"mode": mode, "failed": True})
+                continue
+            with open(result_path) as f:
+                child = json.load(f)
+            stats = child["stats"]
+            result = {
+                "mode": mode,
+                "resources_per_second": args.resources / child["elapsed"],
+                "elapsed": child["elapsed"],
+                "resource_latency_p50": child["resource_latency_p50"],
+                "resource_latency_p99": child["resource_latency_p99"],
+                "request_latency_p50": stats["latency_p50"],
+                "request_latency_p99": stats["latency_p99"],
+                "requests": stats["requests"],
+                "retries": stats["retries"],
+                "errors": stats["errors"],
+                "peak_rss_mb": child["peak_rss_mb"],
+                "bytes_written": child["bytes_written"],
+            }
+            results.append(result)
+            print(
+                f"{mode:<12} {result['resources_per_second']:10.1f} resources/s "
+                f"resource p50 {_ms(result['resource_latency_p50'])} p99 {_ms(result['resource_latency_p99'])} "
+                f"request p50 {_ms(result['request_latency_p50'])} p99 {_ms(result['request_latency_p99'])} "
+                f"peak RSS {result['peak_rss_mb']:7.1f}MB written {result['bytes_written'] / (1024 * 1024):8.2f}MB "
+                f"({result['requests']} requests, {result['retries']} retries)"
+            )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"options": {k: v for k, v in vars(args).items() if k not in ("run_mode", "host", "result", "json")}, "results": results}, f, indent=2)
+    if not args.store:
+        shutil.rmtree(base, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Tiered cache backend: a small in-process LRU in front of a shared cache, with a
+local fallback used while the shared cache cannot be reached.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "aher_project.cache.TieredCache",
+            "OPTIONS": {"SHARED": "shared", "FALLBACK": "local", "LOCAL_MAX_ENTRIES": 2000, "LOCAL_TIMEOUT": 60},
+        },
+        "shared": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://localhost:6379/1"},
+        "local": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": "/tmp/aher_cache"},
+    }
+
+Entries are kept in the local tier for at most LOCAL_TIMEOUT seconds, as other
+processes cannot invalidate them there, so that is how long a change made by
+another process can go unseen.
+
+Keys set or deleted while the shared cache was down only changed the fallback,
+so once the shared cache is reachable again they are deleted from it before it
+is used, and the fallback is cleared for the next outage.
+"""
+
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from aher_project.instrumentation import record_cache
+
+LOCAL_MAX_ENTRIES = 1000
+LOCAL_TIMEOUT = 30 # seconds
+SHARED_RETRY = 30 # seconds the fallback is used for before the shared cache is tried again
+
+_MISSING = object()
+
+
+class LocalLRU:
+    '''
+    Thread safe LRU of values with an expiry time, stored pickled like LocMemCache
+    so that callers changing a value they got do not change the cached one
+    '''
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return _MISSING
+            self._entries.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout):
+        if timeout is not None and timeout <= 0:
+            self.delete(key)
+            return
+        expires = None if timeout is None else time.monotonic() + timeout
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TieredCache(BaseCache):
+    '''
+    Django cache backend reading through an in-process LRU to a shared cache
+
+    OPTIONS: SHARED and FALLBACK name other entries of CACHES, LOCAL_MAX_ENTRIES and
+    LOCAL_TIMEOUT size the in-process tier. Without SHARED the local tier is in front
+    of FALLBACK alone. Errors of the shared cache switch to FALLBACK for SHARED_RETRY
+    seconds rather than failing requests.
+    '''
+
+    def __init__(self, location, params):
+        options = dict(params.get("OPTIONS", {}))
+        self.shared_alias = options.pop("SHARED", None)
+        self.fallback_alias = options.pop("FALLBACK", None)
+        self.local_timeout = options.pop("LOCAL_TIMEOUT", LOCAL_TIMEOUT)
+        self.local = LocalLRU(options.pop("LOCAL_MAX_ENTRIES", LOCAL_MAX_ENTRIES))
+        super().__init__({**params, "OPTIONS": options})
+        self._shared_down_until = 0.0
+        # what changed in the fallback while the shared cache was down, undone there once it is back
+        self._outage_lock = threading.Lock()
+        self._outage = False
+        self._outage_changed = set()
+        self._outage_cleared = False
+
+    def _shared_up(self, shared) -> bool:
+        if time.monotonic() < self._shared_down_until:
+            return False
+        return not self._outage or self._recover(shared)
+
+    def _recover(self, shared) -> bool:
+        '''
+        Deletes the keys changed during an outage from the shared cache, whose values
+        for them are stale, and clears the fallback
+
+        :return: False if the shared cache is still down
+        '''
+        with self._outage_lock:
+            if not self._outage:
+                return True
+            try:
+                if self._outage_cleared:
+                    shared.clear()
+                else:
+                    versions = {}
+                    for key, version in self._outage_changed:
+                        versions.setdefault(version, []).append(key)
+                    for version, keys in versions.items():
+                        shared.delete_many(keys, version)
+            except Exception as e:
+                logging.error(f"Shared cache {self.shared_alias} still failing, using {self.fallback_alias} for {SHARED_RETRY}s: {str(e)}")
+                self._shared_down_until = time.monotonic() + SHARED_RETRY
+                return False
+            self._outage = False
+            self._outage_changed = set()
+            self._outage_cleared = False
+        if self.fallback_alias:
+            try:
+                caches[self.fallback_alias].clear()
+            except Exception as e:
+                logging.error(f"Could not clear the fallback cache {self.fallback_alias}: {str(e)}")
+        return True
+
+    def _call(self, method, *args, changes=None, default=None):
+        '''
+        Calls the shared cache, or the fallback while the shared cache is down
+
+        :param changes: The (key, version) changed by the call, or "all" for clear
+        :param default: Returned if there is no cache to call
+        '''
+        shared = caches[self.shared_alias] if self.shared_alias else None
+        fallback = caches[self.fallback_alias] if self.fallback_alias else None
+        if shared is not None and self._shared_up(shared):
+            try:
+                return getattr(shared, method)(*args)
+            except Exception as e:
+                if fallback is None:
+                    raise
+                logging.error(f"Shared cache {self.shared_alias} failed, using {self.fallback_alias} for {SHARED_RETRY}s: {str(e)}")
+                self._shared_down_until = time.monotonic() + SHARED_RETRY
+        if fallback is None:
+            return default
+        if shared is not None:
+            with self._outage_lock:
+                self._outage = True
+                if changes == "all":
+                    self._outage_cleared = True
+                elif changes is not None:
+                    self._outage_changed.add(changes)
+        return getattr(fallback, method)(*args)
+
+    def _local_timeout(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        return self.local_timeout if timeout is None else min(timeout, self.local_timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self._call("add", key, value, timeout, version, changes=(key, version))
+        if added:
+            self.local.set(self.make_and_validate_key(key, version), value, self._local_timeout(timeout))
+        return added
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version)
+        value = self.local.get(local_key)
+        if value is not _MISSING:
+            record_cache("local_hit")
+            return value
+        # a sentinel rather than None, so that a cached None is a hit
+        value = self._call("get", key, _MISSING, version, default=_MISSING)
+        if value is _MISSING:
+            record_cache("miss")
+            return default
+        record_cache("shared_hit")
+        # the entry's own timeout is not known here, it is kept no longer than the default one
+        self.local.set(local_key, value, self._local_timeout(DEFAULT_TIMEOUT))
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._call("set", key, value, timeout, version, changes=(key, version))
+        self.local.set(self.make_and_validate_key(key, version), value, self._local_timeout(timeout))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._call("touch", key, timeout, version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_and_validate_key(key, version))
+        return self._call("delete", key, version, changes=(key, version))
+
+    def clear(self):
+        self.local.clear()
+        self._call("clear", changes="all")
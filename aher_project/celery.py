@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 import platform
 
@@ -11,3 +12,15 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aher_project.settings')
 app = Celery('aher_project')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@worker_process_shutdown.connect
+def close_database_pools(**kwargs):
+    # Celery's Django fixup already closes or reuses the per task connections according to
+    # CONN_MAX_AGE, the idle connections of the pooled backend are closed when a worker exits
+    from django.conf import settings
+
+    if any(db["ENGINE"] == "aher_project.db.backends.pooled_postgis" for db in settings.DATABASES.values()):
+        from aher_project.db.backends.pooled_postgis.base import close_pools
+
+        close_pools()
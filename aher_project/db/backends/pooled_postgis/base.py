@@ -0,0 +1,194 @@
+"""
+PostGIS database backend keeping a pool of open connections in every process.
+
+Django closes a connection at the end of each request / task when CONN_MAX_AGE
+is 0, this backend then hands it back to its process' pool instead, and the
+next request of any thread of the process takes it from there without a new
+connection being set up. Configure with
+
+    "ENGINE": "aher_project.db.backends.pooled_postgis",
+    "CONN_MAX_AGE": 0,
+    "OPTIONS": {"POOL": {"MAX_SIZE": 10, "MAX_IDLE": 300, "CHECK_AFTER": 30}},
+
+Pools are per process id, so forked processes such as Celery's prefork workers
+start with pools of their own and never use, nor close, their parent's
+connections.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from django.contrib.gis.db.backends.postgis.base import DatabaseWrapper as PostGISDatabaseWrapper
+
+POOL_MAX_SIZE = 10 # idle connections kept per process and database
+POOL_MAX_IDLE = 300 # seconds an idle connection is kept for
+POOL_CHECK_AFTER = 30 # seconds idle after which a connection is checked before it is handed out
+
+
+class ConnectionPool:
+    '''
+    Thread safe stack of idle connections, the most recently used are handed out first
+    so that connections idle for long are the ones that expire
+    '''
+
+    def __init__(self, max_size: int = POOL_MAX_SIZE, max_idle: float = POOL_MAX_IDLE, check_after: float = POOL_CHECK_AFTER):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._idle: List[Tuple[object, float]] = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def get(self):
+        '''
+        An idle connection that is still usable, None if there is none
+        '''
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, released = self._idle.pop()
+            idle = time.monotonic() - released
+            if idle > self.max_idle or not _usable(connection, check=idle > self.check_after):
+                _close(connection)
+                continue
+            self.reused += 1
+            return connection
+
+    def put(self, connection) -> bool:
+        '''
+        Takes back a connection that is no longer used, False if it should be closed instead
+        '''
+        if len(self._idle) >= self.max_size or not _reset(connection):
+            return False
+        with self._lock:
+            if len(self._idle) >= self.max_size:
+                return False
+            self._idle.append((connection, time.monotonic()))
+        return True
+
+
+def _usable(connection, check: bool) -> bool:
+    if connection.closed:
+        return False
+    if not check:
+        return True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        connection.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _reset(connection) -> bool:
+    '''
+    Ends whatever transaction a connection was left in and discards its session state:
+    SET parameters, temporary tables, prepared statements, LISTENs and advisory locks,
+    so the next user starts clean. False if that failed and the connection must be closed
+    '''
+    if connection.closed:
+        return False
+    try:
+        connection.rollback()
+        autocommit = connection.autocommit
+        # DISCARD ALL cannot run inside a transaction block
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("DISCARD ALL")
+        connection.autocommit = autocommit
+        return True
+    except Exception:
+        return False
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+_POOLS: Dict[Tuple[int, str], ConnectionPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(alias: str, options: Dict) -> ConnectionPool:
+    key = (os.getpid(), alias)
+    pool = _POOLS.get(key)
+    if pool is None:
+        with _POOLS_LOCK:
+            pool = _POOLS.get(key)
+            if pool is None:
+                pool = _POOLS[key] = ConnectionPool(
+                    max_size=options.get("MAX_SIZE", POOL_MAX_SIZE),
+                    max_idle=options.get("MAX_IDLE", POOL_MAX_IDLE),
+                    check_after=options.get("CHECK_AFTER", POOL_CHECK_AFTER),
+                )
+    return pool
+
+
+def pool_stats() -> Dict[str, Dict]:
+    '''
+    Connections created and reused by the pools of this process, per database alias
+    '''
+    pid = os.getpid()
+    return {alias: {"created": pool.created, "reused": pool.reused, "idle": len(pool._idle)} for (owner, alias), pool in _POOLS.items() if owner == pid}
+
+
+def close_pools():
+    '''
+    Closes the idle connections of this process' pools, e.g. when a worker process exits
+    '''
+    pid = os.getpid()
+    for (owner, alias), pool in list(_POOLS.items()):
+        if owner != pid:
+            continue
+        with pool._lock:
+            idle, pool._idle = pool._idle, []
+        for connection, released in idle:
+            _close(connection)
+
+
+class DatabaseWrapper(PostGISDatabaseWrapper):
+    @property
+    def pool(self) -> ConnectionPool:
+        return get_pool(self.alias, self.settings_dict["OPTIONS"].get("POOL", {}))
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        # the pool settings are not connection parameters of the driver
+        params.pop("POOL", None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        connection = pool.get()
+        if connection is None:
+            connection = super().get_new_connection(conn_params)
+            pool.created += 1
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.pool.put(self.connection):
+            return
+        with self.wrap_database_errors:
+            return self.connection.close()
+
+    def init_connection_state(self):
+        try:
+            super().init_connection_state()
+        except Exception:
+            # a pooled connection the server has dropped since it was checked
+            logging.warning("Pooled database connection failed its set up, connecting again")
+            _close(self.connection)
+            self.connection = super().get_new_connection(self.get_connection_params())
+            self.pool.created += 1
+            super().init_connection_state()
@@ -0,0 +1,259 @@
+"""
+Request instrumentation cheap enough to leave on in production.
+
+InstrumentationMiddleware times every request per view. For a sample of the
+requests (INSTRUMENTATION_SAMPLE_RATE) it also counts the SQL queries and their
+time, the cache lookups of the TieredCache caches by result, and the
+elasticsearch requests and their time. The aggregates of the process are served
+in the Prometheus text format by views.metrics and, every
+INSTRUMENTATION_LOG_INTERVAL seconds, summarised in a log line.
+"""
+
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import connections
+
+DEFAULT_SAMPLE_RATE = 0.1
+DEFAULT_LOG_INTERVAL = 300 # seconds, 0 to not log
+# upper bounds (seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+CACHE_RESULTS = ("local_hit", "shared_hit", "miss")
+
+logger = logging.getLogger(__name__)
+
+
+class RequestSample:
+    '''
+    What one sampled request spent its time on
+    '''
+
+    __slots__ = ("sql_count", "sql_time", "es_count", "es_time", "cache")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.es_count = 0
+        self.es_time = 0.0
+        self.cache = dict.fromkeys(CACHE_RESULTS, 0)
+
+
+_CURRENT: contextvars.ContextVar[Optional[RequestSample]] = contextvars.ContextVar("aher_request_sample", default=None)
+
+
+class ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.sampled = 0
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.es_count = 0
+        self.es_time = 0.0
+        self.cache = dict.fromkeys(CACHE_RESULTS, 0)
+
+
+class Collector:
+    '''
+    Thread safe per view aggregates of the requests of this process
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.views: Dict[str, ViewStats] = {}
+        self.interval: Dict[str, ViewStats] = {}
+        self.interval_start = time.monotonic()
+
+    def record(self, view: str, duration: float, status: int, sample: Optional[RequestSample]):
+        bucket = bisect.bisect_left(DURATION_BUCKETS, duration)
+        with self._lock:
+            for views in (self.views, self.interval):
+                stats = views.get(view)
+                if stats is None:
+                    stats = views[view] = ViewStats()
+                stats.requests += 1
+                stats.duration += duration
+                stats.buckets[bucket] += 1
+                if status >= 500:
+                    stats.errors += 1
+                if sample is not None:
+                    stats.sampled += 1
+                    stats.sql_count += sample.sql_count
+                    stats.sql_time += sample.sql_time
+                    stats.es_count += sample.es_count
+                    stats.es_time += sample.es_time
+                    for result, count in sample.cache.items():
+                        stats.cache[result] += count
+
+    def take_interval(self):
+        '''
+        The aggregates since the last call and the seconds they cover
+        '''
+        with self._lock:
+            interval, self.interval = self.interval, {}
+            now = time.monotonic()
+            seconds, self.interval_start = now - self.interval_start, now
+        return interval, seconds
+
+    def prometheus(self) -> str:
+        with self._lock:
+            views = {view: _copy(stats) for view, stats in self.views.items()}
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        def label(view, **extra):
+            labels = {"view": view, "pid": str(os.getpid()), **extra}
+            return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+        metric("aher_http_requests_total", "counter", "Requests per view", [f"aher_http_requests_total{label(v)} {s.requests}" for v, s in views.items()])
+        metric("aher_http_errors_total", "counter", "Requests per view answered with a 5xx status", [f"aher_http_errors_total{label(v)} {s.errors}" for v, s in views.items()])
+        samples = []
+        for v, s in views.items():
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, s.buckets):
+                cumulative += count
+                samples.append(f"aher_http_request_duration_seconds_bucket{label(v, le='+Inf' if bound == float('inf') else f'{bound:g}')} {cumulative}")
+            samples.append(f"aher_http_request_duration_seconds_sum{label(v)} {s.duration:.6f}")
+            samples.append(f"aher_http_request_duration_seconds_count{label(v)} {s.requests}")
+        metric("aher_http_request_duration_seconds", "histogram", "Request duration per view", samples)
+        metric("aher_http_sampled_requests_total", "counter", "Requests per view whose SQL, cache and elasticsearch use was recorded", [f"aher_http_sampled_requests_total{label(v)} {s.sampled}" for v, s in views.items()])
+        metric("aher_sql_queries_total", "counter", "SQL queries of the sampled requests", [f"aher_sql_queries_total{label(v)} {s.sql_count}" for v, s in views.items()])
+        metric("aher_sql_duration_seconds_total", "counter", "SQL time of the sampled requests", [f"aher_sql_duration_seconds_total{label(v)} {s.sql_time:.6f}" for v, s in views.items()])
+        metric("aher_cache_lookups_total", "counter", "Cache lookups of the sampled requests by result", [f"aher_cache_lookups_total{label(v, result=r)} {s.cache[r]}" for v, s in views.items() for r in CACHE_RESULTS])
+        metric("aher_elasticsearch_requests_total", "counter", "Elasticsearch requests of the sampled requests", [f"aher_elasticsearch_requests_total{label(v)} {s.es_count}" for v, s in views.items()])
+        metric("aher_elasticsearch_duration_seconds_total", "counter", "Elasticsearch time of the sampled requests", [f"aher_elasticsearch_duration_seconds_total{label(v)} {s.es_time:.6f}" for v, s in views.items()])
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _copy(stats: ViewStats) -> ViewStats:
+    copy = ViewStats()
+    copy.__dict__.update({key: (list(value) if isinstance(value, list) else dict(value) if isinstance(value, dict) else value) for key, value in stats.__dict__.items()})
+    return copy
+
+
+COLLECTOR = Collector()
+
+
+def record_cache(result: str):
+    '''
+    Counts a cache lookup of the current request if it is sampled, called by TieredCache
+    '''
+    sample = _CURRENT.get()
+    if sample is not None:
+        sample.cache[result] += 1
+
+
+def _sql_wrapper(execute, sql, params, many, context):
+    sample = _CURRENT.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.sql_count += 1
+        sample.sql_time += time.perf_counter() - start
+
+
+_ES_INSTRUMENTED = False
+_ES_LOCK = threading.Lock()
+
+
+def instrument_elasticsearch():
+    '''
+    Times the requests of the elasticsearch client, once per process
+    '''
+    global _ES_INSTRUMENTED
+    with _ES_LOCK:
+        if _ES_INSTRUMENTED:
+            return
+        _ES_INSTRUMENTED = True
+        try:
+            from elastic_transport import Transport
+        except ImportError:
+            logger.warning("elastic_transport is not installed, elasticsearch time is not recorded")
+            return
+
+        original = Transport.perform_request
+
+        @functools.wraps(original)
+        def perform_request(self, *args, **kwargs):
+            sample = _CURRENT.get()
+            if sample is None:
+                return original(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return original(self, *args, **kwargs)
+            finally:
+                sample.es_count += 1
+                sample.es_time += time.perf_counter() - start
+
+        Transport.perform_request = perform_request
+
+
+def log_summary(interval: Dict[str, ViewStats], seconds: float):
+    requests = sum(stats.requests for stats in interval.values())
+    if not requests:
+        return
+    sampled = sum(stats.sampled for stats in interval.values()) or 1
+    slowest = sorted(interval.items(), key=lambda item: item[1].duration, reverse=True)[:5]
+    logger.warning(
+        f"{requests} requests in {seconds:.0f}s ({requests / seconds:.1f}/s), "
+        f"{sum(s.errors for s in interval.values())} errors, "
+        f"mean {sum(s.duration for s in interval.values()) / requests * 1000:.1f}ms, "
+        f"per sampled request: {sum(s.sql_count for s in interval.values()) / sampled:.1f} queries "
+        f"{sum(s.sql_time for s in interval.values()) / sampled * 1000:.1f}ms sql "
+        f"{sum(s.es_time for s in interval.values()) / sampled * 1000:.1f}ms elasticsearch, "
+        f"cache {'/'.join(str(sum(s.cache[r] for s in interval.values())) for r in CACHE_RESULTS)} ({'/'.join(CACHE_RESULTS)}); "
+        f"most time: {', '.join(f'{view} {stats.duration:.1f}s/{stats.requests}' for view, stats in slowest)}"
+    )
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, "INSTRUMENTATION_SAMPLE_RATE", DEFAULT_SAMPLE_RATE)
+        self.log_interval = getattr(settings, "INSTRUMENTATION_LOG_INTERVAL", DEFAULT_LOG_INTERVAL)
+        instrument_elasticsearch()
+
+    def __call__(self, request):
+        sample = RequestSample() if self.sample_rate and random.random() < self.sample_rate else None
+        token = _CURRENT.set(sample)
+        start = time.perf_counter()
+        status = 500
+        try:
+            if sample is None:
+                response = self.get_response(request)
+            else:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(_sql_wrapper))
+                    response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            _CURRENT.reset(token)
+            match = getattr(request, "resolver_match", None)
+            view = (match.view_name or match._func_path) if match is not None else "unresolved"
+            COLLECTOR.record(view, time.perf_counter() - start, status, sample)
+            if self.log_interval and time.monotonic() - COLLECTOR.interval_start >= self.log_interval:
+                log_summary(*COLLECTOR.take_interval())
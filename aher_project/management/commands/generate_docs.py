@@ -1,10 +1,156 @@
 from django.core.management.base import BaseCommand
+from aher_project.management.commands.util import session
 from aher_project.management.commands.util.scraper import main as scraper_main
 
 class Command(BaseCommand):
     help = 'Generate documentation by scraping resources'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--celery',
+            action='store_true',
+            help='Queue the crawl as Celery tasks spread over the workers instead of running it here',
+        )
+        parser.add_argument(
+            '--source',
+            choices=['http', 'db'],
+            default='http',
+            help='Crawl the resources API over HTTP, or export straight from the database without the web tier',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of resources read per query with --source=db',
+        )
+        parser.add_argument(
+            '--output',
+            choices=['files', 'shards'],
+            default='files',
+            help='Write one JSON file per resource, or stream resources into JSON-lines shards with an index',
+        )
+        parser.add_argument(
+            '--shard-size',
+            type=int,
+            default=256,
+            help='Size in MB of a shard before the next one is started',
+        )
+        parser.add_argument(
+            '--compression',
+            choices=['gzip', 'zstd'],
+            default=None,
+            help='Compress the shards (zstd needs the zstandard package)',
+        )
+        parser.add_argument(
+            '--projections',
+            default=None,
+            help='JSON file of keys / paths to keep or drop per graph, keyed by graph id or name',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of threads fetching resources concurrently (1 = sequential)',
+        )
+        parser.add_argument(
+            '--max-in-flight',
+            type=int,
+            default=0,
+            help='Maximum number of resources being fetched at once (0 = twice the number of workers)',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Number of processes splitting the resource pages between them, each with --workers threads',
+        )
+        parser.add_argument(
+            '--pipeline',
+            action='store_true',
+            help='Stream page listings, resource fetches and writes through concurrent stages',
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=1000,
+            help='Number of resource ids / documents buffered between pipeline stages',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Carry on from the last page completed by an interrupted crawl',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only fetch and write resources that are new or have changed since the last crawl',
+        )
+        parser.add_argument(
+            '--no-plan',
+            action='store_true',
+            help='Walk the resource list until an empty page instead of working out its pages up front',
+        )
+        parser.add_argument(
+            '--stats-file',
+            default=None,
+            help='JSON-lines file progress records are appended to (default: crawl_stats.jsonl in the doc store)',
+        )
+        parser.add_argument(
+            '--report-interval',
+            type=float,
+            default=10,
+            help='Seconds between progress lines and stats records (0 = only once the crawl is done)',
+        )
+        parser.add_argument(
+            '--connect-timeout',
+            type=float,
+            default=session.CONNECT_TIMEOUT,
+            help='Seconds to wait for a connection to the server',
+        )
+        parser.add_argument(
+            '--read-timeout',
+            type=float,
+            default=session.READ_TIMEOUT,
+            help='Seconds to wait for the server to send data',
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=session.MAX_RETRIES,
+            help='Number of retries, with exponential backoff, for failed or 429/5xx requests',
+        )
+
     def handle(self, *args, **options):
+        if options['celery']:
+            from aher_project.tasks import generate_docs
+            result = generate_docs.delay(options={'incremental': options['incremental'], 'projections': options['projections']})
+            self.stdout.write(self.style.SUCCESS(f'Queued document generation as task {result.id}'))
+            return
+
         self.stdout.write('Starting document generation...')
-        scraper_main()
+        session.configure(
+            connect_timeout=options['connect_timeout'],
+            read_timeout=options['read_timeout'],
+            retries=options['retries'],
+        )
+        scraper_main(
+            workers=options['workers'],
+            max_in_flight=options['max_in_flight'],
+            pipeline=options['pipeline'],
+            queue_size=options['queue_size'],
+            resume=options['resume'],
+            incremental=options['incremental'],
+            source=options['source'],
+            batch_size=options['batch_size'],
+            output=options['output'],
+            shard_size_mb=options['shard_size'],
+            compression=options['compression'],
+            projections=options['projections'],
+            processes=options['processes'],
+            stats_file=options['stats_file'],
+            report_interval=options['report_interval'],
+            plan=not options['no_plan'],
+        )
+        if options['source'] == 'http':
+            self.stdout.write(session.STATS.summary())
         self.stdout.write(self.style.SUCCESS('Successfully generated documents'))
\ No newline at end of file
@@ -0,0 +1,276 @@
+import json
+import logging
+import multiprocessing
+import os
+
+import django
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from arches.app.models import models
+from arches.app.search.base_index import get_index
+from aher_project.search_indexes.batch_index import bulk_index
+
+CHECKPOINT_FILENAME = "reindex_{name}.json"
+RANGES_PER_PROCESS = 8 # resource id ranges per process, the checkpoint records finished ranges
+# index settings while the new index is loaded, restored once the load is done
+LOAD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+# the alias is not moved to a new index holding fewer documents than this share of the old
+# index's, or that prepared fewer than this share of the resources in the database
+MIN_COMPLETE = 0.9
+
+
+def _prefixed(name: str) -> str:
+    # the name elasticsearch knows an index by, see BaseIndex / SearchEngine
+    return f"{settings.ELASTICSEARCH_PREFIX}_{name}" if settings.ELASTICSEARCH_PREFIX else name
+
+
+def _graphids() -> List[str]:
+    # the graphs BaseIndex.reindex indexes
+    return [
+        str(graphid)
+        for graphid in models.GraphModel.objects.filter(isresource=True)
+        .exclude(graphid=settings.SYSTEM_SETTINGS_RESOURCE_MODEL_ID)
+        .values_list("graphid", flat=True)
+    ]
+
+
+def _resource_count(graphids: List[str]) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM resource_instances WHERE graphid = ANY(%s::uuid[])", [graphids])
+        return cursor.fetchone()[0]
+
+
+def _resource_ranges(graphids: List[str], ranges: int) -> List[List[Optional[str]]]:
+    '''
+    Splits the resources of graphs into ranges of about the same size
+
+    :return: [first id, id the range stops before] pairs, the last range is open ended
+    '''
+    total = _resource_count(graphids)
+    if not total:
+        return []
+    step = -(-total // ranges)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT resourceinstanceid FROM (
+                SELECT resourceinstanceid, row_number() OVER (ORDER BY resourceinstanceid) AS rn
+                FROM resource_instances
+                WHERE graphid = ANY(%s::uuid[])
+            ) r
+            WHERE (rn - 1) %% %s = 0
+            ORDER BY resourceinstanceid
+            """,
+            [graphids, step],
+        )
+        starts = [str(row[0]) for row in cursor.fetchall()]
+    return [[start, end] for start, end in zip(starts, starts[1:] + [None])]
+
+
+def _index_range(task) -> List:
+    '''
+    Indexes one resource id range into the new index, run in the worker processes
+    '''
+    name, version, graphids, start, end, batch_size = task
+    index = get_index(name)
+    index.index_name = version
+    resources = models.ResourceInstance.objects.filter(graph_id__in=graphids, resourceinstanceid__gte=start)
+    if end is not None:
+        resources = resources.filter(resourceinstanceid__lt=end)
+    return [start, bulk_index(index, resources.order_by("resourceinstanceid"), batch_size)]
+
+
+def _load_state(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_state(path: str, state: Dict):
+    # written aside and renamed, so an interrupted write cannot lose the checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _current_settings(se, index: str) -> Dict:
+    response = se.es.indices.get_settings(index=index, include_defaults=True)[index]
+    current = {}
+    for key in LOAD_SETTINGS:
+        value = response.get("settings", {}).get("index", {}).get(key)
+        if value is None:
+            value = response.get("defaults", {}).get("index", {}).get(key)
+        current[key] = value
+    return current
+
+
+def _check_complete(se, alias: str, index: str, graphids: List[str], prepared: int):
+    '''
+    Refuses a new index that looks incomplete, e.g. because the workers failed to
+    send their bulk requests, before the alias is moved to it
+
+    :param alias: The alias, or the index created by BaseIndex.prepare_index, searched now
+    :param index: The new index
+    :param prepared: The resources the workers prepared
+    '''
+    indexed = se.es.count(index=index)["count"]
+    resources = _resource_count(graphids)
+    if resources and (indexed == 0 or prepared < resources * MIN_COMPLETE):
+        raise CommandError(
+            f"{index} holds {indexed} documents of {prepared} resources prepared, "
+            f"but there are {resources} resources"
+        )
+    if se.es.indices.exists(index=alias):
+        current = se.es.count(index=alias)["count"]
+        if indexed < current * MIN_COMPLETE:
+            raise CommandError(f"{index} holds {indexed} documents, {alias} holds {current}")
+
+
+def _swap_alias(se, alias: str, index: str, keep_old: bool) -> List[str]:
+    '''
+    Points the alias at the new index in one atomic update
+
+    :return: The indexes the alias pointed at before
+    '''
+    actions = [{"add": {"index": index, "alias": alias}}]
+    old = []
+    if se.es.indices.exists_alias(name=alias):
+        old = [name for name in se.es.indices.get_alias(name=alias).keys() if name != index]
+        actions = [{"remove": {"index": name, "alias": alias}} for name in old] + actions
+    elif se.es.indices.exists(index=alias):
+        # the index as created by BaseIndex.prepare_index, replaced by the alias in the same update
+        actions.insert(0, {"remove_index": {"index": alias}})
+    se.es.indices.update_aliases(actions=actions)
+    if not keep_old:
+        for name in old:
+            se.es.indices.delete(index=name, ignore_unavailable=True)
+    return old
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild a custom index registered in ELASTICSEARCH_CUSTOM_INDEXES across worker processes. '
+        'The resources are loaded into a new versioned index which the index name is then aliased to, '
+        'so searches keep using the old index until the new one is complete. Resources saved during the '
+        'load are only indexed into the old index.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'name',
+            help='Name of the custom index, as in ELASTICSEARCH_CUSTOM_INDEXES',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Number of processes indexing resource id ranges concurrently',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Resources prepared together and documents per bulk request (default CUSTOM_INDEX_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Continue a reindex that failed or was interrupted, skipping the ranges it finished',
+        )
+        parser.add_argument(
+            '--checkpoint-dir',
+            default='.',
+            help='Directory of the checkpoint file recording the finished ranges',
+        )
+        parser.add_argument(
+            '--keep-old',
+            action='store_true',
+            help='Keep the previous index once the alias points at the new one',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Point the alias at the new index even if it holds clearly fewer documents than the old one',
+        )
+
+    def handle(self, *args, **options):
+        name = options['name']
+        processes = max(1, options['processes'])
+        if not any(index['name'] == name for index in settings.ELASTICSEARCH_CUSTOM_INDEXES):
+            raise CommandError(f"{name} is not in ELASTICSEARCH_CUSTOM_INDEXES")
+        index = get_index(name)
+        se = index.se
+        path = os.path.join(options['checkpoint_dir'], CHECKPOINT_FILENAME.format(name=name))
+
+        state = _load_state(path)
+        if state is not None and not (options['resume'] and se.es.indices.exists(index=_prefixed(state['index']))):
+            if options['resume']:
+                logging.warning(f"Index {state['index']} of the checkpoint is gone, starting again")
+            # an unfinished index of an earlier run is never aliased, so it can go
+            alias = _prefixed(name)
+            stale = _prefixed(state['index'])
+            if se.es.indices.exists(index=stale) and not se.es.indices.exists_alias(name=alias, index=stale):
+                se.es.indices.delete(index=stale)
+            state = None
+
+        if state is None:
+            graphids = _graphids()
+            index.index_name = f"{name}_v{datetime.now():%Y%m%d%H%M%S}"
+            index.prepare_index()
+            state = {
+                'index': index.index_name,
+                'graphids': graphids,
+                'settings': _current_settings(se, _prefixed(index.index_name)),
+                'ranges': _resource_ranges(graphids, processes * RANGES_PER_PROCESS),
+                'done': {},
+            }
+            _save_state(path, state)
+        else:
+            print(f"Resuming {state['index']}, {len(state['done'])} of {len(state['ranges'])} ranges done")
+
+        version = _prefixed(state['index'])
+        pending = [
+            (name, state['index'], state['graphids'], start, end, options['batch_size'])
+            for start, end in state['ranges']
+            if start not in state['done']
+        ]
+
+        se.es.indices.put_settings(index=version, settings={"index": LOAD_SETTINGS})
+        try:
+            if pending:
+                # spawned rather than forked, so no connection or elasticsearch client of ours is
+                # shared and it works the same everywhere. django is set up in each worker, from the
+                # DJANGO_SETTINGS_MODULE the workers inherit, before _index_range is loaded
+                context = multiprocessing.get_context("spawn")
+                with context.Pool(min(processes, len(pending)), initializer=django.setup) as pool:
+                    for start, count in pool.imap_unordered(_index_range, pending):
+                        state['done'][start] = count
+                        _save_state(path, state)
+                        print(f"{len(state['done'])} of {len(state['ranges'])} ranges done, {sum(state['done'].values())} resources")
+        except Exception as e:
+            raise CommandError(f"Reindexing {name} failed, run again with --resume to continue: {str(e)}")
+        finally:
+            se.es.indices.put_settings(index=version, settings={"index": state['settings']})
+
+        se.es.indices.refresh(index=version)
+        if not options['force']:
+            try:
+                _check_complete(se, _prefixed(name), version, state['graphids'], sum(state['done'].values()))
+            except CommandError as e:
+                # the checkpoint is kept, so the check can be overridden without indexing again
+                raise CommandError(
+                    f"Not pointing {_prefixed(name)} at an incomplete index, the old index is still used: {str(e)}. "
+                    f"Run again with --resume --force to use it anyway"
+                )
+        old = _swap_alias(se, _prefixed(name), version, options['keep_old'])
+        os.remove(path)
+        print(f"{_prefixed(name)} now points at {version}, {sum(state['done'].values())} resources indexed")
+        if old:
+            print(f"Previous index {'kept' if options['keep_old'] else 'deleted'}: {', '.join(old)}")
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+CHECKPOINT_FILENAME = "crawl_checkpoint.sqlite3"
+COMMIT_EVERY = 500 # resource records between commits
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page INTEGER PRIMARY KEY,
+    resources INTEGER NOT NULL,
+    completed TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resources (
+    resourceid TEXT PRIMARY KEY,
+    content_hash TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    updated TEXT NOT NULL
+);
+"""
+
+
+def content_hash(document: str) -> str:
+    return hashlib.sha1(document.encode("utf-8")).hexdigest()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Checkpoint:
+    '''
+    Persistent crawl state kept next to the documents in the doc store
+
+    Records which listing pages have been fully stored, so an interrupted crawl
+    can resume, and a content hash plus the HTTP validators (ETag /
+    Last-Modified) of every stored resource, so unchanged resources are skipped.
+    Safe to share between threads.
+
+    before_commit, e.g. the sink's flush, is called before every commit that records
+    pages or resources, so nothing recorded can still be sitting in a write buffer.
+    '''
+
+    def __init__(self, store_path: str, filename: str = CHECKPOINT_FILENAME, before_commit: Optional[Callable[[], None]] = None):
+        os.makedirs(store_path, exist_ok=True)
+        self.path = os.path.join(store_path, filename)
+        self.before_commit = before_commit
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def clear_pages(self):
+        '''
+        Forget page progress, called when a crawl starts over or runs to the end
+        '''
+        with self._lock:
+            self._connection.execute("DELETE FROM pages")
+            self._connection.commit()
+
+    def is_page_complete(self, page: int) -> bool:
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM pages WHERE page = ?", (page,)).fetchone() is not None
+
+    def mark_page_complete(self, page: int, resources: int):
+        if self.before_commit is not None:
+            self.before_commit()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages (page, resources, completed) VALUES (?, ?, ?)", (page, resources, _now())
+            )
+            self._connection.commit()
+            self._pending = 0
+
+    def resume_page(self, start_page: int) -> int:
+        '''
+        The first page at or after start_page that has not been completed
+        '''
+        with self._lock:
+            rows = self._connection.execute("SELECT page FROM pages WHERE page >= ? ORDER BY page", (start_page,))
+            page = start_page
+            for (completed,) in rows:
+                if completed != page:
+                    break
+                page += 1
+            return page
+
+    def counts(self) -> Dict[str, int]:
+        '''
+        The number of resources ever stored and the resources on the completed pages
+        '''
+        with self._lock:
+            resources = self._connection.execute("SELECT count(*) FROM resources").fetchone()[0]
+            completed = self._connection.execute("SELECT coalesce(sum(resources), 0) FROM pages").fetchone()[0]
+        return {"resources": resources, "completed": completed}
+
+    def get_resource(self, resourceid: str) -> Optional[Dict[str, str]]:
+        '''
+        The stored hash and validators for a resource, or None if it has never been stored
+        '''
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content_hash, etag, last_modified FROM resources WHERE resourceid = ?", (resourceid,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"content_hash": row[0], "etag": row[1], "last_modified": row[2]}
+
+    def record_resource(self, resourceid: str, document_hash: Optional[str], etag: Optional[str] = None, last_modified: Optional[str] = None):
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO resources (resourceid, content_hash, etag, last_modified, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(resourceid) DO UPDATE SET content_hash = COALESCE(excluded.content_hash, content_hash), "
+                "etag = excluded.etag, last_modified = excluded.last_modified, updated = excluded.updated",
+                (resourceid, document_hash, etag, last_modified, _now()),
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                if self.before_commit is not None:
+                    self.before_commit()
+                self._connection.commit()
+                self._pending = 0
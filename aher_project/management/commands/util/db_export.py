@@ -0,0 +1,143 @@
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.db.models import Max
+from arches.app.models import models
+from arches.app.models.resource import Resource
+from arches.app.models.tile import Tile
+from arches.app.utils.betterJSONSerializer import JSONSerializer
+from arches.app.utils.label_based_graph import LabelBasedGraph
+
+BATCH_SIZE = 500 # resources (and their tiles) loaded per query
+# the HTTP crawl is anonymous, so the database export only shows what anonymous users can read
+EXPORT_USERNAME = "anonymous"
+EXPORT_PERM = "read_nodegroup"
+
+
+def fetch_graphs_from_db() -> Dict[str, Dict[str, str]]:
+    '''
+    The same graph summaries as scraper.fetch_graphs, read from the database
+    '''
+    graphs = {}
+    for graph in models.GraphModel.objects.filter(isresource=True).exclude(name="Arches System Settings"):
+        graphs[str(graph.graphid)] = {
+            "graph_name": str(graph.name),
+            "graph_description": str(graph.description) if graph.description else None,
+        }
+    return graphs
+
+
+def _batches(iterable: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _last_edits(resourceids: List[str]) -> Dict[str, str]:
+    '''
+    The timestamp of the latest edit log entry of each resource, used as its last-edit marker
+    '''
+    edits = (
+        models.EditLog.objects.filter(resourceinstanceid__in=resourceids)
+        .values("resourceinstanceid")
+        .annotate(last_edit=Max("timestamp"))
+    )
+    return {edit["resourceinstanceid"]: edit["last_edit"].isoformat() for edit in edits}
+
+
+def _readable_tiles(tiles: List, user, readable: Dict) -> List:
+    '''
+    The tiles of nodegroups user can read, as Resource.load_tiles(user, perm) filters them
+
+    :param readable: The permission checked for each nodegroup so far, by nodegroup id, updated
+    '''
+    kept = []
+    for tile in tiles:
+        if tile.nodegroup_id is None:
+            continue
+        if tile.nodegroup_id not in readable:
+            readable[tile.nodegroup_id] = user.has_perm(EXPORT_PERM, tile.nodegroup)
+        if readable[tile.nodegroup_id]:
+            kept.append(tile)
+    return kept
+
+
+def iter_resource_documents(
+    graphids: Iterable[str],
+    batch_size: int = BATCH_SIZE,
+    is_unchanged=None,
+    is_batch_complete=None,
+) -> Iterator[Tuple[int, List[Tuple[str, Optional[Dict], Optional[str]]]]]:
+    '''
+    Streams resources out of the database in batches, building for each one the
+    same document that /resources/<id>?format=json returns to an anonymous user
+
+    Resources are read with a server side cursor and the tiles of a whole batch
+    are loaded in one query, so neither the web tier nor one query per resource
+    is involved.
+
+    :param graphids: The graphs to export resources of
+    :param batch_size: The number of resources loaded per query
+    :param is_unchanged: Optional callable taking a resource id and its last-edit marker,
+        returning True if the stored document is still up to date
+    :param is_batch_complete: Optional callable taking a batch number, returning True if
+        the batch was stored by an earlier, interrupted export
+    :return: Yields (batch number, [(resource id, document or None if unchanged, last-edit marker)])
+    '''
+    user = User.objects.get(username=EXPORT_USERNAME)
+    readable = {}
+    resources = (
+        Resource.objects.filter(graph_id__in=list(graphids))
+        .order_by("resourceinstanceid")
+        .iterator(chunk_size=batch_size)
+    )
+
+    for batch_number, batch in enumerate(_batches(resources, batch_size), start=1):
+        if is_batch_complete is not None and is_batch_complete(batch_number):
+            continue
+
+        resourceids = [str(resource.resourceinstanceid) for resource in batch]
+        last_edits = _last_edits(resourceids)
+        if is_unchanged is not None:
+            changed = [r for r in batch if not is_unchanged(str(r.resourceinstanceid), last_edits.get(str(r.resourceinstanceid)))]
+        else:
+            changed = batch
+
+        tiles = defaultdict(list)
+        batch_tiles = Tile.objects.filter(resourceinstance_id__in=[r.resourceinstanceid for r in changed]).select_related("nodegroup").order_by("sortorder")
+        # setting resource.tiles skips load_tiles, so its nodegroup permissions are applied here
+        for tile in _readable_tiles(batch_tiles, user, readable):
+            tiles[tile.resourceinstance_id].append(tile)
+
+        documents = []
+        changed_ids = {r.resourceinstanceid for r in changed}
+        for resource in batch:
+            resourceid = str(resource.resourceinstanceid)
+            if resource.resourceinstanceid not in changed_ids:
+                documents.append((resourceid, None, last_edits.get(resourceid)))
+                continue
+            resource_tiles = tiles.get(resource.resourceinstanceid)
+            document = {
+                "resourceinstanceid": resourceid,
+                "graph_id": str(resource.graph_id),
+                "legacyid": resource.legacyid,
+                "displayname": resource.displayname(),
+                "displaydescription": resource.displaydescription(),
+                "map_popup": resource.map_popup(),
+                "resource": {},
+            }
+            # LabelBasedGraph reloads the tiles itself, one query per resource, whenever the
+            # resource has none set, so a resource without readable tiles keeps its empty graph instead
+            if resource_tiles is not None:
+                resource.tiles = resource_tiles
+                document["resource"] = LabelBasedGraph.from_resource(
+                    resource, compact=True, hide_empty_nodes=False, user=user, perm=EXPORT_PERM
+                )
+            documents.append((resourceid, JSONSerializer().serializeToPython(document), last_edits.get(resourceid)))
+        yield batch_number, documents
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Callable, Dict, Mapping, Optional
+
+GRAPH_CACHE_FILENAME = "graph_cache.json"
+
+
+def freeze(graphs: Mapping[str, Mapping]) -> Mapping[str, Mapping]:
+    '''
+    A read only view of graphs keyed by graph id, safe to share between threads
+    '''
+    return MappingProxyType({graphid: MappingProxyType(dict(graph)) for graphid, graph in graphs.items()})
+
+
+def to_dict(graphs: Optional[Mapping[str, Mapping]]) -> Dict[str, Dict]:
+    '''
+    Plain dicts of frozen graphs, to pickle for worker processes or serialise for Celery tasks
+    '''
+    return {graphid: dict(graph) for graphid, graph in (graphs or {}).items()}
+
+
+def read_cache(store_path: str) -> Optional[Dict]:
+    path = os.path.join(store_path, GRAPH_CACHE_FILENAME)
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable graph cache {path}: {str(e)}")
+        return None
+    return cache if isinstance(cache, dict) and isinstance(cache.get("graphs"), dict) else None
+
+
+def write_cache(store_path: str, cache: Dict):
+    '''
+    Writes the cache through a temporary file, so concurrent readers never see half of it
+    '''
+    os.makedirs(store_path, exist_ok=True)
+    path = os.path.join(store_path, GRAPH_CACHE_FILENAME)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(cache, f)
+    os.replace(temporary, path)
+
+
+def load_graphs(store_path: str, url: str, fetch: Callable, parse: Callable[[list], Dict]) -> Dict[str, Dict]:
+    '''
+    The graphs from the cache in the doc store, revalidated against the server
+
+    The request carries the cached ETag / Last-Modified, so an unchanged graph list
+    costs a 304. Servers without validators send the list again, and if it hashes
+    the same as the cached one it is not even parsed. If the server cannot be
+    reached the cached graphs are used as they are.
+
+    :param store_path: The doc store the cache is kept in
+    :param url: The graph list URL
+    :param fetch: Called with the URL and headers=, returns the response or None on error
+    :param parse: Turns the decoded graph list into the graphs to keep, keyed by graph id
+    :return: The graphs keyed by graph id
+    '''
+    cache = read_cache(store_path)
+    headers = {}
+    if cache is not None:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+
+    response = fetch(url, headers=headers or None)
+    if response is not None and response.status_code == 304 and cache is not None:
+        return cache["graphs"]
+    if response is None or response.status_code != 200:
+        status = response.status_code if response is not None else "no response"
+        if cache is not None:
+            logging.warning(f"Error fetching graphs: code {status}, using the graphs cached on {cache.get('fetched')}")
+            return cache["graphs"]
+        logging.error(f"Error fetching graphs: code {status}")
+        return {}
+
+    content_hash = hashlib.sha1(response.content).hexdigest()
+    etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+    if cache is not None and cache.get("hash") == content_hash:
+        graphs = cache["graphs"]
+        if (etag, last_modified) == (cache.get("etag"), cache.get("last_modified")):
+            return graphs
+    else:
+        graphs = parse(response.json())
+
+    try:
+        write_cache(store_path, {
+            "etag": etag,
+            "last_modified": last_modified,
+            "hash": content_hash,
+            "fetched": datetime.now(timezone.utc).isoformat(),
+            "graphs": graphs,
+        })
+    except OSError as e:
+        logging.error(f"Error writing the graph cache: {str(e)}")
+    return graphs
@@ -0,0 +1,103 @@
+import logging
+from typing import Callable, Dict, NamedTuple, Optional
+
+# fields of a listing response or count endpoint giving the number of resources / pages
+TOTAL_FIELDS = ("count", "total", "totalItems", "total_results")
+LAST_PAGE_FIELDS = ("pages", "last_page", "num_pages", "total_pages")
+PAGE_SIZE_FIELDS = ("page_size", "per_page", "itemsPerPage")
+MAX_PROBE_PAGE = 1 << 40 # the galloping search gives up past this page
+
+
+class ListingPlan(NamedTuple):
+    '''
+    The extent of the resource listing, known before its pages are crawled
+    '''
+    page_size: int
+    last_page: int # 0 for an empty listing
+    total: int
+    source: str # where the plan came from: "count", "listing" or "probe"
+
+    @property
+    def last_page_size(self) -> int:
+        return self.total - (self.last_page - 1) * self.page_size if self.last_page else 0
+
+    def resources_from(self, start_page: int, limit: int = 0) -> int:
+        '''
+        The number of resources on the pages from start_page to the last one
+
+        :param start_page: The first page crawled
+        :param limit: The number of resources taken from each page, 0 for all of them
+        '''
+        if self.last_page < start_page:
+            return 0
+        per_page = min(limit, self.page_size) if limit > 0 else self.page_size
+        last = min(limit, self.last_page_size) if limit > 0 else self.last_page_size
+        return (self.last_page - start_page) * per_page + last
+
+
+def _first_int(data: Dict, fields) -> Optional[int]:
+    for field in fields:
+        value = data.get(field)
+        if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+            return value
+    return None
+
+
+def plan_from_response(data: Dict, page_size: Optional[int] = None, source: str = "listing") -> Optional[ListingPlan]:
+    '''
+    A plan from the total / last page fields of a listing or count response, if it has them
+
+    :param data: The decoded response
+    :param page_size: The number of resources on a full page, if the response does not say
+    :param source: Recorded in the plan
+    '''
+    if not isinstance(data, dict):
+        return None
+    page_size = _first_int(data, PAGE_SIZE_FIELDS) or page_size
+    if not page_size:
+        return None
+    total = _first_int(data, TOTAL_FIELDS)
+    last_page = _first_int(data, LAST_PAGE_FIELDS)
+    if total is None:
+        # a last page alone does not say how full it is
+        return None
+    if last_page is None:
+        last_page = -(-total // page_size)
+    return ListingPlan(page_size, last_page, total, source)
+
+
+def probe_last_page(count_page: Callable[[int], int], page_size: int) -> ListingPlan:
+    '''
+    Finds the last page of a listing without a total, by galloping (pages 2, 4, 8, ...)
+    until a page is not full and then binary searching between the last full page and it,
+    so about 2 * log2(pages) listing requests
+
+    :param count_page: Returns the number of resources on a page, 0 past the end
+    :param page_size: The number of resources on page 1
+    '''
+    if page_size == 0:
+        return ListingPlan(0, 0, 0, "probe")
+    full, page, size = 1, 2, None
+    while page < MAX_PROBE_PAGE:
+        size = count_page(page)
+        if size < page_size:
+            break
+        full, page = page, page * 2
+    else:
+        logging.error(f"Resource listing still full at page {page}, the last page was not found")
+        return ListingPlan(page_size, full, full * page_size, "probe")
+
+    # full is a full page, page the first one found that is not
+    last, last_size = (page, size) if size else (full, page_size)
+    low, high = full, page
+    while size == 0 and high - low > 1:
+        middle = (low + high) // 2
+        middle_size = count_page(middle)
+        if middle_size == page_size:
+            low, last, last_size = middle, middle, page_size
+        elif middle_size:
+            last, last_size = middle, middle_size
+            break
+        else:
+            high = middle
+    return ListingPlan(page_size, last, (last - 1) * page_size + last_size, "probe")
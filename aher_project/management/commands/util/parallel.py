@@ -0,0 +1,172 @@
+import glob
+import logging
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from aher_project.management.commands.util import graph_cache, scraper, session
+from aher_project.management.commands.util.sinks import SHARD_INDEX_FILENAME, SHARD_PREFIX
+from aher_project.management.commands.util.telemetry import TELEMETRY
+
+PAGES_PER_CLAIM = 1 # pages a worker process claims from the shared page counter at a time
+# worker processes are spawned, not forked: the parent has the telemetry reporter and maybe
+# other threads running, and a fork would copy whatever locks they hold. a spawned worker
+# starts from the module defaults, so the parent's settings are passed on in _scraper_state()
+START_METHOD = "spawn"
+
+
+def _worker_index_filename(worker: int) -> str:
+    return f"{os.path.splitext(SHARD_INDEX_FILENAME)[0]}-w{worker}.jsonl"
+
+
+def _scraper_state() -> Dict:
+    '''
+    The module settings of the parent's crawl that its worker processes need
+    '''
+    return {
+        "host_url": scraper.HOST_URL,
+        "doc_store_path": scraper.DOC_STORE_PATH,
+        "resource_limit": scraper.RESOURCE_LIMIT,
+        "stream_resources": scraper.STREAM_RESOURCES,
+        "session": session.settings(),
+    }
+
+
+def _setup_worker(worker: int, graphs: Dict, options: Dict, state: Dict):
+    '''
+    Sets up the scraper state of a worker process, which writes to its own shards
+    '''
+    # counters inherited from the parent if it was forked anyway would be reported twice
+    session.STATS.reset()
+    TELEMETRY.reset()
+    scraper.set_host(state["host_url"])
+    scraper.DOC_STORE_PATH = state["doc_store_path"]
+    scraper.RESOURCE_LIMIT = state["resource_limit"]
+    scraper.STREAM_RESOURCES = state["stream_resources"]
+    session.configure(**{**state["session"], "pool_size": max(state["session"]["pool_size"], options["workers"] + 1)})
+    scraper.GRAPH_DICT = graph_cache.freeze(graphs)
+    scraper.open_crawl_state(
+        incremental=options["incremental"],
+        output=options["output"],
+        shard_size_mb=options["shard_size_mb"],
+        compression=options["compression"],
+        projections=options["projections"],
+        shard_prefix=f"{SHARD_PREFIX}-w{worker}",
+        shard_index=_worker_index_filename(worker),
+    )
+
+
+def _crawl_worker(worker: int, graphs: Dict, options: Dict, state: Dict, next_page, end_page, progress, planned_last_page: int = 0):
+    '''
+    Claims blocks of pages from the shared counter and crawls them until a page
+    past the end of the resource list is found by any worker
+
+    The first empty page seen lowers the shared end_page, so every worker stops
+    claiming pages after it while pages before it are still crawled. Empty pages
+    up to planned_last_page, the last page of a planned listing, are skipped instead.
+    '''
+    _setup_worker(worker, graphs, options, state)
+    executor = ThreadPoolExecutor(max_workers=options["workers"], thread_name_prefix=f"scraper-{worker}") if options["workers"] > 1 else None
+    max_in_flight = options["max_in_flight"] if options["max_in_flight"] > 0 else options["workers"] * 2
+    try:
+        while True:
+            with next_page.get_lock():
+                first = next_page.value
+                next_page.value += PAGES_PER_CLAIM
+            if first >= end_page.value:
+                break
+            for page in range(first, first + PAGES_PER_CLAIM):
+                if page >= end_page.value:
+                    break
+                if scraper.CHECKPOINT.is_page_complete(page):
+                    continue
+                resources = scraper.page_crawler(page, "empty", executor=executor, max_in_flight=max_in_flight)
+                if not resources and page <= planned_last_page:
+                    continue
+                if not resources:
+                    with end_page.get_lock():
+                        end_page.value = min(end_page.value, page)
+                    break
+                progress.put(("page", worker, page, resources, TELEMETRY.counters()))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        scraper.close_crawl_state()
+        progress.put(("done", worker, session.STATS.as_dict(include_sample=True), TELEMETRY.counters(include_sample=True)))
+
+
+def _merge_shard_indexes(store_path: str):
+    '''
+    Appends the index of every worker's shards to the shared shard index
+    '''
+    pattern = os.path.join(store_path, f"{os.path.splitext(SHARD_INDEX_FILENAME)[0]}-w*.jsonl")
+    with open(os.path.join(store_path, SHARD_INDEX_FILENAME), "a") as index:
+        for worker_index in sorted(glob.glob(pattern)):
+            with open(worker_index) as f:
+                for line in f:
+                    index.write(line)
+            os.remove(worker_index)
+
+
+def run_processes(processes: int, start_page: int, max_pages: int, options: Dict, planned_last_page: int = 0) -> bool:
+    '''
+    Crawls the page space across worker processes, reporting their progress
+
+    :param processes: The number of worker processes
+    :param start_page: The first page to crawl
+    :param max_pages: The page number to stop before
+    :param options: The output, projection and threading options of the scraper's main()
+    :param planned_last_page: The last page of the listing if it was planned, see scraper.plan_listing
+    :return: True if every worker process finished cleanly
+    '''
+    context = multiprocessing.get_context(START_METHOD)
+    next_page = context.Value("q", start_page)
+    end_page = context.Value("q", max_pages)
+    progress = context.Queue()
+    # a leftover index from an interrupted run is merged before the new workers start writing
+    if options["output"] == "shards":
+        _merge_shard_indexes(scraper.DOC_STORE_PATH)
+
+    workers = [
+        context.Process(
+            target=_crawl_worker,
+            args=(worker, graph_cache.to_dict(scraper.GRAPH_DICT), options, _scraper_state(), next_page, end_page, progress, planned_last_page),
+            name=f"scraper-process-{worker}",
+        )
+        for worker in range(processes)
+    ]
+    for process in workers:
+        process.start()
+
+    pages = resources = 0
+    running = len(workers)
+    while running:
+        try:
+            message = progress.get(timeout=1)
+        except queue.Empty:
+            if not any(process.is_alive() for process in workers):
+                # a worker died without reporting, there is nothing left to wait for
+                break
+            continue
+        if message[0] == "page":
+            _, worker, page, count, counters = message
+            pages += 1
+            resources += count
+            TELEMETRY.update_remote(worker, counters)
+            print(f"Worker {worker} finished page {page} ({count} resources), {pages} pages / {resources} resources in total")
+        else:
+            running -= 1
+            session.STATS.merge(message[2])
+            TELEMETRY.update_remote(message[1], message[3])
+
+    for process in workers:
+        process.join()
+    if options["output"] == "shards":
+        _merge_shard_indexes(scraper.DOC_STORE_PATH)
+
+    failed = [process.name for process in workers if process.exitcode != 0]
+    if failed:
+        logging.error(f"Scraper processes failed: {', '.join(failed)}")
+    return not failed
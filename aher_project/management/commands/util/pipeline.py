@@ -0,0 +1,194 @@
+import logging
+import queue
+import threading
+from typing import Callable, List, Optional
+
+# placed on a queue to tell the consuming stage that its producers are done
+_DONE = object()
+
+# how often (seconds) blocked stages wake up to check whether the crawl was stopped
+_POLL_INTERVAL = 0.5
+
+
+class _PageTracker:
+    '''
+    Counts down the resources of each listed page so that a callback can be told
+    once every resource of a page has been written, skipped or has failed
+    '''
+
+    def __init__(self, on_page_complete: Optional[Callable[[int, int], None]]):
+        self._on_page_complete = on_page_complete
+        self._lock = threading.Lock()
+        self._remaining = {}
+        self._totals = {}
+
+    def add(self, page: int, count: int):
+        with self._lock:
+            self._remaining[page] = count
+            self._totals[page] = count
+
+    def done(self, page: int):
+        with self._lock:
+            self._remaining[page] -= 1
+            if self._remaining[page]:
+                return
+            del self._remaining[page]
+            total = self._totals.pop(page)
+        if self._on_page_complete is not None:
+            self._on_page_complete(page, total)
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    '''
+    Put an item on a bounded queue, giving up if the pipeline is stopped while waiting
+
+    :return: True if the item was queued
+    '''
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    '''
+    Get an item from a queue, returning _DONE if the pipeline is stopped while waiting
+    '''
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def _listing_stage(list_page: Callable[[int], List[str]], skip_page: Optional[Callable[[int], bool]], start_page: int, max_pages: int, ids: queue.Queue, tracker: _PageTracker, fetchers: int, stop: threading.Event):
+    '''
+    Streams resource ids page by page into the id queue until an empty page is found
+    '''
+    try:
+        page = start_page
+        while page < max_pages and not stop.is_set():
+            if skip_page is not None and skip_page(page):
+                page += 1
+                continue
+            print(f"Processing page {page}")
+            resources = list_page(page)
+            if not resources:
+                break
+            tracker.add(page, len(resources))
+            for resource in resources:
+                if not _put(ids, (page, resource), stop):
+                    return
+            page += 1
+    except Exception as e:
+        logging.error(f"Error listing resources on page {page}: {str(e)}")
+    finally:
+        for _ in range(fetchers):
+            _put(ids, _DONE, stop)
+
+
+def _log_error(resource: str, error: Exception):
+    logging.error(f"Error processing {resource}: {str(error)}")
+
+
+def _fetch_stage(build_document: Callable[[str], Optional[str]], ids: queue.Queue, documents: queue.Queue, tracker: _PageTracker, stop: threading.Event, on_error: Callable[[str, Exception], None]):
+    '''
+    Turns resource ids into documents, one resource failing never stops the stage
+    '''
+    try:
+        while True:
+            item = _get(ids, stop)
+            if item is _DONE:
+                break
+            page, resource = item
+            try:
+                document = build_document(resource)
+            except Exception as e:
+                on_error(resource, e)
+                document = None
+            if document is None:
+                tracker.done(page)
+            elif not _put(documents, (page, resource, document), stop):
+                break
+    finally:
+        _put(documents, _DONE, stop)
+
+
+def run_pipeline(
+    list_page: Callable[[int], List[str]],
+    build_document: Callable[[str], Optional[str]],
+    write_document: Callable[[str, str], None],
+    start_page: int,
+    max_pages: int,
+    workers: int = 1,
+    queue_size: int = 1000,
+    skip_page: Optional[Callable[[int], bool]] = None,
+    on_page_complete: Optional[Callable[[int, int], None]] = None,
+    on_error: Callable[[str, Exception], None] = _log_error,
+) -> int:
+    '''
+    Crawls resources as a listing -> fetch -> write pipeline
+
+    A single listing thread streams resource ids into a bounded queue ahead of the
+    fetch workers, so the next page listing overlaps with the current page's
+    resource fetches. Fetched documents are drained by the calling thread, which
+    is the only one writing to the doc store.
+
+    :param list_page: Returns the resource ids on a page, an empty list meaning the last page was passed
+    :param build_document: Returns the document to store for a resource id, or None to skip it
+    :param write_document: Stores a document, called with the resource id and the document
+    :param start_page: The first page to list
+    :param max_pages: The page number to stop before
+    :param workers: The number of fetch threads
+    :param queue_size: The maximum number of ids (and of documents) waiting between stages
+    :param skip_page: Returns True for pages that should not be listed, e.g. already crawled ones
+    :param on_page_complete: Called with the page number and its resource count once every resource on it is done
+    :param on_error: Called with the resource id and the exception when building or writing a document fails
+    :return: The number of documents written
+    '''
+    workers = max(workers, 1)
+    ids = queue.Queue(maxsize=queue_size)
+    documents = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    tracker = _PageTracker(on_page_complete)
+
+    threads = [
+        threading.Thread(
+            target=_listing_stage,
+            args=(list_page, skip_page, start_page, max_pages, ids, tracker, workers, stop),
+            name="scraper-listing",
+            daemon=True,
+        )
+    ]
+    threads += [
+        threading.Thread(target=_fetch_stage, args=(build_document, ids, documents, tracker, stop, on_error), name=f"scraper-fetch-{i}", daemon=True)
+        for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    written = 0
+    running = workers
+    try:
+        while running:
+            item = _get(documents, stop)
+            if item is _DONE:
+                running -= 1
+                continue
+            page, resource, document = item
+            try:
+                write_document(resource, document)
+                written += 1
+            except Exception as e:
+                on_error(resource, e)
+            tracker.done(page)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    return written
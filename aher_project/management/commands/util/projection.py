@@ -0,0 +1,132 @@
+"""
+Per graph projection of the documents written by the scraper.
+
+A projection config is a JSON file keyed by graph id or graph name:
+
+    {
+        "Monument": {
+            "drop": ["Geometry", "$.resource.Location Data.Geospatial Coordinates"]
+        },
+        "b9e0701e-5463-11e9-b5f5-000d3ab1e588": {
+            "keep": ["$.resource.Names", "$.resource.Descriptions"]
+        }
+    }
+
+"drop" lists keys to remove wherever they appear, or "$."-prefixed paths from
+the document root to remove. "keep", when given, lists the only paths kept
+besides the document fields in ALWAYS_KEEP. A path step into a list applies to
+every item of the list.
+"""
+
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from aher_project.management.commands.util.prune import IGNORE_KEYS, PRUNER, Pruner
+
+PATH_PREFIX = "$."
+ALWAYS_KEEP = frozenset({"resourceinstanceid", "graph_id", "graph_name", "displayname", "displaydescription", "document_url"})
+
+
+def _parse_path(path: str) -> Tuple[str, ...]:
+    return tuple(path[len(PATH_PREFIX):].split("."))
+
+
+def _drop_path(value: Any, path: Tuple[str, ...]) -> bool:
+    '''
+    Removes a path from a document in place
+
+    :return: True if value was emptied and should be removed from its parent
+    '''
+    if isinstance(value, list):
+        value[:] = [item for item in value if not _drop_path(item, path)]
+        return not value
+    if not isinstance(value, dict) or path[0] not in value:
+        return False
+    if len(path) == 1 or _drop_path(value[path[0]], path[1:]):
+        del value[path[0]]
+    return not value
+
+
+def _keep_paths(value: Any, tree: Dict) -> Any:
+    '''
+    Copies only the parts of a document that are in a tree of kept paths
+    '''
+    if not tree:
+        # the end of a kept path, everything below it is kept
+        return value
+    if isinstance(value, list):
+        return [kept for kept in (_keep_paths(item, tree) for item in value) if kept]
+    if not isinstance(value, dict):
+        return None
+    kept = {}
+    for key, subtree in tree.items():
+        if key in value:
+            child = _keep_paths(value[key], subtree)
+            if child:
+                kept[key] = child
+    return kept
+
+
+class GraphProjection:
+    '''
+    The compiled projection rules of one graph
+    '''
+
+    def __init__(self, drop: Iterable[str] = (), keep: Iterable[str] = ()):
+        drop = list(drop)
+        drop_keys = {key for key in drop if not key.startswith(PATH_PREFIX)}
+        self.drop_paths = [_parse_path(path) for path in drop if path.startswith(PATH_PREFIX)]
+        # prunes the graph's extra keys in the same walk as the default IGNORE_KEYS
+        self.pruner = Pruner(IGNORE_KEYS | drop_keys) if drop_keys else None
+        self.keep_tree = {}
+        for path in keep:
+            if not path.startswith(PATH_PREFIX):
+                raise ValueError(f"Kept paths must start with {PATH_PREFIX}: {path}")
+            node = self.keep_tree
+            for step in _parse_path(path):
+                node = node.setdefault(step, {})
+
+    def apply(self, data: Dict, pruned: bool = True) -> Dict:
+        '''
+        Projects a document
+
+        :param data: The document, changed in place
+        :param pruned: False if the document still needs the default pruning, which is then
+            done together with this graph's dropped keys
+        '''
+        if self.pruner is not None:
+            data = self.pruner.prune(data)
+        elif not pruned:
+            data = PRUNER.prune(data)
+        for path in self.drop_paths:
+            _drop_path(data, path)
+        if self.keep_tree:
+            kept = _keep_paths(data, self.keep_tree) or {}
+            data = {key: kept.get(key, value) for key, value in data.items() if key in kept or key in ALWAYS_KEEP}
+        return data
+
+
+def load_projections(path: str, graphs: Optional[Dict[str, Dict]] = None) -> Dict[str, GraphProjection]:
+    '''
+    Reads a projection config, keyed by graph id or name, into projections keyed by graph id
+
+    :param path: The JSON config file
+    :param graphs: The graphs from fetch_graphs, used to resolve graph names
+    :return: The compiled projection of each graph with rules
+    '''
+    with open(path) as f:
+        config = json.load(f)
+
+    graphs = graphs or {}
+    graphids_by_name = {graph["graph_name"]: graphid for graphid, graph in graphs.items()}
+    projections = {}
+    for graph, rules in config.items():
+        graphid = graph if graph in graphs else graphids_by_name.get(graph)
+        if graphid is None:
+            if graphs:
+                logging.warning(f"Projection rules for unknown graph {graph} are ignored")
+                continue
+            graphid = graph
+        projections[graphid] = GraphProjection(drop=rules.get("drop", []), keep=rules.get("keep", []))
+    return projections
@@ -0,0 +1,201 @@
+import json
+from typing import Any, BinaryIO, Dict, Iterable, List
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+IGNORE_KEYS = frozenset({
+    "valueid",
+    "concept_id",
+    "language_id",
+    "valuetype_id",
+    "instance_details",
+    "direction",
+    "Geospatial Coordinates",
+    "inverseOntologyProperty",
+    "ontologyProperty",
+    "resourceId",
+    "resourceXresourceId",
+    "legacyid",
+    "map_popup",
+    "concept_details",
+    "@display_value",
+})
+# keys containing any of these are dropped
+IGNORE_KEY_SUBSTRINGS = ("Metatype",)
+# string values treated as empty
+NULL_STRINGS = frozenset({"null", "Undefined"})
+# keys whose keep / drop decision is remembered, documents only use a few thousand distinct keys
+KEY_CACHE_SIZE = 100000
+STREAM_BUFFER_SIZE = 64 * 1024 # bytes read at a time by load_stream()
+
+
+class Pruner:
+    '''
+    Removes ignored keys and empty values from decoded JSON documents
+
+    Keeps the behaviour of the original recursive remove_empty_dict_items: a
+    dict entry is dropped if its key is ignored, or its value is empty once
+    pruned or one of NULL_STRINGS; a list item is dropped if it is empty once
+    pruned. Key decisions are computed once per distinct key, the walk uses an
+    explicit stack so deep tile trees cannot hit the recursion limit, and
+    loads() prunes while decoding so the unpruned tree is never built.
+    Safe to share between threads.
+    '''
+
+    def __init__(self, ignore_keys: Iterable[str] = IGNORE_KEYS, ignore_key_substrings: Iterable[str] = IGNORE_KEY_SUBSTRINGS):
+        self.ignore_keys = frozenset(ignore_keys)
+        self.ignore_key_substrings = tuple(ignore_key_substrings)
+        self._key_cache = {}
+
+    def keep_key(self, key) -> bool:
+        keep = self._key_cache.get(key)
+        if keep is None:
+            text = str(key)
+            keep = text not in self.ignore_keys and not any(s in text for s in self.ignore_key_substrings)
+            if len(self._key_cache) < KEY_CACHE_SIZE:
+                self._key_cache[key] = keep
+        return keep
+
+    def prune(self, value: Any) -> Any:
+        '''
+        Returns a pruned copy of a decoded JSON value
+        '''
+        if isinstance(value, dict):
+            root = {}
+            stack = [(iter(value.items()), root, True, None)]
+        elif isinstance(value, list):
+            root = []
+            stack = [(iter(value), root, False, None)]
+        else:
+            return value
+
+        keep_key = self.keep_key
+        while stack:
+            items, result, is_dict, result_key = stack[-1]
+            for item in items:
+                if is_dict:
+                    key, child = item
+                    if not keep_key(key):
+                        continue
+                else:
+                    key, child = None, item
+                if isinstance(child, dict):
+                    stack.append((iter(child.items()), {}, True, key))
+                    break
+                if isinstance(child, list):
+                    stack.append((iter(child), [], False, key))
+                    break
+                if not child:
+                    continue
+                if is_dict:
+                    if type(child) is str and child in NULL_STRINGS:
+                        continue
+                    result[key] = child
+                else:
+                    result.append(child)
+            else:
+                # every item of this container is done, hand it to its parent if anything is left
+                stack.pop()
+                if stack and result:
+                    parent, parent_is_dict = stack[-1][1], stack[-1][2]
+                    if parent_is_dict:
+                        parent[result_key] = result
+                    else:
+                        parent.append(result)
+        return root
+
+    def prune_list(self, values: List) -> List:
+        '''
+        Prunes a list whose dicts have already been pruned by object_pairs_hook
+        '''
+        return [v for v in (self.prune_list(v) if type(v) is list else v for v in values) if v]
+
+    def object_pairs_hook(self, pairs) -> Dict:
+        '''
+        json object_pairs_hook pruning every object as soon as it is decoded,
+        objects nested in it have already been pruned by the time it is called
+        '''
+        keep_key = self.keep_key
+        result = {}
+        for key, value in pairs:
+            if not keep_key(key):
+                continue
+            if type(value) is list:
+                value = self.prune_list(value)
+            if not value or (type(value) is str and value in NULL_STRINGS):
+                continue
+            result[key] = value
+        return result
+
+    def loads(self, data) -> Any:
+        '''
+        Decodes and prunes a JSON document in one pass
+        '''
+        value = json.loads(data, object_pairs_hook=self.object_pairs_hook)
+        if type(value) is list:
+            return self.prune_list(value)
+        return value
+
+    def load_stream(self, fp: BinaryIO, buf_size: int = STREAM_BUFFER_SIZE) -> Any:
+        '''
+        Decodes and prunes a JSON document while it is read from a file like object,
+        buf_size bytes at a time, with the same result as loads()
+
+        Ignored keys are skipped without building their values, so the unpruned document
+        is never held in memory, only the read buffer and the pruned document, which is
+        returned whole. Needs ijson.
+        '''
+        if ijson is None:
+            raise ImportError("ijson is not installed. Please install it using 'pip install ijson'")
+
+        keep_key = self.keep_key
+        # (container, is_dict, its key in the parent) of the containers being built
+        stack = []
+        root = None
+        key = None
+        skipping = 0 # depth of the ignored value being skipped, -1 while waiting for it to start
+
+        for event, value in ijson.basic_parse(fp, buf_size=buf_size, use_float=True):
+            if skipping:
+                if event == "start_map" or event == "start_array":
+                    skipping = 1 if skipping < 0 else skipping + 1
+                elif event == "end_map" or event == "end_array":
+                    skipping -= 1
+                elif skipping < 0:
+                    skipping = 0
+                continue
+
+            if event == "map_key":
+                if keep_key(value):
+                    key = value
+                else:
+                    skipping = -1
+                continue
+            if event == "start_map" or event == "start_array":
+                stack.append(({} if event == "start_map" else [], event == "start_map", key))
+                continue
+            if event == "end_map" or event == "end_array":
+                value, _, key = stack.pop()
+                if not stack:
+                    root = value
+                    continue
+            elif not stack:
+                return value
+
+            # a finished container or a scalar, added to its parent unless empty
+            parent, parent_is_dict, _ = stack[-1]
+            if not value:
+                continue
+            if parent_is_dict:
+                if type(value) is str and value in NULL_STRINGS:
+                    continue
+                parent[key] = value
+            else:
+                parent.append(value)
+        return root
+
+
+PRUNER = Pruner()
@@ -2,32 +2,59 @@ import shutil
 import os
 import json
 import logging
+import time
 import requests
-from typing import List, Dict
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Optional
+from aher_project.management.commands.util import graph_cache, session
+from aher_project.management.commands.util.checkpoint import Checkpoint, content_hash
+from aher_project.management.commands.util.listing import ListingPlan, plan_from_response, probe_last_page
+from aher_project.management.commands.util.pipeline import run_pipeline
+from aher_project.management.commands.util.projection import load_projections
+from aher_project.management.commands.util import prune
+from aher_project.management.commands.util.prune import PRUNER
+from aher_project.management.commands.util.sinks import SHARD_INDEX_FILENAME, SHARD_PREFIX, DirectorySink, ShardSink
+from aher_project.management.commands.util.telemetry import REPORT_INTERVAL, STATS_FILENAME, TELEMETRY, TelemetryReporter
 
 HOST_URL = "http://localhost:8000"
 GLHER_URL = "https://glher.historicengland.org.uk"
 RESOURCES_URL = f"{HOST_URL}/resources/?page="
 GRAPHS_URL = f"{HOST_URL}/graphs/?format=json"
+COUNT_URL = f"{HOST_URL}/resource-count"
 DOC_STORE_PATH = os.path.join(os.getcwd(), "doc_store")
 
+def set_host(host_url: str):
+    '''
+    Points the crawl at another Arches instance, e.g. a test server or a mock
+    '''
+    global HOST_URL, RESOURCES_URL, GRAPHS_URL, COUNT_URL
+    HOST_URL = host_url.rstrip("/")
+    RESOURCES_URL = f"{HOST_URL}/resources/?page="
+    GRAPHS_URL = f"{HOST_URL}/graphs/?format=json"
+    COUNT_URL = f"{HOST_URL}/resource-count"
+
 def save_to_doc(string_data, filename, extension=".txt"):
-    if not os.path.exists(DOC_STORE_PATH):
-        os.makedirs(DOC_STORE_PATH)
+    # exist_ok as several worker threads may race to create the store
+    os.makedirs(DOC_STORE_PATH, exist_ok=True)
     full_file_path = os.path.join(DOC_STORE_PATH, f"{filename}{extension}")
     with open(full_file_path, 'w') as f:
         f.write(string_data)
 
 
-def fetch_url(url: str) -> requests.Response:
+def fetch_url(url: str, headers: Optional[Dict[str, str]] = None, retries: Optional[int] = None, stream: bool = False) -> requests.Response:
     """
-    Fetch a URL using requests
+    Fetch a URL using the shared keep-alive session, retrying transient failures
     
     :param url: The URL to fetch
+    :param headers: Optional extra request headers
+    :param retries: The number of retries, the session's setting if None
+    :param stream: Return once the headers are received, the body is read from response.raw and the response must be closed
     :return: The response or None if there was an error
     """
     try:
-        response = requests.get(url)
+        response = session.get(url, headers=headers, retries=retries, stream=stream)
         return response
     except Exception as e:
         logging.error(f"Error fetching URL {url}: {str(e)}")
@@ -77,12 +104,16 @@ def fetch_url(url: str) -> requests.Response:
     #Chroma.from_texts(texts=index_chunk_lit, embedding=OLLAMA_EMBEDDINGS, persist_directory=CHROMA_STORE_PATH).persist()
 
 def fetch_graphs():
-    response = fetch_url(GRAPHS_URL)
-    if not response or response.status_code == 500:
-        logging.error("500 error fetching graphs")
-        return {}
-    
-    data = response.json()
+    '''
+    The resource graphs, from the graph cache in the doc store revalidated against
+    the server, see util/graph_cache.py
+    '''
+    return graph_cache.load_graphs(DOC_STORE_PATH, GRAPHS_URL, fetch_url, resource_graphs)
+
+def resource_graphs(data: List[Dict]) -> Dict[str, Dict]:
+    '''
+    The name and description of the resource graphs in the graph list, keyed by graph id
+    '''
     graphs = {}
     for graph in data:
         #if graph["isactive"] and graph["isresource"]:
@@ -94,39 +125,143 @@ def fetch_graphs():
                 }
     return graphs
 
-def fetch_resourceids(page: int):
+def fetch_listing(page: int, retries: Optional[int] = None) -> Optional[Dict]:
     url = f"{RESOURCES_URL}{page}"
     #print(url)
-    response = fetch_url(url)
-    print(f"fetching page {page}: {url}")
+    with TELEMETRY.phase("list"):
+        response = fetch_url(url, retries=retries)
     if not response or response.status_code == 500:
-        print(f"500 error fetching resource list for page {page}")
+        TELEMETRY.error(response.status_code if response is not None else "no response")
         logging.error(f"500 error fetching resource list for page {page}")
+        return None
+    return response.json()
+
+class ListingError(Exception):
+    '''
+    Raised by list_resourceids(strict=True) when a listing page could not be fetched
+    '''
+
+def fetch_resourceids(page: int, strict: bool = False):
+    data = fetch_listing(page)
+    if data is None:
+        if strict:
+            raise ListingError(f"Error listing resources on page {page}")
         return []
-    
-    data = response.json()
     #print(data)
     urls = data["ldp:contains"]
     return [url.split("/")[-1] for url in urls]
 
+def plan_listing() -> Optional[ListingPlan]:
+    '''
+    Works out how many resources and pages the resource list has before it is
+    crawled: from the count endpoint (views/resource_count.py), from total fields
+    in the first listing page, or else by probing for the last page
+
+    :return: The plan, or None if the first listing page could not be fetched
+    '''
+    response = fetch_url(COUNT_URL)
+    if response is not None and response.status_code == 200:
+        try:
+            plan = plan_from_response(response.json(), source="count")
+        except ValueError:
+            plan = None
+        if plan is not None:
+            return plan
+
+    data = fetch_listing(1)
+    if data is None:
+        return None
+    page_size = len(data.get("ldp:contains", []))
+    plan = plan_from_response(data, page_size=page_size or None)
+    if plan is not None:
+        return plan
+    # probed without retries: older Arches answer pages past the end with a 500, and a page
+    # wrongly taken as past the end only makes the crawl walk on from the planned last page
+    return probe_last_page(_count_listed, page_size)
+
+def _count_listed(page: int) -> int:
+    data = fetch_listing(page, retries=0)
+    return len(data["ldp:contains"]) if data else 0
+
+def add_document_fields(data: Dict, resourceinstanceid: str) -> Dict:
+    '''
+    Adds the graph name and public report URL to a resource document
+    '''
+    if GRAPH_DICT:
+        graphid = data["graph_id"]
+        if graphid in GRAPH_DICT:
+            data["graph_name"] = GRAPH_DICT[graphid]["graph_name"]
+    #data["document_url"] = f"{HOST_URL}/report/{resourceinstanceid}"
+    data["document_url"] = f"{GLHER_URL}/report/{resourceinstanceid}"
+    return data
+
+def _conditional_headers(resourceinstanceid: str) -> Optional[Dict[str, str]]:
+    '''
+    If-None-Match / If-Modified-Since headers from the validators stored for a resource
+    '''
+    if not INCREMENTAL or CHECKPOINT is None:
+        return None
+    stored = CHECKPOINT.get_resource(resourceinstanceid)
+    if not stored:
+        return None
+    headers = {}
+    if stored["etag"]:
+        headers["If-None-Match"] = stored["etag"]
+    if stored["last_modified"]:
+        headers["If-Modified-Since"] = stored["last_modified"]
+    return headers or None
+
 def fetch_resource(resourceinstanceid: str):
     url = f"{HOST_URL}/resources/{resourceinstanceid}?format=json"
     #print(url)
-    response = fetch_url(url)
+    streaming = STREAM_RESOURCES and prune.ijson is not None
+    # when streaming the body is read while it is parsed, so its download counts as parse time
+    with TELEMETRY.phase("fetch"):
+        response = fetch_url(url, headers=_conditional_headers(resourceinstanceid), stream=streaming)
+    try:
+        return read_resource(resourceinstanceid, response, streaming)
+    finally:
+        if streaming and response is not None:
+            response.close()
+
+def read_resource(resourceinstanceid: str, response: Optional[requests.Response], streaming: bool = False):
+    '''
+    The pruned resource of a resource response
+
+    :param resourceinstanceid: The resource instance id
+    :param response: The response, None if there was none
+    :param streaming: Parse the body while it is read from response.raw instead of buffering it
+    :return: The resource, UNCHANGED for a 304, or None on error
+    '''
+    if response is not None and response.status_code == 304:
+        TELEMETRY.resource_done("unchanged")
+        return UNCHANGED
     if not response or response.status_code != 200:
-        logging.error(f"Error fetching resource {resourceinstanceid}: code {response.status_code}")
+        status = response.status_code if response is not None else "no response"
+        TELEMETRY.error(status)
+        TELEMETRY.resource_done("failed")
+        logging.error(f"Error fetching resource {resourceinstanceid}: code {status}")
         return None
     
     try:
-        data = response.json()
-        if GRAPH_DICT:
-            graphid = data["graph_id"]
-            if graphid in GRAPH_DICT:
-                data["graph_name"] = GRAPH_DICT[graphid]["graph_name"]
-        #data["document_url"] = f"{HOST_URL}/report/{resourceinstanceid}"
-        data["document_url"] = f"{GLHER_URL}/report/{resourceinstanceid}"
+        # pruned while decoding so the unpruned resource is never built
+        with TELEMETRY.phase("parse"):
+            if streaming:
+                # and the raw body is not buffered either. the pruned resource is still built
+                # in memory and written to the sink once it is complete
+                data = PRUNER.load_stream(session.CountingReader(response))
+            else:
+                data = response.json(object_pairs_hook=PRUNER.object_pairs_hook)
+            data = add_document_fields(data, resourceinstanceid)
+        if CHECKPOINT is not None:
+            _PENDING[resourceinstanceid] = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
         return data
     except Exception as e:
+        TELEMETRY.error("parse")
+        TELEMETRY.resource_done("failed")
         logging.error(f"Error parsing JSON for resource {resourceinstanceid}: {str(e)}")
         return None
 
@@ -150,79 +285,194 @@ def fetch_resource(resourceinstanceid: str):
 #3            break
 #3    return chunks
 
-def page_crawler(page: int, store_path: str) -> bool:
+def build_document(resource: str) -> Optional[str]:
     '''
-    Fetches resources from a given page and stores them in the vector store
-    
-    :param page: The page number to fetch resources from
-    :param store_path: The path to the vector store
-    :return: True if resources were fetched and stored successfully, False meaning max page reached
-    
+    Fetches a single resource and prunes it into the JSON document to store
+
+    :param resource: The resource instance id
+    :return: The JSON document, or None if the resource could not be fetched
     '''
-    resources = fetch_resourceids(page)
+    _STARTED[resource] = time.perf_counter()
+    data = fetch_resource(resource)
+    if data is UNCHANGED or not data:
+        _STARTED.pop(resource, None)
+        return None
+    document = prepare_document(resource, data, pruned=True)
+    if document is None:
+        _STARTED.pop(resource, None)
+    return document
+
+def prepare_document(resource: str, data: Dict, pruned: bool = False) -> Optional[str]:
+    '''
+    Prunes a resource into the JSON document to store
+
+    :param resource: The resource instance id
+    :param data: The resource as returned by the API
+    :param pruned: True if data was already pruned while it was decoded
+    :return: The JSON document, or None if it matches the stored one in an incremental crawl
+    '''
+    with TELEMETRY.phase("prune"):
+        projection = PROJECTIONS.get(data.get("graph_id"))
+        if projection is not None:
+            data = projection.apply(data, pruned=pruned)
+        elif not pruned:
+            data = remove_empty_dict_items(data)
+        #print(data)
+        document = json.dumps(data)
+        document_hash = content_hash(document) if CHECKPOINT is not None else None
+
+    if CHECKPOINT is not None:
+        pending = _PENDING.setdefault(resource, {"etag": None, "last_modified": None})
+        pending["content_hash"] = document_hash
+        if INCREMENTAL:
+            stored = CHECKPOINT.get_resource(resource)
+            if stored and stored["content_hash"] == pending["content_hash"]:
+                # the stored document is already up to date, only refresh its validators
+                del _PENDING[resource]
+                CHECKPOINT.record_resource(resource, None, pending["etag"], pending["last_modified"])
+                TELEMETRY.resource_done("unchanged")
+                return None
+    return document
+
+def write_document(resource: str, document: str):
+    with TELEMETRY.phase("write"):
+        SINK.write(resource, document)
+        if CHECKPOINT is not None:
+            # recorded only once the document is written, and the checkpoint flushes the sink to
+            # disk before committing, so a document lost to a crash is never recorded as stored
+            pending = _PENDING.pop(resource, {})
+            CHECKPOINT.record_resource(resource, pending.get("content_hash"), pending.get("etag"), pending.get("last_modified"))
+    TELEMETRY.resource_done("written")
+    started = _STARTED.pop(resource, None)
+    if started is not None:
+        TELEMETRY.resource_latency(time.perf_counter() - started)
+    #stringData = convert_json_to_report(stringData)
+    #save_to_doc(stringData, f"{resource}")
+    #chunks = chunk_data(stringData, 1000, 200)
+    #chunks = chunk_data(stringData, 0, 0)
+    #for chunk in chunks:
+    #    text_chunks.append(chunk)
+    #if text_chunks:
+        #Chroma.from_texts(texts=text_chunks, embedding=OLLAMA_EMBEDDINGS, persist_directory=store_path).persist()
+
+def process_resource(resource: str) -> bool:
+    '''
+    Fetches a single resource, prunes it and stores it in the doc store
+
+    Errors are logged and swallowed so one bad resource never stops the crawl
+
+    :param resource: The resource instance id
+    :return: True if the resource was stored, False otherwise
+    '''
+    try:
+        document = build_document(resource)
+        if document is not None:
+            write_document(resource, document)
+            return True
+    except Exception as e:
+        resource_failed(resource, e)
+    return False
+
+def resource_failed(resource: str, error: Exception):
+    '''
+    Logs and counts a resource that failed with an unexpected error
+    '''
+    _STARTED.pop(resource, None)
+    TELEMETRY.error(type(error).__name__)
+    TELEMETRY.resource_done("failed")
+    logging.error(f"Error processing {resource}: {str(error)}")
+
+def process_resources_concurrently(resources: List[str], executor: ThreadPoolExecutor, max_in_flight: int) -> int:
+    '''
+    Runs process_resource for each resource on the executor, never holding more
+    than max_in_flight resources (and so responses) in memory at once
+
+    :param resources: The resource instance ids to process
+    :param executor: The worker pool to run on
+    :param max_in_flight: The maximum number of submitted but unfinished resources
+    :return: The number of resources stored
+    '''
+    stored = 0
+    pending = set()
+    for resource in resources:
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            stored += sum(1 for future in done if future.result())
+        pending.add(executor.submit(process_resource, resource))
+    done, _ = wait(pending)
+    stored += sum(1 for future in done if future.result())
+    return stored
+
+def list_resourceids(page: int, strict: bool = False) -> List[str]:
+    '''
+    Lists the resource ids to crawl on a page, trimmed to RESOURCE_LIMIT
+
+    :param page: The page number to list
+    :param strict: Raise ListingError if the page could not be fetched, rather than
+        treating it as past the end (older Arches answer those pages with a 500)
+    :return: The resource ids, an empty list meaning max page reached
+    '''
+    resources = fetch_resourceids(page, strict=strict)
 
     if not resources:
         logging.error(f"No resources found on page {page}")
-        return False
+        return []
 
     # if RESOURCE_LIMIT is great than 0 then trim the resources list to the limit
     if RESOURCE_LIMIT > 0:
         resources = resources[:RESOURCE_LIMIT]
+    return resources
 
-    for resource in resources:
-        try:
-            #text_chunks = [] 
-            data = fetch_resource(resource)
-            if data:
-                data = remove_empty_dict_items(data)
-                #print(data)
-                stringData = json.dumps(data)
-                save_to_doc(stringData, f"{resource}", extension=".json") 
-                #stringData = convert_json_to_report(stringData)
-                #save_to_doc(stringData, f"{resource}")
-                #chunks = chunk_data(stringData, 1000, 200)
-                #chunks = chunk_data(stringData, 0, 0)
-                #for chunk in chunks:
-                #    text_chunks.append(chunk)
-            
-            #if text_chunks:
-                #Chroma.from_texts(texts=text_chunks, embedding=OLLAMA_EMBEDDINGS, persist_directory=store_path).persist()
-        except Exception as e:
-            logging.error(f"Error processing {resource}: {str(e)}")
-            continue
+def page_crawler(page: int, store_path: str, executor: Optional[ThreadPoolExecutor] = None, max_in_flight: int = 0, resources: Optional[List[str]] = None) -> int:
+    '''
+    Fetches resources from a given page and stores them in the vector store
+    
+    :param page: The page number to fetch resources from
+    :param store_path: The path to the vector store
+    :param executor: Optional worker pool, resources are fetched one after another without it
+    :param max_in_flight: The maximum number of resources in flight on the executor
+    :param resources: The resource ids on the page if it was already listed
+    :return: The number of resources on the page, 0 meaning max page reached
+    
+    '''
+    if resources is None:
+        resources = list_resourceids(page)
+
+    if not resources:
+        return 0
 
-    return True
+    if executor is None:
+        for resource in resources:
+            process_resource(resource)
+    else:
+        process_resources_concurrently(resources, executor, max_in_flight)
+
+    if CHECKPOINT is not None:
+        CHECKPOINT.mark_page_complete(page, len(resources))
+    TELEMETRY.page_done(page, len(resources))
+    return len(resources)
 
 
 GRAPH_DICT = None
 
-IGNORE_KEYS = [
-        "valueid",
-        "concept_id",
-        "language_id",
-        "valueid",
-        "valuetype_id",
-        "instance_details",
-        "direction",
-        "Geospatial Coordinates",
-        "inverseOntologyProperty",
-        "ontologyProperty",
-        "resourceId",
-        "resourceXresourceId",
-        "legacyid",
-        "map_popup",
-        "concept_details",
-        "@display_value"
-]
+# crawl state shared with the fetching threads, set up by main()
+SINK = None
+CHECKPOINT = None
+# per graph projection rules keyed by graph id
+PROJECTIONS = {}
+INCREMENTAL = False
+# validators and hashes of fetched resources waiting to be written, keyed by resource id
+_PENDING = {}
+# when the fetch of each resource in progress started, for its latency once written
+_STARTED = {}
+# returned by fetch_resource when the server reports the resource as not modified
+UNCHANGED = object()
+
 def remove_empty_dict_items(d: Dict):
     '''
-    Remove empty items from a dictionary
+    Remove empty items and IGNORE_KEYS from a dictionary
     '''
-    if not isinstance(d, (dict, list)):
-        return d
-    if isinstance(d, list):
-        return [v for v in (remove_empty_dict_items(v) for v in d) if v]
-    return {k: v for k, v in ((k, remove_empty_dict_items(v)) for k, v in d.items()) if v and not k in IGNORE_KEYS and v not in ["null", "Undefined"] and "Metatype" not in str(k)}
+    return PRUNER.prune(d)
             
 
 #def convert_json_to_report(document_content: str):
@@ -266,12 +516,13 @@ def remove_empty_dict_items(d: Dict):
 #    return OLLAMA_SUMMARIZER.predict(prompt)
 
 
-def run_graph_crawler(store_path: str):
+def run_graph_crawler(store_path: str, graph_fetcher=fetch_graphs):
     '''
     Fetch information about the graphs and store them in the vector store
     '''
     global GRAPH_DICT
-    GRAPH_DICT = fetch_graphs()
+    # read only, so the fetching threads and worker processes can share it as it is
+    GRAPH_DICT = graph_cache.freeze(graph_fetcher())
 
     if not GRAPH_DICT:
         logging.error("No graphs found")
@@ -280,7 +531,7 @@ def run_graph_crawler(store_path: str):
     for graphid, graph in GRAPH_DICT.items():
         try:
             #text_chunks = []
-            stringData = json.dumps(graph)
+            stringData = json.dumps(dict(graph))
             save_to_doc(stringData, f"graph_{graphid}", extension=".json")
             #chunks = chunk_data(stringData, 1000, 200) # modded to just do the whole document.
             #    text_chunks.append(chunk)
@@ -304,22 +555,283 @@ START_PAGE = 1
 #MAX_PAGES = 1
 MAX_PAGES = 9999999999
 RESOURCE_LIMIT = 0 # 0 = no limit
+WORKERS = 1 # 1 = fetch resources one after another
+MAX_IN_FLIGHT = 0 # 0 = twice the number of workers
+QUEUE_SIZE = 1000 # ids / documents buffered between pipeline stages
+DB_BATCH_SIZE = 500 # resources read per query when exporting straight from the database
+SHARD_SIZE_MB = 256 # size of a JSON-lines shard before the next one is started
+LISTING_AHEAD = 4 # pages listed ahead of the one being crawled when the last page is known
+STREAM_RESOURCES = True # parse resources while they are downloaded, when ijson is installed
+
+def main(workers: int = WORKERS, max_in_flight: int = MAX_IN_FLIGHT, pipeline: bool = False, queue_size: int = QUEUE_SIZE, resume: bool = False, incremental: bool = False, source: str = "http", batch_size: int = DB_BATCH_SIZE, output: str = "files", shard_size_mb: int = SHARD_SIZE_MB, compression: Optional[str] = None, projections: Optional[str] = None, processes: int = 1, stats_file: Optional[str] = None, report_interval: float = REPORT_INTERVAL, plan: bool = True):
+    '''
+    Crawls the graphs and every resource into the doc store
+
+    :param workers: The number of threads fetching resources
+    :param max_in_flight: The maximum number of resources being fetched at once
+    :param pipeline: Overlap page listing, fetching and writing in separate stages
+    :param queue_size: The number of ids / documents buffered between pipeline stages
+    :param resume: Carry on from the pages completed by an interrupted crawl
+    :param incremental: Only fetch and write resources that are new or have changed since the last crawl
+    :param source: "http" to crawl the API of HOST_URL, "db" to read straight from the database (needs Django set up)
+    :param batch_size: The number of resources read per query from the database
+    :param output: "files" for one JSON file per resource, "shards" for JSON-lines shards with an index
+    :param shard_size_mb: The size of a shard before the next one is started
+    :param compression: None, "gzip" or "zstd" compression of the shards
+    :param projections: Path of a JSON file of per graph keys / paths to keep or drop
+    :param processes: The number of processes splitting the pages between them, each with its own shards
+    :param stats_file: Path of the JSON-lines file progress records are appended to, STATS_FILENAME in the doc store by default
+    :param report_interval: Seconds between progress lines and records, 0 to only report once the crawl is done
+    :param plan: Work out the number of pages up front (see plan_listing) rather than walking the list until an empty page
+    '''
+    if processes > 1 and (source == "db" or pipeline):
+        raise ValueError("Multiple processes can only be used with the page by page HTTP crawl")
+
+    if STREAM_RESOURCES and prune.ijson is None and source == "http":
+        logging.warning("ijson is not installed so every resource is buffered whole before it is parsed. Please install it using 'pip install ijson'")
+
+    TELEMETRY.reset()
+    reporter = TelemetryReporter(stats_file or os.path.join(DOC_STORE_PATH, STATS_FILENAME), report_interval)
+    reporter.start()
+    try:
+        crawl(workers, max_in_flight, pipeline, queue_size, resume, incremental, source, batch_size, output, shard_size_mb, compression, projections, processes, plan)
+    finally:
+        reporter.stop()
 
-def main():
+def crawl(workers: int, max_in_flight: int, pipeline: bool, queue_size: int, resume: bool, incremental: bool, source: str, batch_size: int, output: str, shard_size_mb: int, compression: Optional[str], projections: Optional[str], processes: int, plan: bool):
+    '''
+    The crawl run by main(), see there for the parameters
+    '''
        
     #scrape_index_page()
 
     #run_graph_crawler("CHROMA_STORE_PATH")
-    run_graph_crawler("empty")
-
-    page = START_PAGE
-    #while page <= MAX_PAGES and page_crawler(page, CHROMA_STORE_PATH):
-    while page < MAX_PAGES:
-        print(f"Processing page {page}")
-        ret = page_crawler(page, "empty")
-        page += 1
-        if not ret:
-            break
+    if source == "db":
+        # imported here so that the HTTP crawl can still run without Django
+        from aher_project.management.commands.util.db_export import fetch_graphs_from_db
+        run_graph_crawler("empty", graph_fetcher=fetch_graphs_from_db)
+    else:
+        # one keep-alive connection per thread that can be fetching at the same time
+        session.configure(pool_size=max(session.POOL_SIZE, workers + 1))
+        run_graph_crawler("empty")
+
+    listing_plan = plan_listing() if plan and source == "http" else None
+    if listing_plan is not None:
+        print(f"{listing_plan.total} resources on {listing_plan.last_page} pages of {listing_plan.page_size} (from the {listing_plan.source})")
+
+    if processes > 1:
+        crawl_with_processes(processes, resume, listing_plan, {
+            "workers": workers,
+            "max_in_flight": max_in_flight,
+            "incremental": incremental,
+            "output": output,
+            "shard_size_mb": shard_size_mb,
+            "compression": compression,
+            "projections": projections,
+        })
+        return
+
+    open_crawl_state(incremental=incremental, output=output, shard_size_mb=shard_size_mb, compression=compression, projections=projections)
+    if resume:
+        start_page = CHECKPOINT.resume_page(START_PAGE)
+        print(f"Resuming from page {start_page}")
+    else:
+        CHECKPOINT.clear_pages()
+        start_page = START_PAGE
+    set_expected_total(CHECKPOINT, listing_plan)
+
+    try:
+        if source == "db":
+            export_from_db(batch_size)
+        elif pipeline:
+            run_pipeline(
+                list_resourceids,
+                build_document,
+                write_document,
+                start_page,
+                MAX_PAGES,
+                workers=workers,
+                queue_size=queue_size,
+                skip_page=CHECKPOINT.is_page_complete,
+                on_page_complete=page_complete,
+                on_error=resource_failed,
+            )
+        else:
+            crawl_pages(start_page, workers, max_in_flight, listing_plan)
+        # the crawl reached the end of the resource list so there is nothing left to resume
+        CHECKPOINT.clear_pages()
+    finally:
+        close_crawl_state()
+
+def open_crawl_state(incremental: bool = False, output: str = "files", shard_size_mb: int = SHARD_SIZE_MB, compression: Optional[str] = None, projections: Optional[str] = None, shard_prefix: str = SHARD_PREFIX, shard_index: str = SHARD_INDEX_FILENAME):
+    '''
+    Sets up the output, checkpoint and projections used while crawling, once GRAPH_DICT is loaded
+
+    :param incremental: Only write resources that are new or have changed since the last crawl
+    :param output: "files" for one JSON file per resource, "shards" for JSON-lines shards with an index
+    :param shard_size_mb: The size of a shard before the next one is started
+    :param compression: None, "gzip" or "zstd" compression of the shards
+    :param projections: Path of a JSON file of per graph keys / paths to keep or drop
+    :param shard_prefix: The file name prefix of the shards written
+    :param shard_index: The file name of the shard index written
+    '''
+    global CHECKPOINT, INCREMENTAL, SINK, PROJECTIONS
+    PROJECTIONS = load_projections(projections, GRAPH_DICT) if projections else {}
+    if output == "shards":
+        SINK = ShardSink(DOC_STORE_PATH, compression=compression, shard_size=shard_size_mb * 1024 * 1024, prefix=shard_prefix, index_filename=shard_index)
+    else:
+        SINK = DirectorySink(DOC_STORE_PATH)
+    CHECKPOINT = Checkpoint(DOC_STORE_PATH, before_commit=SINK.flush)
+    INCREMENTAL = incremental
+
+def set_expected_total(checkpoint: Checkpoint, plan: Optional[ListingPlan] = None):
+    '''
+    Sets the total for the ETA from the listing plan, or else estimates it from the
+    resources stored by earlier crawls, counting the pages already completed when resuming
+    '''
+    counts = checkpoint.counts()
+    if plan is not None:
+        TELEMETRY.set_total(plan.resources_from(START_PAGE, RESOURCE_LIMIT), resumed=counts["completed"])
+    elif counts["resources"]:
+        TELEMETRY.set_total(counts["resources"], estimated=True, resumed=counts["completed"])
+
+def page_complete(page: int, resources: int):
+    CHECKPOINT.mark_page_complete(page, resources)
+    TELEMETRY.page_done(page, resources)
+
+def close_crawl_state():
+    '''
+    Flushes and closes what open_crawl_state set up
+    '''
+    global CHECKPOINT, INCREMENTAL, SINK, PROJECTIONS
+    try:
+        if SINK is not None:
+            SINK.close()
+        if CHECKPOINT is not None:
+            CHECKPOINT.close()
+    finally:
+        SINK = None
+        CHECKPOINT = None
+        INCREMENTAL = False
+        PROJECTIONS = {}
+        _PENDING.clear()
+
+def crawl_with_processes(processes: int, resume: bool, plan: Optional[ListingPlan], options: Dict):
+    '''
+    Crawls the pages across worker processes, see util/parallel.py
+
+    :param processes: The number of worker processes
+    :param resume: Carry on from the pages completed by an interrupted crawl
+    :param plan: The extent of the listing if it is known
+    :param options: The threading, output and projection options passed to main()
+    '''
+    from aher_project.management.commands.util.parallel import run_processes
+
+    checkpoint = Checkpoint(DOC_STORE_PATH)
+    try:
+        if resume:
+            start_page = checkpoint.resume_page(START_PAGE)
+            print(f"Resuming from page {start_page}")
+        else:
+            checkpoint.clear_pages()
+            start_page = START_PAGE
+        set_expected_total(checkpoint, plan)
+        if run_processes(processes, start_page, MAX_PAGES, options, planned_last_page=plan.last_page if plan is not None else 0):
+            checkpoint.clear_pages()
+    finally:
+        checkpoint.close()
+
+def export_from_db(batch_size: int):
+    '''
+    Exports every resource of the crawled graphs straight from the database
+
+    Batches take the place of pages in the checkpoint, and in an incremental
+    export the latest edit log timestamp is the last-edit marker, so unchanged
+    resources are not even built.
+
+    :param batch_size: The number of resources read per query
+    '''
+    from aher_project.management.commands.util.db_export import iter_resource_documents
+
+    def is_unchanged(resource: str, last_edit: Optional[str]) -> bool:
+        if not INCREMENTAL or last_edit is None:
+            return False
+        stored = CHECKPOINT.get_resource(resource)
+        return bool(stored and stored["last_modified"] == last_edit)
+
+    batches = iter_resource_documents(GRAPH_DICT.keys(), batch_size, is_unchanged=is_unchanged, is_batch_complete=CHECKPOINT.is_page_complete)
+    for batch_number, documents in batches:
+        print(f"Processing batch {batch_number}")
+        for resource, data, last_edit in documents:
+            if data is None:
+                TELEMETRY.resource_done("unchanged")
+                continue
+            try:
+                _PENDING[resource] = {"etag": None, "last_modified": last_edit}
+                document = prepare_document(resource, add_document_fields(data, resource))
+                if document is not None:
+                    write_document(resource, document)
+            except Exception as e:
+                resource_failed(resource, e)
+        page_complete(batch_number, len(documents))
+
+def crawl_pages(start_page: int, workers: int, max_in_flight: int, plan: Optional[ListingPlan] = None):
+    '''
+    Crawls pages one after another until the end of the resource list
+
+    :param start_page: The first page to crawl
+    :param workers: The number of threads fetching the resources of a page
+    :param max_in_flight: The maximum number of resources being fetched at once
+    :param plan: The extent of the listing if it is known, its pages are then listed ahead of being crawled
+    '''
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scraper") if workers > 1 else None
+    if max_in_flight <= 0:
+        max_in_flight = workers * 2
+
+    try:
+        page = start_page
+        if plan is not None:
+            crawl_planned_pages(start_page, plan, executor, max_in_flight)
+            # carries on past the planned pages in case resources were added since, normally one empty page
+            page = max(start_page, plan.last_page + 1)
+        #while page <= MAX_PAGES and page_crawler(page, CHROMA_STORE_PATH):
+        while page < MAX_PAGES:
+            if CHECKPOINT is not None and CHECKPOINT.is_page_complete(page):
+                page += 1
+                continue
+            print(f"Processing page {page}")
+            ret = page_crawler(page, "empty", executor=executor, max_in_flight=max_in_flight)
+            page += 1
+            if not ret:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+def crawl_planned_pages(start_page: int, plan: ListingPlan, executor: Optional[ThreadPoolExecutor], max_in_flight: int):
+    '''
+    Crawls the pages of a planned listing, listing up to LISTING_AHEAD pages ahead of
+    the one whose resources are being fetched. A planned page found empty (e.g. the
+    resources were deleted since) does not end the crawl.
+
+    :param start_page: The first page to crawl
+    :param plan: The extent of the listing
+    :param executor: Optional worker pool for the resources of a page
+    :param max_in_flight: The maximum number of resources being fetched at once
+    '''
+    pages = iter([
+        page for page in range(start_page, min(plan.last_page + 1, MAX_PAGES))
+        if CHECKPOINT is None or not CHECKPOINT.is_page_complete(page)
+    ])
+    with ThreadPoolExecutor(max_workers=LISTING_AHEAD, thread_name_prefix="scraper-listing") as listing:
+        listed = deque((page, listing.submit(list_resourceids, page)) for page in islice(pages, LISTING_AHEAD))
+        while listed:
+            page, resources = listed.popleft()
+            following = next(pages, None)
+            if following is not None:
+                listed.append((following, listing.submit(list_resourceids, following)))
+            print(f"Processing page {page}")
+            page_crawler(page, "empty", executor=executor, max_in_flight=max_in_flight, resources=resources.result())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
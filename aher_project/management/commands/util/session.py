@@ -0,0 +1,248 @@
+import bisect
+import logging
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Dict, Optional
+
+CONNECT_TIMEOUT = 5 # seconds
+READ_TIMEOUT = 60 # seconds
+MAX_RETRIES = 3 # retries after the first attempt
+BACKOFF_FACTOR = 0.5 # seconds, doubled on every retry
+BACKOFF_MAX = 30 # seconds
+POOL_SIZE = 16 # keep-alive connections per host
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+# request latencies kept, as a uniform sample of all requests, for percentiles
+LATENCY_SAMPLE_SIZE = 10000
+
+
+class SessionStats:
+    '''
+    Thread safe counters for the requests made through the shared session
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.retries = 0
+            self.errors = 0
+            self.bytes = 0
+            self.latency_total = 0.0
+            self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+            self.latency_sample = []
+
+    def record(self, latency: float, nbytes: int = 0, retry: bool = False, error: bool = False):
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, latency)
+        with self._lock:
+            self.requests += 1
+            self.bytes += nbytes
+            self.latency_total += latency
+            self.latency_buckets[bucket] += 1
+            # reservoir sampling, every request is equally likely to be in the sample
+            if len(self.latency_sample) < LATENCY_SAMPLE_SIZE:
+                self.latency_sample.append(latency)
+            else:
+                slot = random.randrange(self.requests)
+                if slot < LATENCY_SAMPLE_SIZE:
+                    self.latency_sample[slot] = latency
+            if retry:
+                self.retries += 1
+            if error:
+                self.errors += 1
+
+    def merge(self, stats: Dict):
+        '''
+        Adds in the counters of another process, as returned by its as_dict()
+        '''
+        with self._lock:
+            self.requests += stats["requests"]
+            self.retries += stats["retries"]
+            self.errors += stats["errors"]
+            self.bytes += stats["bytes"]
+            self.latency_total += stats["latency_mean"] * stats["requests"]
+            for i, count in enumerate(stats["latency_histogram"].values()):
+                self.latency_buckets[i] += count
+            sample = self.latency_sample + stats.get("latency_sample", [])
+            self.latency_sample = random.sample(sample, LATENCY_SAMPLE_SIZE) if len(sample) > LATENCY_SAMPLE_SIZE else sample
+
+    def percentile(self, p: float) -> float:
+        '''
+        The latency below which p percent of the requests took, from the latency sample
+        '''
+        with self._lock:
+            sample = sorted(self.latency_sample)
+        if not sample:
+            return 0.0
+        return sample[min(len(sample) - 1, int(len(sample) * p / 100))]
+
+    def as_dict(self, include_sample: bool = False) -> Dict:
+        '''
+        The counters as plain data, with the latency sample for merge() in another process if include_sample
+        '''
+        p50, p99 = self.percentile(50), self.percentile(99)
+        with self._lock:
+            stats = {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "bytes": self.bytes,
+                "latency_mean": self.latency_total / self.requests if self.requests else 0.0,
+                "latency_histogram": {
+                    ("+Inf" if bound == float("inf") else f"{bound:g}"): count
+                    for bound, count in zip(LATENCY_BUCKETS, self.latency_buckets)
+                },
+                "latency_p50": p50,
+                "latency_p99": p99,
+            }
+            if include_sample:
+                stats["latency_sample"] = list(self.latency_sample)
+            return stats
+
+    def add_bytes(self, nbytes: int):
+        '''
+        Counts body bytes read after the request was recorded, from a streamed response
+        '''
+        with self._lock:
+            self.bytes += nbytes
+
+    def summary(self) -> str:
+        stats = self.as_dict()
+        histogram = ", ".join(f"<={bound}s: {count}" for bound, count in stats["latency_histogram"].items() if count)
+        return (
+            f"HTTP requests: {stats['requests']}, retries: {stats['retries']}, errors: {stats['errors']}, "
+            f"bytes: {stats['bytes']}, mean latency: {stats['latency_mean'] * 1000:.1f}ms, "
+            f"p50: {stats['latency_p50'] * 1000:.1f}ms, p99: {stats['latency_p99'] * 1000:.1f}ms"
+            + (f"\nLatency histogram: {histogram}" if histogram else "")
+        )
+
+
+STATS = SessionStats()
+
+
+class CountingReader:
+    '''
+    File like view of a streamed response body, decoded, that adds the bytes read to STATS
+    '''
+
+    def __init__(self, response: requests.Response):
+        self._raw = response.raw
+        self._raw.decode_content = True
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._raw.read(size)
+        STATS.add_bytes(len(data))
+        return data
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+_SETTINGS = {
+    "connect_timeout": CONNECT_TIMEOUT,
+    "read_timeout": READ_TIMEOUT,
+    "retries": MAX_RETRIES,
+    "backoff_factor": BACKOFF_FACTOR,
+    "pool_size": POOL_SIZE,
+}
+
+
+def configure(**settings):
+    '''
+    Change the session settings, the session is rebuilt on its next use
+
+    :param settings: Any of connect_timeout, read_timeout, retries, backoff_factor and pool_size
+    '''
+    global _SESSION
+    unknown = set(settings) - set(_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown session settings: {', '.join(sorted(unknown))}")
+    with _SESSION_LOCK:
+        _SETTINGS.update({k: v for k, v in settings.items() if v is not None})
+        if _SESSION is not None:
+            _SESSION.close()
+            _SESSION = None
+
+
+def settings() -> Dict:
+    '''
+    A copy of the session settings, to configure() another process with
+    '''
+    with _SESSION_LOCK:
+        return dict(_SETTINGS)
+
+
+def get_session() -> requests.Session:
+    '''
+    The keep-alive session shared by every scraper thread
+    '''
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                session = requests.Session()
+                # retries are handled in get() so that they can be counted
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=_SETTINGS["pool_size"], max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _SESSION = session
+    return _SESSION
+
+
+def _backoff(attempt: int, response: Optional[requests.Response]) -> float:
+    '''
+    Seconds to wait before the next attempt, honouring a numeric Retry-After header
+    '''
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), BACKOFF_MAX)
+    delay = min(_SETTINGS["backoff_factor"] * (2 ** attempt), BACKOFF_MAX)
+    return delay + random.uniform(0, delay / 10)
+
+
+def get(url: str, retries: Optional[int] = None, **kwargs) -> requests.Response:
+    '''
+    GET a URL through the shared session, retrying with exponential backoff on
+    connection errors, timeouts and 429/5xx responses
+
+    :param url: The URL to fetch
+    :param retries: The number of retries of this request, the configured number if None
+    :param kwargs: Passed on to requests.Session.get, read the body of a stream=True request through CountingReader
+    :return: The last response received
+    :raises requests.RequestException: If no response was received on the final attempt
+    '''
+    kwargs.setdefault("timeout", (_SETTINGS["connect_timeout"], _SETTINGS["read_timeout"]))
+    session = get_session()
+    if retries is None:
+        retries = _SETTINGS["retries"]
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            response = session.get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            STATS.record(time.perf_counter() - start, retry=attempt > 0, error=True)
+            if attempt >= retries:
+                raise
+            logging.warning(f"Retrying {url} after error: {str(e)}")
+            time.sleep(_backoff(attempt, None))
+            attempt += 1
+            continue
+
+        # a streamed body is not read yet, its bytes are counted as it is read through CountingReader
+        nbytes = 0 if kwargs.get("stream") else len(response.content)
+        STATS.record(time.perf_counter() - start, nbytes, retry=attempt > 0, error=response.status_code >= 400)
+        if response.status_code not in RETRY_STATUSES or attempt >= retries:
+            return response
+        logging.warning(f"Retrying {url} after status {response.status_code}")
+        # an unread streamed body would keep its connection out of the pool
+        response.close()
+        time.sleep(_backoff(attempt, response))
+        attempt += 1
@@ -0,0 +1,231 @@
+import gzip
+import json
+import mmap
+import os
+import re
+import threading
+from typing import Dict, Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SHARD_PREFIX = "shard"
+SHARD_INDEX_FILENAME = "shard_index.jsonl"
+SHARD_SIZE = 256 * 1024 * 1024 # bytes on disk before a new shard is started
+BLOCK_SIZE = 1024 * 1024 # uncompressed bytes of documents compressed together
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _check_compression(compression: Optional[str]):
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}, expected one of gzip, zstd")
+    if compression == "zstd" and zstandard is None:
+        raise ImportError("zstandard is not installed. Please install it using 'pip install zstandard'")
+
+
+def _compress(data: bytes, compression: Optional[str]) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+
+def _decompress(data: bytes, compression: Optional[str]) -> bytes:
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _sync_path(path: str):
+    # a file closed once written, or a directory, whose new entries are only durable once it is synced
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DirectorySink:
+    '''
+    Writes every document to its own <resourceid>.json file in the doc store.
+    Safe to share between threads.
+    '''
+
+    def __init__(self, store_path: str):
+        self.store_path = store_path
+        os.makedirs(store_path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._written = set()
+
+    def write(self, resourceid: str, document: str):
+        path = os.path.join(self.store_path, f"{resourceid}.json")
+        with open(path, "w") as f:
+            f.write(document)
+        with self._lock:
+            self._written.add(path)
+
+    def flush(self):
+        '''
+        Syncs the files written since the last flush and the doc store directory to
+        disk, called before the checkpoint records the documents written so far
+        '''
+        with self._lock:
+            written, self._written = self._written, set()
+        if not written:
+            return
+        for path in written:
+            _sync_path(path)
+        _sync_path(self.store_path)
+
+    def close(self):
+        self.flush()
+
+
+class ShardSink:
+    '''
+    Streams documents into size bounded JSON-lines shards
+
+    Documents are gathered into blocks of about BLOCK_SIZE bytes and every block
+    is written as its own gzip member / zstd frame, so a shard is still a valid
+    compressed JSON-lines file while a single document can be read by
+    decompressing only its block. Every document gets a line in the index file:
+
+        {"resourceid": ..., "shard": ..., "offset": ..., "length": ..., "start": ..., "end": ...}
+
+    where offset / length locate the block in the shard file and start / end the
+    document in the decompressed block. The index is only ever appended to, so
+    a document written again by a later crawl is found by its last index line.
+    Safe to share between threads.
+    '''
+
+    def __init__(self, store_path: str, compression: Optional[str] = None, shard_size: int = SHARD_SIZE, prefix: str = SHARD_PREFIX, index_filename: str = SHARD_INDEX_FILENAME):
+        _check_compression(compression)
+        os.makedirs(store_path, exist_ok=True)
+        self.store_path = store_path
+        self.compression = compression
+        self.shard_size = shard_size
+        self.prefix = prefix
+        # uncompressed shards are appended to directly, compressed ones a block at a time
+        self.block_size = BLOCK_SIZE if compression else 0
+        self._lock = threading.Lock()
+        self._index = open(os.path.join(store_path, index_filename), "a")
+        self._shard_number = self._next_shard_number()
+        self._shard = None
+        self._shard_name = None
+        self._block = bytearray()
+        self._block_entries = []
+
+    def _next_shard_number(self) -> int:
+        '''
+        The first shard number not used by an earlier crawl, so that shards are never overwritten
+        '''
+        pattern = re.compile(rf"^{re.escape(self.prefix)}-(\d+)\.jsonl")
+        numbers = [int(m.group(1)) for m in (pattern.match(name) for name in os.listdir(self.store_path)) if m]
+        return max(numbers) + 1 if numbers else 0
+
+    def _open_shard(self):
+        self._shard_name = f"{self.prefix}-{self._shard_number:05d}.jsonl{COMPRESSIONS[self.compression]}"
+        self._shard = open(os.path.join(self.store_path, self._shard_name), "ab")
+        self._shard_number += 1
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        if self._shard is None:
+            self._open_shard()
+        data = _compress(bytes(self._block), self.compression)
+        offset = self._shard.tell()
+        self._shard.write(data)
+        for resourceid, start, end in self._block_entries:
+            entry = {"resourceid": resourceid, "shard": self._shard_name, "offset": offset, "length": len(data), "start": start, "end": end}
+            self._index.write(json.dumps(entry) + "\n")
+        self._block = bytearray()
+        self._block_entries = []
+        if self._shard.tell() >= self.shard_size:
+            _sync(self._shard)
+            self._shard.close()
+            self._shard = None
+
+    def write(self, resourceid: str, document: str):
+        line = document.encode("utf-8") + b"\n"
+        with self._lock:
+            start = len(self._block)
+            self._block += line
+            # the trailing newline is not part of the document
+            self._block_entries.append((resourceid, start, start + len(line) - 1))
+            if len(self._block) >= self.block_size:
+                self._flush_block()
+
+    def flush(self):
+        '''
+        Writes out the pending block and syncs the shard and index to disk, called
+        before the checkpoint records the documents written so far
+        '''
+        with self._lock:
+            if self._index.closed:
+                return
+            self._flush_block()
+            if self._shard is not None:
+                _sync(self._shard)
+            _sync(self._index)
+
+    def close(self):
+        with self._lock:
+            self._flush_block()
+            if self._shard is not None:
+                _sync(self._shard)
+                self._shard.close()
+                self._shard = None
+            _sync(self._index)
+            self._index.close()
+
+
+class ShardReader:
+    '''
+    Random access to documents written by ShardSink, via memory mapped shards
+    '''
+
+    def __init__(self, store_path: str, index_filename: str = SHARD_INDEX_FILENAME):
+        self.store_path = store_path
+        self._index = {}
+        with open(os.path.join(store_path, index_filename)) as f:
+            for line in f:
+                entry = json.loads(line)
+                self._index[entry["resourceid"]] = entry
+        self._maps = {}
+
+    def __contains__(self, resourceid: str) -> bool:
+        return resourceid in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def resourceids(self):
+        return self._index.keys()
+
+    def _map(self, shard: str) -> mmap.mmap:
+        if shard not in self._maps:
+            with open(os.path.join(self.store_path, shard), "rb") as f:
+                self._maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[shard]
+
+    def get(self, resourceid: str) -> Dict:
+        entry = self._index[resourceid]
+        compression = next((c for c, ext in COMPRESSIONS.items() if ext and entry["shard"].endswith(ext)), None)
+        block = _decompress(self._map(entry["shard"])[entry["offset"]:entry["offset"] + entry["length"]], compression)
+        return json.loads(block[entry["start"]:entry["end"]])
+
+    def close(self):
+        for shard_map in self._maps.values():
+            shard_map.close()
+        self._maps = {}
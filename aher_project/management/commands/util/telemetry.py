@@ -0,0 +1,262 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from aher_project.management.commands.util import session
+
+REPORT_INTERVAL = 10 # seconds between progress lines / stats records, 0 = only the final record
+RATE_WINDOW = 60 # seconds the rolling resources/s is measured over
+STATS_FILENAME = "crawl_stats.jsonl"
+# list = resource list pages, fetch = resource requests, parse = decoding (pruned while decoding),
+# prune = projections / pruning, serialisation and hashing, write = doc store and checkpoint
+PHASES = ("list", "fetch", "parse", "prune", "write")
+OUTCOMES = ("written", "unchanged", "failed")
+# per resource latencies kept, as a uniform sample of the written resources, for percentiles
+LATENCY_SAMPLE_SIZE = 10000
+
+
+class CrawlTelemetry:
+    '''
+    Thread safe progress counters of a crawl: pages and resources done by
+    outcome, errors by HTTP status (or kind), and the time spent per phase
+
+    Phase times are summed over the threads, so with several workers they add
+    up to more than the elapsed time. The latency of a resource is the time from
+    the start of its fetch to its document being written. Worker processes report
+    their counters() to the parent with update_remote(), which adds them into as_dict().
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start = time.time()
+            self._start = time.monotonic()
+            self.pages = 0
+            self.resources = 0
+            self.outcomes = dict.fromkeys(OUTCOMES, 0)
+            self.errors = {}
+            self.phase_time = dict.fromkeys(PHASES, 0.0)
+            self.phase_count = dict.fromkeys(PHASES, 0)
+            # resources done by an earlier, interrupted crawl that this one resumes
+            self.resumed = 0
+            self.total = None
+            self.total_estimated = False
+            self.latency_sample = []
+            self._latencies = 0
+            self._remote = {}
+            self._history = deque()
+
+    def page_done(self, page: int, resources: int):
+        with self._lock:
+            self.pages += 1
+
+    def resource_done(self, outcome: str):
+        with self._lock:
+            self.resources += 1
+            self.outcomes[outcome] += 1
+
+    def resource_latency(self, seconds: float):
+        '''
+        Records the time a written resource took, from the start of its fetch
+        '''
+        with self._lock:
+            self._latencies += 1
+            if len(self.latency_sample) < LATENCY_SAMPLE_SIZE:
+                self.latency_sample.append(seconds)
+            else:
+                # reservoir sampling, every resource is equally likely to be kept
+                slot = random.randrange(self._latencies)
+                if slot < LATENCY_SAMPLE_SIZE:
+                    self.latency_sample[slot] = seconds
+
+    def error(self, kind):
+        '''
+        Counts an error, kind being the HTTP status code or e.g. "no response" / "parse"
+        '''
+        kind = str(kind)
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phase_time[name] += elapsed
+                self.phase_count[name] += 1
+
+    def set_total(self, total: Optional[int], estimated: bool = False, resumed: int = 0):
+        '''
+        The number of resources the crawl will go through, for the ETA
+
+        :param total: The number of resources, None if unknown
+        :param estimated: True if the total is a guess, e.g. the resources of the last crawl
+        :param resumed: The resources already done by the crawl being resumed
+        '''
+        with self._lock:
+            self.total = total
+            self.total_estimated = estimated
+            self.resumed = resumed
+
+    def counters(self, include_sample: bool = False) -> Dict:
+        '''
+        The cumulative counters, as sent by a worker process to update_remote(), with
+        the latency sample if include_sample, e.g. once the worker is done
+        '''
+        with self._lock:
+            counters = {
+                "pages": self.pages,
+                "resources": self.resources,
+                "outcomes": dict(self.outcomes),
+                "errors": dict(self.errors),
+                "phase_time": dict(self.phase_time),
+                "phase_count": dict(self.phase_count),
+            }
+            if include_sample:
+                counters["latency_sample"] = list(self.latency_sample)
+            return counters
+
+    def update_remote(self, worker: int, counters: Dict):
+        with self._lock:
+            self._remote[worker] = counters
+
+    def as_dict(self) -> Dict:
+        '''
+        A snapshot of the progress, as written to the stats file
+        '''
+        now = time.monotonic()
+        combined = self.counters()
+        with self._lock:
+            latencies = list(self.latency_sample)
+            for remote in self._remote.values():
+                latencies += remote.get("latency_sample", [])
+                combined["pages"] += remote["pages"]
+                combined["resources"] += remote["resources"]
+                for key in ("outcomes", "errors", "phase_time", "phase_count"):
+                    for name, value in remote[key].items():
+                        combined[key][name] = combined[key].get(name, 0) + value
+            elapsed = now - self._start
+            resources = combined["resources"]
+            # rolling rate over the snapshots of the last RATE_WINDOW seconds
+            self._history.append((now, resources))
+            while len(self._history) > 2 and now - self._history[1][0] >= RATE_WINDOW:
+                self._history.popleft()
+            then, resources_then = self._history[0]
+            mean_rate = resources / elapsed if elapsed > 0 else 0.0
+            rate = (resources - resources_then) / (now - then) if now - then >= 1 else mean_rate
+            done = resources + self.resumed
+            remaining = max(self.total - done, 0) if self.total is not None else None
+            eta = remaining / rate if remaining is not None and rate > 0 else None
+            total, total_estimated, resumed = self.total, self.total_estimated, self.resumed
+
+        stats = {
+            "time": time.time(),
+            "elapsed": elapsed,
+            **combined,
+            "resumed": resumed,
+            "total": total,
+            "total_estimated": total_estimated,
+            "percent": min(done / total * 100, 100.0) if total else None,
+            "rate": rate,
+            "rate_mean": mean_rate,
+            "eta": eta,
+            "resource_latency_p50": _percentile(latencies, 50),
+            "resource_latency_p99": _percentile(latencies, 99),
+            "http": session.STATS.as_dict(),
+        }
+        return stats
+
+    def summary(self, stats: Optional[Dict] = None) -> str:
+        '''
+        One console line of progress
+        '''
+        stats = stats or self.as_dict()
+        outcomes = stats["outcomes"]
+        line = (
+            f"{stats['pages']} pages, {stats['resources']} resources "
+            f"({outcomes['written']} written, {outcomes['unchanged']} unchanged, {outcomes['failed']} failed), "
+            f"{stats['rate']:.1f}/s"
+        )
+        if stats["percent"] is not None:
+            line += f", {stats['percent']:.1f}%{' (estimated)' if stats['total_estimated'] else ''}"
+        if stats["eta"] is not None:
+            line += f", ETA {_duration(stats['eta'])}"
+        if stats["errors"]:
+            line += f", errors: {', '.join(f'{kind}: {count}' for kind, count in sorted(stats['errors'].items()))}"
+        timed = [f"{name} {seconds:.0f}s" for name, seconds in stats["phase_time"].items() if seconds >= 0.5]
+        if timed:
+            line += f", time in {', '.join(timed)}"
+        return line
+
+
+def _percentile(sample: list, p: float) -> Optional[float]:
+    if not sample:
+        return None
+    sample = sorted(sample)
+    return sample[min(len(sample) - 1, int(len(sample) * p / 100))]
+
+
+def _duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+TELEMETRY = CrawlTelemetry()
+
+
+class TelemetryReporter:
+    '''
+    Prints a progress line and appends a JSON record to the stats file every
+    interval seconds from a background thread, and a final record on stop()
+
+        {"time": ..., "elapsed": ..., "pages": ..., "resources": ..., "outcomes": {...}, "errors": {...},
+         "phase_time": {...}, "total": ..., "rate": ..., "eta": ..., "http": {...}, "final": false}
+    '''
+
+    def __init__(self, stats_path: Optional[str], interval: float = REPORT_INTERVAL, telemetry: CrawlTelemetry = TELEMETRY):
+        self.stats_path = stats_path
+        self.interval = interval
+        self.telemetry = telemetry
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.stats_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.stats_path)), exist_ok=True)
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="scraper-telemetry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report(final=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def report(self, final: bool = False):
+        stats = self.telemetry.as_dict()
+        stats["final"] = final
+        print(("Crawl finished: " if final else "Progress: ") + self.telemetry.summary(stats))
+        if not self.stats_path:
+            return
+        try:
+            with open(self.stats_path, "a") as f:
+                f.write(json.dumps(stats) + "\n")
+        except OSError as e:
+            logging.error(f"Error writing crawl stats to {self.stats_path}: {str(e)}")
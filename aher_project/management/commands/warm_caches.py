@@ -0,0 +1,125 @@
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User, update_last_login
+from django.contrib.auth.signals import user_logged_in
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import NoReverseMatch, reverse
+
+from arches.app.models import models
+from arches.app.utils import permission_backend
+
+# pages requested per resource graph, they build the graph, its cards and widgets
+GRAPH_PAGES = ("add_resource",)
+# pages requested once per user, they build the user's search and permission state
+USER_PAGES = ("search_home", "time_wheel_config")
+
+
+def _resource_graphids():
+    return [
+        str(graphid)
+        for graphid in models.GraphModel.objects.filter(isresource=True)
+        .exclude(graphid=settings.SYSTEM_SETTINGS_RESOURCE_MODEL_ID)
+        .values_list("graphid", flat=True)
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill the shared caches after a deploy so that the first requests do not build them: requests the '
+        'resource pages of every graph, loads the permission maps of the given users and requests the '
+        'pages that cache per user state. Needs a shared cache (CACHE_REDIS_URL or the file cache) to '
+        'be of use to the web processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            nargs='*',
+            default=None,
+            help='Usernames to warm permission maps and pages for, besides the anonymous user (default: all active users)',
+        )
+        parser.add_argument(
+            '--max-users',
+            type=int,
+            default=200,
+            help='Most users to warm when --users is not given, the most recent logins first',
+        )
+        parser.add_argument(
+            '--host',
+            default=None,
+            help='Host header of the page requests (default: the first of ALLOWED_HOSTS)',
+        )
+
+    def handle(self, *args, **options):
+        host = options['host'] or next((h for h in settings.ALLOWED_HOSTS if h not in ('*', '') and not h.startswith('.')), 'localhost')
+        graphids = _resource_graphids()
+        if options['users'] is None:
+            users = list(User.objects.filter(is_active=True).order_by('-last_login')[:options['max_users']])
+        else:
+            users = list(User.objects.filter(username__in=options['users']))
+        anonymous = User.objects.filter(username='anonymous').first()
+        if anonymous is not None and anonymous not in users:
+            users.insert(0, anonymous)
+
+        start = time.perf_counter()
+        # the logins below are not real ones: they must not move last_login, which also orders
+        # the users warmed by the next run
+        tracking_logins = user_logged_in.disconnect(dispatch_uid="update_last_login")
+        try:
+            admin = User.objects.filter(is_superuser=True, is_active=True).first()
+            if admin is not None:
+                client = self._client(host, admin)
+                for graphid in graphids:
+                    for page in GRAPH_PAGES:
+                        self._get(client, page, {"graphid": graphid})
+                client.logout()
+
+            for user in users:
+                self._warm("permissions", user.username, lambda: self._warm_permissions(user))
+                client = self._client(host, user if user.username != 'anonymous' else None)
+                for page in USER_PAGES:
+                    self._get(client, page)
+                # deletes the session force_login created
+                client.logout()
+        finally:
+            if tracking_logins:
+                user_logged_in.connect(update_last_login, dispatch_uid="update_last_login")
+
+        print(f"Warmed {len(graphids)} graphs and {len(users)} users in {time.perf_counter() - start:.1f}s")
+
+    def _client(self, host: str, user=None) -> Client:
+        client = Client(HTTP_HOST=host)
+        if user is not None:
+            client.force_login(user)
+        return client
+
+    def _warm(self, kind: str, name: str, warm):
+        try:
+            warm()
+        except Exception as e:
+            logging.error(f"Could not warm {kind} {name}: {str(e)}")
+
+    def _warm_permissions(self, user: User):
+        # the lookups made when a user searches, views and edits resources
+        permission_backend.get_nodegroups_by_perm(user, ["models.read_nodegroup"])
+        permission_backend.get_nodegroups_by_perm(user, ["models.write_nodegroup"])
+        permission_backend.get_createable_resource_types(user)
+        permission_backend.get_editable_resource_types(user)
+        permission_backend.get_resource_types_by_perm(user, ["models.read_nodegroup"])
+
+    def _get(self, client: Client, page: str, kwargs=None):
+        try:
+            url = reverse(page, kwargs=kwargs)
+        except NoReverseMatch:
+            logging.warning(f"Skipping {page}, there is no such url")
+            return
+        try:
+            response = client.get(url)
+        except Exception as e:
+            logging.error(f"Could not warm {url}: {str(e)}")
+            return
+        if response.status_code >= 400:
+            logging.warning(f"Warming {url} returned {response.status_code}")
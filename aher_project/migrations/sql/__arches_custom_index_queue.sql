@@ -0,0 +1,23 @@
+-- DROP TABLE IF EXISTS public.__arches_custom_index_queue;
+
+-- resources waiting to be reindexed into a custom index with should_update_asynchronously,
+-- one row per resource however often it is saved before the queue is flushed
+CREATE TABLE IF NOT EXISTS public.__arches_custom_index_queue (
+    index_name text NOT NULL,
+    resourceinstanceid uuid NOT NULL,
+    queued timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (index_name, resourceinstanceid)
+);
+
+CREATE INDEX IF NOT EXISTS __arches_custom_index_queue_queued_idx
+    ON public.__arches_custom_index_queue (index_name, queued);
+
+
+-- DROP TABLE IF EXISTS public.__arches_custom_index_flushes;
+
+-- the custom indexes with a flush task scheduled, so that a burst of saves schedules one flush.
+-- scheduled is when the flush was claimed, a save finding an old claim schedules the flush again
+CREATE TABLE IF NOT EXISTS public.__arches_custom_index_flushes (
+    index_name text PRIMARY KEY,
+    scheduled timestamp with time zone NOT NULL DEFAULT now()
+);
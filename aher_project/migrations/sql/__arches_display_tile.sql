@@ -1,3 +1,78 @@
+
+-- DROP MATERIALIZED VIEW IF EXISTS public.__arches_node_display_labels;
+
+-- card name and widget label of every node, one row per card and language, so that rendering
+-- a tile does not need the nodes / cards_x_nodes_x_widgets / cards join. this metadata only
+-- changes when a graph is edited, the view is refreshed by the triggers below.
+-- a node can have more than one widget row on the same card, only the first by sortorder is kept
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.__arches_node_display_labels AS
+    SELECT DISTINCT ON (cnw.nodeid, l.language_code, cnw.cardid)
+        cnw.nodeid,
+        cnw.cardid,
+        l.language_code,
+        c.name ->> l.language_code AS card_name,
+        cnw.label ->> l.language_code AS widget_label
+    FROM public.cards_x_nodes_x_widgets cnw
+        join public.cards c on c.cardid = cnw.cardid
+        cross join lateral (
+            SELECT jsonb_object_keys(cnw.label)
+            UNION
+            SELECT jsonb_object_keys(c.name)
+        ) l(language_code)
+    ORDER BY cnw.nodeid, l.language_code, cnw.cardid, cnw.sortorder, cnw.id
+WITH DATA;
+
+-- unique so that the view can be refreshed concurrently, without blocking readers
+CREATE UNIQUE INDEX IF NOT EXISTS __arches_node_display_labels_node_language_idx
+    ON public.__arches_node_display_labels (nodeid, language_code, cardid);
+
+
+-- DROP FUNCTION IF EXISTS public.__arches_refresh_node_display_labels();
+
+CREATE OR REPLACE FUNCTION public.__arches_refresh_node_display_labels()
+    RETURNS void
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+        BEGIN
+            -- can also be called directly, e.g. after a graph is published or imported
+            REFRESH MATERIALIZED VIEW CONCURRENTLY public.__arches_node_display_labels;
+        END;
+$BODY$;
+
+
+-- DROP FUNCTION IF EXISTS public.__arches_refresh_node_display_labels_trigger();
+
+CREATE OR REPLACE FUNCTION public.__arches_refresh_node_display_labels_trigger()
+    RETURNS trigger
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+        BEGIN
+            -- fired at commit for every changed card / widget row, saving a graph changes many
+            -- of them in one transaction so only the first firing refreshes the view
+            IF COALESCE(current_setting('arches.node_display_labels_refreshed', true), '') = '' THEN
+                PERFORM set_config('arches.node_display_labels_refreshed', 'true', true);
+                PERFORM __arches_refresh_node_display_labels();
+            END IF;
+            RETURN NULL;
+        END;
+$BODY$;
+
+DROP TRIGGER IF EXISTS __arches_node_display_labels_cards ON public.cards;
+CREATE CONSTRAINT TRIGGER __arches_node_display_labels_cards
+    AFTER INSERT OR UPDATE OR DELETE ON public.cards
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION public.__arches_refresh_node_display_labels_trigger();
+
+DROP TRIGGER IF EXISTS __arches_node_display_labels_widgets ON public.cards_x_nodes_x_widgets;
+CREATE CONSTRAINT TRIGGER __arches_node_display_labels_widgets
+    AFTER INSERT OR UPDATE OR DELETE ON public.cards_x_nodes_x_widgets
+    DEFERRABLE INITIALLY DEFERRED
+    FOR EACH ROW EXECUTE FUNCTION public.__arches_refresh_node_display_labels_trigger();
+
 -- DROP FUNCTION IF EXISTS public.__arches_display_tiledata_compact(jsonb, text, boolean);
 
 CREATE OR REPLACE FUNCTION public.__arches_display_tiledata_compact(
@@ -20,20 +95,30 @@ AS $BODY$
             --replace each uuid key with the display value of the node
             
 			RETURN json_build_object(
-                c.name ->> language_id, jsonb_object_agg(cnw.label ->> language_id,__arches_get_node_display_value(tiledata, n.nodeid, language_id))
+                l.card_name, jsonb_object_agg(l.widget_label, dv.display_value)
                 )
 			--RETURN jsonb_object_agg(cnw.label ->> language_id,__arches_get_node_display_value(tiledata, n.nodeid, language_id))
-            FROM nodes n
-                join public.cards_x_nodes_x_widgets cnw on n.nodeid = cnw.nodeid
-				join public.cards c on c.cardid = cnw.cardid
-            WHERE n.nodeid IN (
+            -- card names and widget labels come from the precomputed lookup rather than
+            -- a nodes / cards_x_nodes_x_widgets / cards join
+            FROM public.__arches_node_display_labels l
+                -- the display value is computed once per node and shared by the filter and the output,
+                -- OFFSET 0 stops the planner from inlining the subquery and calling it twice again
+                cross join lateral (
+                    SELECT __arches_get_node_display_value(tiledata, l.nodeid, language_id) AS display_value
+                    OFFSET 0
+                ) dv
+            WHERE l.nodeid IN (
                 	SELECT jsonb_object_keys(tiledata)::uuid
             	)
+                AND l.language_code = language_id
 				AND (
                     NOT compact 
-                    OR __arches_get_node_display_value(tiledata, n.nodeid, language_id) <> ''::text
+                    OR dv.display_value <> ''::text
                 )
-			GROUP BY c.name;
+			GROUP BY l.card_name
+            -- one card per tile, the same one __arches_display_tiledata_compact_bulk picks
+            ORDER BY l.card_name
+            LIMIT 1;
             
         END;
         
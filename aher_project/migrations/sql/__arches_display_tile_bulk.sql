@@ -0,0 +1,76 @@
+
+-- needs __arches_node_display_labels, created in __arches_display_tile.sql
+
+-- DROP FUNCTION IF EXISTS public.__arches_display_tiledata_compact_bulk(uuid[], text, boolean);
+
+CREATE OR REPLACE FUNCTION public.__arches_display_tiledata_compact_bulk(
+	tileids uuid[],
+	language_id text DEFAULT 'en'::text,
+	compact boolean DEFAULT false)
+    RETURNS TABLE(tileid uuid, resourceinstanceid uuid, nodegroupid uuid, sortorder integer, display jsonb)
+    LANGUAGE 'sql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+    ROWS 1000
+AS $BODY$
+    -- set based version of __arches_display_tiledata_compact: renders every tile in tileids
+    -- in one query, returning one row per tile with the same compacted display json
+    -- ({card name: {widget label: display value}}) that the single tile function returns.
+    -- tiles without any node to display return no row.
+    -- a node shown on several cards has a label row per card. like the single tile function
+    -- only one card is rendered per tile: the displays are built per (tile, card) and the
+    -- first card by name is kept.
+    SELECT DISTINCT ON (c.tileid)
+        c.tileid,
+        c.resourceinstanceid,
+        c.nodegroupid,
+        c.sortorder,
+        c.display
+    FROM (
+        SELECT t.tileid,
+            t.resourceinstanceid,
+            t.nodegroupid,
+            t.sortorder,
+            l.card_name,
+            jsonb_build_object(l.card_name, jsonb_object_agg(l.widget_label, dv.display_value)) AS display
+        FROM public.tiles t
+            cross join lateral jsonb_object_keys(t.tiledata) k(nodeid)
+            -- card names and widget labels from the lookup in __arches_display_tile.sql
+            join public.__arches_node_display_labels l on l.nodeid = k.nodeid::uuid and l.language_code = language_id
+            -- the display value is computed once per node and shared by the filter and the output,
+            -- OFFSET 0 stops the planner from inlining the subquery and calling it twice again
+            cross join lateral (
+                SELECT __arches_get_node_display_value(t.tiledata, l.nodeid, language_id) AS display_value
+                OFFSET 0
+            ) dv
+        WHERE t.tileid = ANY(tileids)
+            AND (
+                NOT compact
+                OR dv.display_value <> ''::text
+            )
+        GROUP BY t.tileid, t.resourceinstanceid, t.nodegroupid, t.sortorder, l.card_name
+    ) c
+    ORDER BY c.tileid, c.card_name;
+$BODY$;
+
+
+-- DROP FUNCTION IF EXISTS public.__arches_display_resource_tiledata_compact(uuid, text, boolean);
+
+CREATE OR REPLACE FUNCTION public.__arches_display_resource_tiledata_compact(
+	resourceid uuid,
+	language_id text DEFAULT 'en'::text,
+	compact boolean DEFAULT false)
+    RETURNS TABLE(tileid uuid, resourceinstanceid uuid, nodegroupid uuid, sortorder integer, display jsonb)
+    LANGUAGE 'sql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+    ROWS 100
+AS $BODY$
+    -- every tile of a resource rendered in one call, for exports and reports
+    SELECT *
+    FROM __arches_display_tiledata_compact_bulk(
+        ARRAY(SELECT t.tileid FROM public.tiles t WHERE t.resourceinstanceid = resourceid),
+        language_id,
+        compact
+    );
+$BODY$;
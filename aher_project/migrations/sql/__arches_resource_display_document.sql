@@ -0,0 +1,288 @@
+-- needs __arches_display_tiledata_compact_bulk, created in __arches_display_tile_bulk.sql
+
+-- DROP TABLE IF EXISTS public.__arches_resource_display_documents;
+
+-- the compact display json of every tile of a resource, per language, kept up to date as tiles
+-- are saved and deleted so that reading the display form of a resource is a single row fetch.
+-- document is keyed by nodegroupid, each value is the display json of the nodegroup's tiles
+-- in sortorder: {"<nodegroupid>": [{card name: {widget label: display value}}, ...], ...}
+-- updated is when any nodegroup was last rebuilt, built when the whole document was.
+--
+-- what can go stale: a document only follows the resource's own tiles. card names and widget
+-- labels changed by a graph edit mark the graph's documents stale (see the card / widget
+-- triggers below), __arches_get_resource_display_document then returns NULL for them until
+-- they are rebuilt. display values taken from other rows are not tracked at all: the names of
+-- related resources, concept and domain value labels and the like stay as they were when the
+-- tile was last saved, rebuild everything with __arches_backfill_resource_display_documents(NULL, false)
+-- after such changes or on a schedule.
+CREATE TABLE IF NOT EXISTS public.__arches_resource_display_documents (
+    resourceinstanceid uuid NOT NULL REFERENCES public.resource_instances (resourceinstanceid) ON DELETE CASCADE,
+    language_id text NOT NULL,
+    document jsonb NOT NULL DEFAULT '{}'::jsonb,
+    updated timestamp with time zone NOT NULL DEFAULT now(),
+    built timestamp with time zone NOT NULL DEFAULT now(),
+    PRIMARY KEY (resourceinstanceid, language_id)
+);
+
+ALTER TABLE public.__arches_resource_display_documents
+    ADD COLUMN IF NOT EXISTS built timestamp with time zone NOT NULL DEFAULT now();
+
+
+-- DROP TABLE IF EXISTS public.__arches_resource_display_stale_graphs;
+
+-- graphs whose card names or widget labels changed at since, documents built before then are stale
+CREATE TABLE IF NOT EXISTS public.__arches_resource_display_stale_graphs (
+    graphid uuid PRIMARY KEY,
+    since timestamp with time zone NOT NULL DEFAULT now()
+);
+
+
+-- DROP FUNCTION IF EXISTS public.__arches_refresh_resource_display_document(uuid, uuid[]);
+
+CREATE OR REPLACE FUNCTION public.__arches_refresh_resource_display_document(
+	resourceid uuid,
+	nodegroupids uuid[] DEFAULT NULL)
+    RETURNS void
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+        BEGIN
+            -- rebuilds the given nodegroups of a resource's display documents, or the whole
+            -- documents when nodegroupids is NULL. nodegroups left without tiles are removed.
+            IF NOT EXISTS (SELECT 1 FROM public.resource_instances r WHERE r.resourceinstanceid = resourceid) THEN
+                -- deleted along with its tiles, its documents go with the resource
+                RETURN;
+            END IF;
+
+            -- a resource without a document in some language, e.g. one that existed before the
+            -- documents did, gets all of it built rather than only the changed nodegroups
+            IF nodegroupids IS NOT NULL AND EXISTS (
+                SELECT 1 FROM public.languages lang
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM public.__arches_resource_display_documents rd
+                    WHERE rd.resourceinstanceid = resourceid
+                        AND rd.language_id = lang.code
+                )
+            ) THEN
+                nodegroupids := NULL;
+            END IF;
+
+            WITH displays AS (
+                SELECT lang.code AS language_id,
+                    d.nodegroupid,
+                    jsonb_agg(d.display ORDER BY d.sortorder, d.tileid) AS tiles
+                FROM public.languages lang
+                    cross join lateral __arches_display_tiledata_compact_bulk(
+                        ARRAY(
+                            SELECT t.tileid FROM public.tiles t
+                            WHERE t.resourceinstanceid = resourceid
+                                AND (nodegroupids IS NULL OR t.nodegroupid = ANY(nodegroupids))
+                        ),
+                        lang.code,
+                        true
+                    ) d
+                GROUP BY lang.code, d.nodegroupid
+            ), documents AS (
+                SELECT lang.code AS language_id,
+                    COALESCE(
+                        jsonb_object_agg(ds.nodegroupid::text, ds.tiles) FILTER (WHERE ds.nodegroupid IS NOT NULL),
+                        '{}'::jsonb
+                    ) AS document
+                FROM public.languages lang
+                    left join displays ds on ds.language_id = lang.code
+                GROUP BY lang.code
+            )
+            INSERT INTO public.__arches_resource_display_documents AS rd (resourceinstanceid, language_id, document)
+            SELECT resourceid, documents.language_id, documents.document
+            FROM documents
+            ON CONFLICT (resourceinstanceid, language_id) DO UPDATE
+                SET document = CASE
+                        WHEN nodegroupids IS NULL THEN excluded.document
+                        -- only the changed nodegroups are replaced, the rest of the document is kept
+                        ELSE (rd.document - nodegroupids::text[]) || excluded.document
+                    END,
+                    updated = now(),
+                    built = CASE WHEN nodegroupids IS NULL THEN now() ELSE rd.built END;
+        END;
+$BODY$;
+
+
+-- DROP FUNCTION IF EXISTS public.__arches_resource_display_documents_trigger();
+
+CREATE OR REPLACE FUNCTION public.__arches_resource_display_documents_trigger()
+    RETURNS trigger
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+        DECLARE
+            changed record;
+        BEGIN
+            -- statement level, so a save of many tiles refreshes each affected resource once.
+            -- the transition tables only exist for their own operation, hence one query per branch.
+            IF TG_OP = 'INSERT' THEN
+                FOR changed IN
+                    SELECT n.resourceinstanceid, array_agg(DISTINCT n.nodegroupid) AS nodegroupids
+                    FROM new_tiles n
+                    GROUP BY n.resourceinstanceid
+                LOOP
+                    PERFORM __arches_refresh_resource_display_document(changed.resourceinstanceid, changed.nodegroupids);
+                END LOOP;
+            ELSIF TG_OP = 'UPDATE' THEN
+                FOR changed IN
+                    SELECT c.resourceinstanceid, array_agg(DISTINCT c.nodegroupid) AS nodegroupids
+                    FROM (
+                        -- both sides, a tile can move between nodegroups or resources
+                        SELECT n.resourceinstanceid, n.nodegroupid
+                        FROM new_tiles n
+                            join old_tiles o on o.tileid = n.tileid
+                        WHERE n.tiledata IS DISTINCT FROM o.tiledata
+                            OR n.sortorder IS DISTINCT FROM o.sortorder
+                            OR n.nodegroupid IS DISTINCT FROM o.nodegroupid
+                            OR n.resourceinstanceid IS DISTINCT FROM o.resourceinstanceid
+                        UNION
+                        SELECT o.resourceinstanceid, o.nodegroupid
+                        FROM old_tiles o
+                            join new_tiles n on n.tileid = o.tileid
+                        WHERE n.nodegroupid IS DISTINCT FROM o.nodegroupid
+                            OR n.resourceinstanceid IS DISTINCT FROM o.resourceinstanceid
+                    ) c
+                    GROUP BY c.resourceinstanceid
+                LOOP
+                    PERFORM __arches_refresh_resource_display_document(changed.resourceinstanceid, changed.nodegroupids);
+                END LOOP;
+            ELSIF TG_OP = 'DELETE' THEN
+                FOR changed IN
+                    SELECT o.resourceinstanceid, array_agg(DISTINCT o.nodegroupid) AS nodegroupids
+                    FROM old_tiles o
+                    GROUP BY o.resourceinstanceid
+                LOOP
+                    PERFORM __arches_refresh_resource_display_document(changed.resourceinstanceid, changed.nodegroupids);
+                END LOOP;
+            END IF;
+            RETURN NULL;
+        END;
+$BODY$;
+
+DROP TRIGGER IF EXISTS __arches_resource_display_documents_insert ON public.tiles;
+CREATE TRIGGER __arches_resource_display_documents_insert
+    AFTER INSERT ON public.tiles
+    REFERENCING NEW TABLE AS new_tiles
+    FOR EACH STATEMENT EXECUTE FUNCTION public.__arches_resource_display_documents_trigger();
+
+DROP TRIGGER IF EXISTS __arches_resource_display_documents_update ON public.tiles;
+CREATE TRIGGER __arches_resource_display_documents_update
+    AFTER UPDATE ON public.tiles
+    REFERENCING OLD TABLE AS old_tiles NEW TABLE AS new_tiles
+    FOR EACH STATEMENT EXECUTE FUNCTION public.__arches_resource_display_documents_trigger();
+
+DROP TRIGGER IF EXISTS __arches_resource_display_documents_delete ON public.tiles;
+CREATE TRIGGER __arches_resource_display_documents_delete
+    AFTER DELETE ON public.tiles
+    REFERENCING OLD TABLE AS old_tiles
+    FOR EACH STATEMENT EXECUTE FUNCTION public.__arches_resource_display_documents_trigger();
+
+
+-- DROP FUNCTION IF EXISTS public.__arches_resource_display_documents_stale_trigger();
+
+CREATE OR REPLACE FUNCTION public.__arches_resource_display_documents_stale_trigger()
+    RETURNS trigger
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+        DECLARE
+            changed_graphid uuid;
+        BEGIN
+            -- a changed card or widget row changes the card names / widget labels the documents
+            -- of its graph were built with. they are not rebuilt here, a graph can have millions
+            -- of resources, but marked stale for the backfill.
+            IF TG_TABLE_NAME = 'cards' THEN
+                changed_graphid := CASE WHEN TG_OP = 'DELETE' THEN OLD.graphid ELSE NEW.graphid END;
+            ELSE
+                SELECT c.graphid INTO changed_graphid
+                FROM public.cards c
+                WHERE c.cardid = CASE WHEN TG_OP = 'DELETE' THEN OLD.cardid ELSE NEW.cardid END;
+            END IF;
+            IF changed_graphid IS NOT NULL THEN
+                INSERT INTO public.__arches_resource_display_stale_graphs (graphid)
+                VALUES (changed_graphid)
+                ON CONFLICT (graphid) DO UPDATE SET since = now();
+            END IF;
+            RETURN NULL;
+        END;
+$BODY$;
+
+DROP TRIGGER IF EXISTS __arches_resource_display_documents_cards ON public.cards;
+CREATE TRIGGER __arches_resource_display_documents_cards
+    AFTER INSERT OR UPDATE OR DELETE ON public.cards
+    FOR EACH ROW EXECUTE FUNCTION public.__arches_resource_display_documents_stale_trigger();
+
+DROP TRIGGER IF EXISTS __arches_resource_display_documents_widgets ON public.cards_x_nodes_x_widgets;
+CREATE TRIGGER __arches_resource_display_documents_widgets
+    AFTER INSERT OR UPDATE OR DELETE ON public.cards_x_nodes_x_widgets
+    FOR EACH ROW EXECUTE FUNCTION public.__arches_resource_display_documents_stale_trigger();
+
+
+-- DROP FUNCTION IF EXISTS public.__arches_get_resource_display_document(uuid, text);
+
+CREATE OR REPLACE FUNCTION public.__arches_get_resource_display_document(
+	resourceid uuid,
+	language_id text DEFAULT 'en'::text)
+    RETURNS jsonb
+    LANGUAGE 'sql'
+    COST 100
+    STABLE PARALLEL SAFE
+AS $BODY$
+    -- NULL when the resource has no document yet or its graph's labels changed since it was built
+    SELECT rd.document
+    FROM public.__arches_resource_display_documents rd
+        join public.resource_instances r on r.resourceinstanceid = rd.resourceinstanceid
+        left join public.__arches_resource_display_stale_graphs s on s.graphid = r.graphid
+    WHERE rd.resourceinstanceid = resourceid
+        AND rd.language_id = __arches_get_resource_display_document.language_id
+        -- strictly after: one built in the transaction that changed the labels used the old ones
+        AND (s.since IS NULL OR rd.built > s.since);
+$BODY$;
+
+
+-- DROP FUNCTION IF EXISTS public.__arches_backfill_resource_display_documents(uuid, boolean);
+
+CREATE OR REPLACE FUNCTION public.__arches_backfill_resource_display_documents(
+	graph_id uuid DEFAULT NULL,
+	missing_only boolean DEFAULT true)
+    RETURNS integer
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+        DECLARE
+            resource record;
+            built integer := 0;
+        BEGIN
+            -- builds the documents of existing resources and rebuilds those stale after a graph
+            -- edit, or with missing_only false rebuilds them all, e.g. after loads that ran with
+            -- the user triggers on tiles disabled (the bulk data manager) or to pick up changed
+            -- related resource names and concept labels.
+            -- select __arches_backfill_resource_display_documents(NULL, false); rebuilds everything.
+            FOR resource IN
+                SELECT r.resourceinstanceid
+                FROM public.resource_instances r
+                    left join public.__arches_resource_display_stale_graphs s on s.graphid = r.graphid
+                WHERE (graph_id IS NULL OR r.graphid = graph_id)
+                    AND (
+                        NOT missing_only
+                        OR (
+                            SELECT count(*) FROM public.__arches_resource_display_documents rd
+                            WHERE rd.resourceinstanceid = r.resourceinstanceid
+                                AND (s.since IS NULL OR rd.built > s.since)
+                        ) < (SELECT count(*) FROM public.languages)
+                    )
+            LOOP
+                PERFORM __arches_refresh_resource_display_document(resource.resourceinstanceid);
+                built := built + 1;
+            END LOOP;
+            RETURN built;
+        END;
+$BODY$;
@@ -0,0 +1,180 @@
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import QuerySet
+
+from arches.app.models import models
+from arches.app.search.base_index import BaseIndex
+from arches.app.search.elasticsearch_dsl_builder import Query
+
+DEFAULT_BATCH_SIZE = 1000
+
+# set while documents are prepared in bulk, when get_documents_to_index must really build them
+_BULK = threading.local()
+
+
+def get_batch_size(batch_size: Optional[int] = None) -> int:
+    return batch_size or getattr(settings, "CUSTOM_INDEX_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+
+
+def _resourceids(resources) -> Iterator[str]:
+    '''
+    The ids of resources given as a queryset, Resource objects or ids
+    '''
+    if isinstance(resources, QuerySet):
+        yield from (str(resourceid) for resourceid in resources.values_list("resourceinstanceid", flat=True).iterator())
+        return
+    for resource in resources:
+        yield str(getattr(resource, "resourceinstanceid", resource))
+
+
+@contextmanager
+def _preparing_in_bulk():
+    previous = getattr(_BULK, "active", False)
+    _BULK.active = True
+    try:
+        yield
+    finally:
+        _BULK.active = previous
+
+
+def _batches(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def prepare_documents(index: BaseIndex, resourceids: List[str]) -> Iterator[Tuple[Dict, str]]:
+    '''
+    Gets the documents of a batch of resources from any custom index, loading the
+    batch's resources and tiles in two queries and calling get_documents_to_index
+    for each resource
+    '''
+    tiles = {}
+    for tile in models.TileModel.objects.filter(resourceinstance_id__in=resourceids):
+        tiles.setdefault(str(tile.resourceinstance_id), []).append(tile)
+    for resource in models.ResourceInstance.objects.filter(resourceinstanceid__in=resourceids):
+        yield index.get_documents_to_index(resource, tiles.get(str(resource.resourceinstanceid), []))
+
+
+def bulk_index(index: BaseIndex, resources, batch_size: Optional[int] = None, quiet: bool = True) -> int:
+    '''
+    Sends the documents of resources to a custom index in bulk requests, without
+    refreshing the index
+
+    :param index: The custom index, batches are prepared with its get_documents_to_index_in_bulk if it has one
+    :param resources: A Resource queryset, Resource objects or resource ids
+    :param batch_size: Resources prepared together and documents per bulk request, defaults to CUSTOM_INDEX_BATCH_SIZE
+    :param quiet: Don't print the batch progress
+    :return: The number of resources prepared
+    '''
+    batch_size = get_batch_size(batch_size)
+    prepare = getattr(index, "get_documents_to_index_in_bulk", None) or (lambda batch: prepare_documents(index, batch))
+    total = 0
+    with index.se.BulkIndexer(batch_size=batch_size, refresh=False) as indexer, _preparing_in_bulk():
+        # not `resources or []`: the truth test of a queryset would load every resource
+        for batch in _batches(_resourceids([] if resources is None else resources), batch_size):
+            for document, doc_id in prepare(batch):
+                if document is not None and doc_id is not None:
+                    indexer.add(index=index.index_name, id=doc_id, data=document)
+            total += len(batch)
+            if quiet is False:
+                print(f"Custom Index - {index.index_name}: {total} resources prepared")
+    return total
+
+
+def _deferred_when_asynchronous(build):
+    '''
+    Wraps get_documents_to_index so that outside of bulk preparation an index updated
+    asynchronously returns no document, only the id index_document queues
+    '''
+    @functools.wraps(build)
+    def get_documents_to_index(self, resourceinstance, tiles):
+        from aher_project.search_indexes import update_queue
+
+        if not getattr(_BULK, "active", False) and update_queue.updates_asynchronously(self.index_name):
+            return None, str(resourceinstance.resourceinstanceid)
+        return build(self, resourceinstance, tiles)
+
+    return get_documents_to_index
+
+
+class BatchIndex(BaseIndex):
+    '''
+    A custom index that prepares its documents for a batch of resources at a time
+
+    Subclasses implement get_documents_to_index_in_bulk, ideally with a few
+    aggregate queries per batch, and keep get_documents_to_index for the single
+    resource that Arches indexes when a resource is saved. index_resources, and
+    so reindex, then prepare CUSTOM_INDEX_BATCH_SIZE resources at a time and send
+    their documents in elasticsearch bulk requests of the same size.
+
+    With should_update_asynchronously, the get_documents_to_index of a subclass
+    is skipped when Arches calls it for a saved resource: the resource is only
+    queued by index_document, and its document is built later in bulk.
+    '''
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        build = cls.__dict__.get("get_documents_to_index")
+        if build is not None:
+            cls.get_documents_to_index = _deferred_when_asynchronous(build)
+
+    def get_documents_to_index_in_bulk(self, resourceids: List[str]) -> Iterable[Tuple[Dict, str]]:
+        '''
+        Gets the documents of a batch of resources
+
+        The default loads the batch's resources and tiles in two queries and calls
+        get_documents_to_index for each resource, override it to aggregate in the
+        database instead.
+
+        :param resourceids: The ids of the resources in the batch
+        :return: (document, id) pairs, resources without a document can be left out
+        '''
+        return prepare_documents(self, resourceids)
+
+    def index_document(self, document=None, id=None):
+        '''
+        Indexes the document of a saved resource, or with should_update_asynchronously
+        queues the resource to be reindexed in bulk by a Celery task, see update_queue
+        '''
+        from aher_project.search_indexes import update_queue
+
+        if id is not None and update_queue.updates_asynchronously(self.index_name):
+            update_queue.enqueue(self.index_name, id)
+        else:
+            super().index_document(document=document, id=id)
+
+    def index_resources(self, resources=None, batch_size=None, quiet=False):
+        '''
+        Indexes resources a batch at a time
+
+        :param resources: A Resource queryset, Resource objects or resource ids
+        :param batch_size: Resources prepared together and documents per bulk request, defaults to CUSTOM_INDEX_BATCH_SIZE
+        :param quiet: Don't print the batch progress
+        '''
+        start = datetime.now()
+        batch_size = get_batch_size(batch_size)
+        q = Query(se=self.se)
+        self.se.refresh(index=self.index_name)
+        count_before = self.se.count(index=self.index_name, body=q.dsl)
+
+        # refreshed once at the end rather than after every bulk request
+        total = bulk_index(self, resources, batch_size, quiet)
+
+        self.se.refresh(index=self.index_name)
+        indexed = self.se.count(index=self.index_name, body=q.dsl) - count_before
+        status = "Passed" if total == indexed else "Failed"
+        print(f"Custom Index - {settings.ELASTICSEARCH_PREFIX}_{self.index_name}")
+        print(f"    Status: {status}, In Database: {total}, Indexed: {indexed}, Took: {(datetime.now() - start).seconds} seconds")
+
+    def reindex(self, graphids=None, clear_index=True, batch_size=None, quiet=False):
+        super().reindex(graphids=graphids, clear_index=clear_index, batch_size=get_batch_size(batch_size), quiet=quiet)
@@ -0,0 +1,100 @@
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+from arches.app.models import models
+from aher_project.search_indexes.batch_index import BatchIndex
+
+
+class ResourceStatisticsIndex(BatchIndex):
+    '''
+    Per resource statistics for data quality dashboards: the number of tiles,
+    in total and per nodegroup, the size of the tile data and the last edit.
+    document_size is the size in bytes of the resource's tile data as JSON.
+    '''
+
+    def prepare_index(self):
+        self.index_metadata = {
+            "mappings": {
+                "properties": {
+                    "graph_id": {"type": "keyword"},
+                    "tile_count": {"type": "integer"},
+                    "document_size": {"type": "long"},
+                    "last_edit": {"type": "date"},
+                    "nodegroups": {
+                        "type": "nested",
+                        "properties": {
+                            "nodegroup_id": {"type": "keyword"},
+                            "tile_count": {"type": "integer"},
+                            "document_size": {"type": "long"},
+                        },
+                    },
+                }
+            }
+        }
+        super(ResourceStatisticsIndex, self).prepare_index()
+
+    def get_documents_to_index(self, resourceinstance, tiles):
+        nodegroups = {}
+        for tile in tiles:
+            nodegroup = nodegroups.setdefault(str(tile.nodegroup_id), {"nodegroup_id": str(tile.nodegroup_id), "tile_count": 0, "document_size": 0})
+            nodegroup["tile_count"] += 1
+            # jsonb's text form uses the same separators as json.dumps
+            nodegroup["document_size"] += len(json.dumps(tile.data, ensure_ascii=False).encode("utf-8"))
+        last_edit = models.EditLog.objects.filter(resourceinstanceid=str(resourceinstance.resourceinstanceid)).aggregate(last_edit=Max("timestamp"))["last_edit"]
+        return (self._document(resourceinstance.graph_id, list(nodegroups.values()), last_edit), str(resourceinstance.resourceinstanceid))
+
+    def get_documents_to_index_in_bulk(self, resourceids: List[str]) -> Iterator[Tuple[Dict, str]]:
+        with connection.cursor() as cursor:
+            # the tile counts and sizes of the whole batch in one grouped query
+            cursor.execute(
+                """
+                SELECT r.resourceinstanceid, r.graphid, t.nodegroupid, t.tile_count, t.document_size
+                FROM resource_instances r
+                    left join (
+                        SELECT resourceinstanceid, nodegroupid, count(*) AS tile_count, sum(octet_length(tiledata::text)) AS document_size
+                        FROM tiles
+                        WHERE resourceinstanceid = ANY(%s::uuid[])
+                        GROUP BY resourceinstanceid, nodegroupid
+                    ) t on t.resourceinstanceid = r.resourceinstanceid
+                WHERE r.resourceinstanceid = ANY(%s::uuid[])
+                """,
+                [resourceids, resourceids],
+            )
+            resources = {}
+            for resourceid, graphid, nodegroupid, tile_count, document_size in cursor.fetchall():
+                graph, nodegroups = resources.setdefault(str(resourceid), (graphid, []))
+                if nodegroupid is not None:
+                    nodegroups.append({"nodegroup_id": str(nodegroupid), "tile_count": tile_count, "document_size": int(document_size or 0)})
+
+            cursor.execute(
+                "SELECT resourceinstanceid, max(timestamp) FROM edit_log WHERE resourceinstanceid = ANY(%s) GROUP BY resourceinstanceid",
+                [resourceids],
+            )
+            last_edits = dict(cursor.fetchall())
+
+        for resourceid, (graphid, nodegroups) in resources.items():
+            yield (self._document(graphid, nodegroups, last_edits.get(resourceid)), resourceid)
+
+    def _document(self, graphid, nodegroups: List[Dict], last_edit) -> Dict:
+        return {
+            "graph_id": str(graphid),
+            "tile_count": sum(nodegroup["tile_count"] for nodegroup in nodegroups),
+            "document_size": sum(nodegroup["document_size"] for nodegroup in nodegroups),
+            "last_edit": last_edit.isoformat() if last_edit else None,
+            "nodegroups": nodegroups,
+        }
+
+
+def registered_index_name() -> Optional[str]:
+    '''
+    The name the ResourceStatisticsIndex is registered under in ELASTICSEARCH_CUSTOM_INDEXES
+    '''
+    module = f"{ResourceStatisticsIndex.__module__}.{ResourceStatisticsIndex.__name__}"
+    for index in settings.ELASTICSEARCH_CUSTOM_INDEXES:
+        if index["module"] == module:
+            return index["name"]
+    return None
@@ -1,10 +1,23 @@
-from arches.app.search.base_index import BaseIndex
+from django.db.models import Count
 
+from arches.app.models import models
+from aher_project.search_indexes.batch_index import BatchIndex
 
-class SampleIndex(BaseIndex):
+
+class SampleIndex(BatchIndex):
     def prepare_index(self):
-        self.index_metadata = {"mappings": {"properties": {"tile_count": {"type": "keyword"}, "graph_id": {"type": "keyword"}}}}
+        self.index_metadata = {"mappings": {"properties": {"tile_count": {"type": "integer"}, "graph_id": {"type": "keyword"}}}}
         super(SampleIndex, self).prepare_index()
 
     def get_documents_to_index(self, resourceinstance, tiles):
         return ({"tile_count": len(tiles), "graph_id": resourceinstance.graph_id}, str(resourceinstance.resourceinstanceid))
+
+    def get_documents_to_index_in_bulk(self, resourceids):
+        # the tile counts of the whole batch in one grouped query
+        rows = (
+            models.ResourceInstance.objects.filter(resourceinstanceid__in=resourceids)
+            .annotate(tile_count=Count("tilemodel"))
+            .values_list("resourceinstanceid", "graph_id", "tile_count")
+        )
+        for resourceid, graph_id, tile_count in rows:
+            yield ({"tile_count": tile_count, "graph_id": graph_id}, str(resourceid))
@@ -0,0 +1,129 @@
+"""
+Coalescing update queue for custom indexes with should_update_asynchronously.
+
+Saving a resource only records its id in __arches_custom_index_queue, where
+repeated saves of the same resource collapse into one row. The first save
+after a flush schedules flush_custom_index_queue CUSTOM_INDEX_UPDATE_DELAY
+seconds after its transaction commits, which prepares the documents of
+everything queued by then in batches and sends them in bulk requests.
+"""
+
+import logging
+from typing import List
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from arches.app.search.base_index import get_index
+from aher_project.search_indexes.batch_index import bulk_index, get_batch_size
+
+DEFAULT_UPDATE_DELAY = 5 # seconds
+# a flush claimed longer ago than this many update delays is taken to be lost, e.g. its task
+# was never published or its worker died, and the next save claims and schedules it again
+STALE_FLUSH_DELAYS = 10
+
+
+def update_delay() -> int:
+    return getattr(settings, "CUSTOM_INDEX_UPDATE_DELAY", DEFAULT_UPDATE_DELAY)
+
+
+def updates_asynchronously(name: str) -> bool:
+    '''
+    True if the custom index is registered with should_update_asynchronously
+    '''
+    return any(index["name"] == name and index.get("should_update_asynchronously") for index in settings.ELASTICSEARCH_CUSTOM_INDEXES)
+
+
+def enqueue(name: str, resourceid: str):
+    '''
+    Queues a resource for reindexing, scheduling a flush if none is scheduled yet
+
+    The flush is scheduled once the saving transaction commits, so it never runs
+    before the queued resource and its tiles can be read.
+    '''
+    with connection.cursor() as cursor:
+        # the resource is queued before the flush is claimed, so a flush that is already
+        # scheduled, which clears its claim before draining, always picks the resource up
+        cursor.execute(
+            """
+            WITH queued AS (
+                INSERT INTO __arches_custom_index_queue (index_name, resourceinstanceid)
+                VALUES (%s, %s)
+                ON CONFLICT DO NOTHING
+            )
+            INSERT INTO __arches_custom_index_flushes AS f (index_name)
+            VALUES (%s)
+            ON CONFLICT (index_name) DO UPDATE SET scheduled = now()
+                WHERE f.scheduled < now() - make_interval(secs => %s)
+            RETURNING index_name
+            """,
+            [name, str(resourceid), name, update_delay() * STALE_FLUSH_DELAYS],
+        )
+        schedule = cursor.fetchone() is not None
+    if schedule:
+        transaction.on_commit(lambda: _schedule(name))
+
+
+def _schedule(name: str):
+    from aher_project.tasks import flush_custom_index_queue
+
+    try:
+        flush_custom_index_queue.apply_async(args=[name], countdown=update_delay())
+    except Exception as e:
+        # no broker to queue the flush with, index here rather than leave the resource queued
+        logging.error(f"Could not schedule a flush of custom index {name}, flushing now: {str(e)}")
+        flush(name)
+
+
+def _take(name: str, limit: int) -> List[str]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            DELETE FROM __arches_custom_index_queue q
+            WHERE q.index_name = %s
+                AND q.resourceinstanceid IN (
+                    SELECT resourceinstanceid FROM __arches_custom_index_queue
+                    WHERE index_name = %s
+                    ORDER BY queued
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+            RETURNING q.resourceinstanceid
+            """,
+            [name, name, limit],
+        )
+        return [str(row[0]) for row in cursor.fetchall()]
+
+
+def _requeue(name: str, resourceids: List[str]):
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO __arches_custom_index_queue (index_name, resourceinstanceid) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            [[name, resourceid] for resourceid in resourceids],
+        )
+
+
+def flush(name: str) -> int:
+    '''
+    Reindexes every resource queued for a custom index
+
+    :return: The number of resources reindexed
+    '''
+    with connection.cursor() as cursor:
+        # saves from here on schedule the next flush
+        cursor.execute("DELETE FROM __arches_custom_index_flushes WHERE index_name = %s", [name])
+
+    index = get_index(name)
+    batch_size = get_batch_size()
+    total = 0
+    while True:
+        # taken off the queue in their own transaction, so saves queueing the same
+        # resources are never held up by a flush in progress
+        resourceids = _take(name, batch_size)
+        if not resourceids:
+            return total
+        try:
+            total += bulk_index(index, resourceids, batch_size)
+        except Exception:
+            _requeue(name, resourceids)
+            raise
@@ -94,6 +94,19 @@ ELASTICSEARCH_CUSTOM_INDEXES = []
 #     'name': 'my_new_custom_index', <-- follow ES index naming rules
 #     'should_update_asynchronously': False  <-- denotes if asynchronously updating the index would affect custom functionality within the project.
 # }]
+# the resource statistics served at /resource-statistics for the data quality dashboards:
+# {
+#     'module': 'aher_project.search_indexes.resource_statistics_index.ResourceStatisticsIndex',
+#     'name': 'resource_statistics',
+#     'should_update_asynchronously': True
+# }
+
+# resources whose custom index documents are prepared together, and documents per elasticsearch
+# bulk request, when a custom index based on search_indexes.batch_index.BatchIndex is (re)indexed
+CUSTOM_INDEX_BATCH_SIZE = 1000
+# seconds a custom index with should_update_asynchronously waits after a resource is saved
+# before reindexing it, saves of the same resource within this window are reindexed once
+CUSTOM_INDEX_UPDATE_DELAY = 5
 
 KIBANA_URL = "http://localhost:5601/"
 KIBANA_CONFIG_BASEPATH = "kibana"  # must match Kibana config.yml setting (server.basePath) but without the leading slash,
@@ -107,15 +120,24 @@ LOAD_PACKAGE_ONTOLOGIES = True
 # Make sure to use a trailing slash
 ARCHES_NAMESPACE_FOR_DATA_EXPORT = "http://localhost:8000/"
 
+# connections are kept open between requests / tasks for DB_CONN_MAX_AGE seconds and checked
+# before they are reused. DB_POOL=1 switches to aher_project.db.backends.pooled_postgis instead,
+# where every process keeps up to DB_POOL_MAX_SIZE connections that its threads borrow per request.
+DB_POOL = os.environ.get("DB_POOL", "0") == "1"
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", 60)) # seconds
+
 DATABASES = {
     "default": {
         "ATOMIC_REQUESTS": False,
         "AUTOCOMMIT": True,
-        "CONN_MAX_AGE": 0,
-        "ENGINE": "django.contrib.gis.db.backends.postgis",
+        # pooled connections go back to the pool at the end of every request, rather than staying open
+        "CONN_MAX_AGE": 0 if DB_POOL else DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "ENGINE": "aher_project.db.backends.pooled_postgis" if DB_POOL else "django.contrib.gis.db.backends.postgis",
         "HOST": "localhost",
         "NAME": "aher_project",
-        "OPTIONS": {},
+        "OPTIONS": {"POOL": {"MAX_SIZE": DB_POOL_MAX_SIZE}} if DB_POOL else {},
         "PASSWORD": "postgis",
         "PORT": "5432",
         "POSTGIS_TEMPLATE": "template_postgis",
@@ -177,6 +199,18 @@ MIDDLEWARE = [
     # "silk.middleware.SilkyMiddleware",
 ]
 
+# per view request timing, and for a sample of the requests their SQL, cache and elasticsearch
+# use, served at /metrics in the Prometheus text format and logged every INSTRUMENTATION_LOG_INTERVAL.
+# off unless INSTRUMENTATION_ENABLED=1 is in the environment
+INSTRUMENTATION_ENABLED = os.environ.get("INSTRUMENTATION_ENABLED", "0") == "1"
+INSTRUMENTATION_SAMPLE_RATE = 0.1 # share of the requests whose SQL, cache and elasticsearch use is recorded
+INSTRUMENTATION_LOG_INTERVAL = 300 # seconds, 0 to not log
+# /metrics is open to staff users and to requests with "Authorization: Bearer <token>", for the scraper
+INSTRUMENTATION_METRICS_TOKEN = os.environ.get("INSTRUMENTATION_METRICS_TOKEN", "")
+if INSTRUMENTATION_ENABLED:
+    # first, so that the time of the other middleware is included
+    MIDDLEWARE.insert(0, "aher_project.instrumentation.InstrumentationMiddleware")
+
 STATICFILES_DIRS = build_staticfiles_dirs(
     root_dir=ROOT_DIR,
     app_root=APP_ROOT,
@@ -260,15 +294,42 @@ DATA_UPLOAD_MAX_MEMORY_SIZE = 15728640
 SESSION_COOKIE_NAME = 'aher_project'
 
 # For more info on configuring your cache: https://docs.djangoproject.com/en/2.2/topics/cache/
+# default reads through a small in-process LRU (aher_project.cache.TieredCache)
+# to a shared cache: redis when CACHE_REDIS_URL is set, otherwise a file based cache shared by
+# the processes on this host, which is also the fallback while redis cannot be reached
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "")
+CACHE_DIR = os.path.join(APP_ROOT, 'django_cache')
+CACHE_LOCAL_MAX_ENTRIES = 2000
+CACHE_LOCAL_TIMEOUT = 60 # seconds, how long a change made by another process can go unseen
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        'BACKEND': 'aher_project.cache.TieredCache',
+        'OPTIONS': {
+            'SHARED': 'shared' if CACHE_REDIS_URL else None,
+            'FALLBACK': 'local',
+            'LOCAL_MAX_ENTRIES': CACHE_LOCAL_MAX_ENTRIES,
+            'LOCAL_TIMEOUT': CACHE_LOCAL_TIMEOUT,
+        },
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     },
     'user_permission': {
+        # no in-process tier: a revoked permission must apply at once in every process, and
+        # incr / decr must not work on a stale copy in one of them
         'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
         'LOCATION': 'user_permission_cache',
     },
 }
+if CACHE_REDIS_URL:
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+        'KEY_PREFIX': 'aher_project',
+    }
 
 # Hide nodes and cards in a report that have no data
 HIDE_EMPTY_NODES_IN_REPORT = False
@@ -329,6 +390,8 @@ CELERY_SEARCH_EXPORT_CHECK = 3600  # seconds
 CELERY_BEAT_SCHEDULE = {
     "delete-expired-search-export": {"task": "arches.app.tasks.delete_file", "schedule": CELERY_SEARCH_EXPORT_CHECK,},
     "notification": {"task": "arches.app.tasks.message", "schedule": CELERY_SEARCH_EXPORT_CHECK, "args": ("Celery Beat is Running",),},
+    # nightly incremental refresh of the generated documents, fanned out over the workers
+    # "generate-docs-incremental": {"task": "aher_project.tasks.generate_docs", "schedule": 24 * 3600, "kwargs": {"options": {"incremental": True}},},
 }
 
 # Set to True if you want to send celery tasks to the broker without being able to detect celery.
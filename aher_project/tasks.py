@@ -0,0 +1,178 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from celery import chord, shared_task
+from celery.utils.time import get_exponential_backoff_interval
+
+from aher_project.management.commands.util import graph_cache, scraper
+from aher_project.management.commands.util.telemetry import TELEMETRY
+from aher_project.search_indexes import update_queue
+
+logger = logging.getLogger(__name__)
+
+DOCS_BATCH_SIZE = 100 # resources written by one generate_docs_batch task
+DOCS_TASK_MAX_RETRIES = 3
+DOCS_RETRY_BACKOFF_MAX = 600 # seconds, as Celery's retry_backoff_max
+
+# options of generate_docs that can be passed on to the crawl tasks, shard output is
+# left out as appending to shards would not make retried tasks idempotent
+DOCS_TASK_OPTIONS = ("incremental", "projections")
+
+
+def _open_crawl_state(graphs: Dict, options: Optional[Dict]):
+    # the scraper keeps its crawl state per process, which suits the default prefork pool
+    options = {key: value for key, value in (options or {}).items() if key in DOCS_TASK_OPTIONS}
+    scraper.GRAPH_DICT = graph_cache.freeze(graphs)
+    scraper.open_crawl_state(output="files", **options)
+
+
+def _process(resourceids: List[str]) -> Tuple[int, List[str]]:
+    '''
+    Fetches and writes resources one after another
+
+    :return: The number stored, and the ids of the resources that failed. Unchanged
+        resources of an incremental crawl are neither
+    '''
+    stored = 0
+    failed = []
+    for resourceid in resourceids:
+        failures = TELEMETRY.outcomes["failed"]
+        if scraper.process_resource(resourceid):
+            stored += 1
+        elif TELEMETRY.outcomes["failed"] > failures:
+            failed.append(resourceid)
+    return stored, failed
+
+
+def _retry_failed(task, failed: List[str], **kwargs):
+    '''
+    Retries the task for the resources that failed, if it has retries left
+    '''
+    if failed and task.request.retries < task.max_retries:
+        countdown = get_exponential_backoff_interval(factor=1, retries=task.request.retries, maximum=DOCS_RETRY_BACKOFF_MAX)
+        logger.info(f"Retrying {len(failed)} failed resources in {countdown}s")
+        raise task.retry(kwargs=kwargs, countdown=countdown)
+    if failed:
+        logger.error(f"Giving up on {len(failed)} resources after {task.request.retries} retries: {', '.join(failed)}")
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=DOCS_TASK_MAX_RETRIES, acks_late=True)
+def generate_docs_batch(self, resourceids: List[str], graphs: Dict, options: Optional[Dict] = None, total: Optional[int] = None, stored: int = 0) -> Dict:
+    """
+    Fetches and writes a batch of resources. Every resource is written to its own
+    file named after its id, so running a batch again (e.g. on retry) is safe.
+    Resources that fail are retried on their own, with backoff, up to
+    DOCS_TASK_MAX_RETRIES times, total and stored carrying the batch's counts
+    over. Anything failing the whole batch retries it.
+    """
+    total = len(resourceids) if total is None else total
+    _open_crawl_state(graphs, options)
+    try:
+        done, failed = _process(resourceids)
+    finally:
+        scraper.close_crawl_state()
+    stored += done
+    _retry_failed(self, failed, resourceids=failed, graphs=graphs, options=options, total=total, stored=stored)
+    return {"resources": total, "stored": stored, "failed": len(failed)}
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=DOCS_TASK_MAX_RETRIES, acks_late=True)
+def generate_docs_page(self, page: int, graphs: Dict, options: Optional[Dict] = None, resourceids: Optional[List[str]] = None, total: Optional[int] = None, stored: int = 0) -> Dict:
+    """
+    Fetches and writes every resource on one page of the resource list. A page
+    that cannot be listed raises ListingError so that the task is retried rather
+    than the page being taken as empty. Resources that fail are retried on their
+    own like in generate_docs_batch, the page is only marked complete once none did.
+    """
+    _open_crawl_state(graphs, options)
+    failed = []
+    try:
+        if resourceids is None:
+            resourceids = scraper.list_resourceids(page, strict=True)
+            total = len(resourceids)
+        done, failed = _process(resourceids)
+        stored += done
+        if total and not failed:
+            scraper.CHECKPOINT.mark_page_complete(page, total)
+    finally:
+        scraper.close_crawl_state()
+    _retry_failed(self, failed, page=page, graphs=graphs, options=options, resourceids=failed, total=total, stored=stored)
+    return {"page": page, "resources": total or 0, "stored": stored, "failed": len(failed)}
+
+
+@shared_task
+def generate_docs_summary(results: List[Dict]) -> Dict:
+    """
+    Chord callback totalling the results of the batch / page tasks of a crawl
+    """
+    summary = {
+        "tasks": len(results),
+        "resources": sum(result["resources"] for result in results),
+        "stored": sum(result["stored"] for result in results),
+        "failed": sum(result.get("failed", 0) for result in results),
+    }
+    logger.info(
+        f"Document generation finished: {summary['stored']} of {summary['resources']} resources stored "
+        f"by {summary['tasks']} tasks, {summary['failed']} failed"
+    )
+    return summary
+
+
+@shared_task
+def generate_docs(options: Optional[Dict] = None, batch_size: int = DOCS_BATCH_SIZE, pages: int = 0) -> Optional[str]:
+    """
+    Fans a full crawl out over the Celery workers: the graphs are fetched and the
+    resource list is walked here, then a chord of generate_docs_batch tasks does
+    the fetching and writing and generate_docs_summary gathers their results.
+    When the number of pages is given, or can be planned up front (see
+    scraper.plan_listing), one generate_docs_page task per page is queued
+    instead, without walking the resource list first.
+
+    :param options: generate_docs options passed on to the tasks, see DOCS_TASK_OPTIONS
+    :param batch_size: The number of resources per generate_docs_batch task
+    :param pages: The number of pages to crawl from START_PAGE, 0 to plan them or else walk the list until its end
+    :return: The id of the chord callback's result, None if there was nothing to crawl
+    """
+    scraper.run_graph_crawler("empty")
+    graphs = graph_cache.to_dict(scraper.GRAPH_DICT)
+
+    if not pages:
+        plan = scraper.plan_listing()
+        if plan is not None:
+            pages = plan.last_page - scraper.START_PAGE + 1
+            if pages <= 0:
+                return None
+
+    if pages:
+        header = [generate_docs_page.s(page, graphs, options) for page in range(scraper.START_PAGE, scraper.START_PAGE + pages)]
+        return chord(header)(generate_docs_summary.s()).id
+
+    batches = []
+    batch = []
+    page = scraper.START_PAGE
+    while page < scraper.MAX_PAGES:
+        resourceids = scraper.list_resourceids(page)
+        if not resourceids:
+            break
+        for resourceid in resourceids:
+            batch.append(resourceid)
+            if len(batch) >= batch_size:
+                batches.append(batch)
+                batch = []
+        page += 1
+    if batch:
+        batches.append(batch)
+
+    if not batches:
+        return None
+    header = [generate_docs_batch.s(batch, graphs, options) for batch in batches]
+    return chord(header)(generate_docs_summary.s()).id
+
+
+@shared_task(autoretry_for=(Exception,), retry_backoff=True, max_retries=DOCS_TASK_MAX_RETRIES, acks_late=True)
+def flush_custom_index_queue(name: str) -> int:
+    """
+    Reindexes the resources queued for a custom index with should_update_asynchronously,
+    scheduled by update_queue.enqueue a short delay after the first save it covers
+    """
+    return update_queue.flush(name)
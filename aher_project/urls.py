@@ -2,10 +2,16 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
 from django.urls import include, path
+from aher_project.views.metrics import MetricsView
+from aher_project.views.resource_count import ResourceCountView
+from aher_project.views.resource_statistics import ResourceStatisticsView
 
 # COPIED FROM ./arches_her/docker/aher_project/docker/urls.py
 
 urlpatterns = [
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    path("resource-count", ResourceCountView.as_view(), name="resource_count"),
+    path("resource-statistics", ResourceStatisticsView.as_view(), name="resource_statistics"),
     path('', include('arches.urls')),
    path("", include("arches_her.urls")),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
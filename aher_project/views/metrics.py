@@ -0,0 +1,31 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.views.generic import View
+
+from aher_project.instrumentation import COLLECTOR
+
+
+def _has_token(request) -> bool:
+    token = getattr(settings, "INSTRUMENTATION_METRICS_TOKEN", "")
+    scheme, _, credentials = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    return bool(token) and scheme.lower() == "bearer" and hmac.compare_digest(credentials.strip().encode(), token.encode())
+
+
+class MetricsView(View):
+    '''
+    The request aggregates of the process answering, in the Prometheus text format
+
+    Open to staff users and to requests bearing INSTRUMENTATION_METRICS_TOKEN (the
+    scraper), not found unless INSTRUMENTATION_ENABLED. Every process keeps its own
+    aggregates, labelled with its pid, so with several server processes each scrape
+    only sees the one that answered it.
+    '''
+
+    def get(self, request):
+        if not getattr(settings, "INSTRUMENTATION_ENABLED", False):
+            raise Http404()
+        if not (request.user.is_staff or request.user.is_superuser or _has_token(request)):
+            return HttpResponseForbidden()
+        return HttpResponse(COLLECTOR.prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
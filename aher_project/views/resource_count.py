@@ -0,0 +1,22 @@
+import math
+
+from django.conf import settings
+from django.views.generic import View
+
+from arches.app.models.models import ResourceInstance
+from arches.app.utils.response import JSONResponse
+
+
+class ResourceCountView(View):
+    '''
+    The number of resources the /resources/ listing pages through, and its page size,
+    so a crawl can plan every page up front instead of walking the list to its end
+
+        {"count": 123456, "page_size": 500, "pages": 247}
+    '''
+
+    def get(self, request):
+        # the same resources as the listing, which leaves out the system settings resource
+        count = ResourceInstance.objects.exclude(pk=settings.SYSTEM_SETTINGS_RESOURCE_ID).count()
+        page_size = settings.API_MAX_PAGE_SIZE
+        return JSONResponse({"count": count, "page_size": page_size, "pages": math.ceil(count / page_size)})
@@ -0,0 +1,88 @@
+from django.contrib.auth.decorators import login_required
+from django.utils.decorators import method_decorator
+from django.views.generic import View
+
+from arches.app.search.base_index import get_index
+from arches.app.utils.response import JSONErrorResponse, JSONResponse
+from aher_project.search_indexes.resource_statistics_index import registered_index_name
+
+DEFAULT_SIZE_INTERVAL = 10240 # bytes, width of the document size histogram buckets
+MAX_GRAPHS = 500 # graphs returned by the per graph aggregation
+MAX_NODEGROUPS = 1000 # nodegroups returned by the per nodegroup aggregation
+
+
+@method_decorator(login_required, name="dispatch")
+class ResourceStatisticsView(View):
+    '''
+    Aggregations of the ResourceStatisticsIndex for data quality dashboards, answered by
+    elasticsearch in a single search without touching the tiles table
+
+    Query parameters: graph_id to only count the resources of one graph, interval for the
+    width in bytes of the document size histogram buckets.
+    '''
+
+    def get(self, request):
+        name = registered_index_name()
+        if name is None:
+            return JSONErrorResponse("Resource statistics unavailable", "No ResourceStatisticsIndex is registered in ELASTICSEARCH_CUSTOM_INDEXES", status=404)
+        try:
+            interval = int(request.GET.get("interval", DEFAULT_SIZE_INTERVAL))
+        except ValueError:
+            interval = 0
+        if interval <= 0:
+            return JSONErrorResponse("Invalid interval", "interval must be a positive number of bytes", status=400)
+
+        graph_id = request.GET.get("graph_id")
+        body = {
+            "size": 0,
+            "track_total_hits": True,
+            "query": {"term": {"graph_id": graph_id}} if graph_id else {"match_all": {}},
+            "aggs": {
+                "graphs": {
+                    "terms": {"field": "graph_id", "size": MAX_GRAPHS},
+                    "aggs": {
+                        "tile_count": {"sum": {"field": "tile_count"}},
+                        "document_size": {"stats": {"field": "document_size"}},
+                        "last_edit": {"max": {"field": "last_edit"}},
+                    },
+                },
+                "document_size": {"histogram": {"field": "document_size", "interval": interval, "min_doc_count": 1}},
+                "tile_count": {"stats": {"field": "tile_count"}},
+                "nodegroups": {
+                    "nested": {"path": "nodegroups"},
+                    "aggs": {
+                        "nodegroup": {
+                            "terms": {"field": "nodegroups.nodegroup_id", "size": MAX_NODEGROUPS},
+                            "aggs": {"tile_count": {"sum": {"field": "nodegroups.tile_count"}}},
+                        }
+                    },
+                },
+            },
+        }
+        results = get_index(name).se.search(index=name, body=body)
+        aggregations = results["aggregations"]
+
+        return JSONResponse(
+            {
+                "resources": results["hits"]["total"]["value"],
+                "tile_count": aggregations["tile_count"],
+                "graphs": [
+                    {
+                        "graph_id": bucket["key"],
+                        "resources": bucket["doc_count"],
+                        "tile_count": int(bucket["tile_count"]["value"]),
+                        "document_size": bucket["document_size"],
+                        "last_edit": bucket["last_edit"].get("value_as_string"),
+                    }
+                    for bucket in aggregations["graphs"]["buckets"]
+                ],
+                "document_size_histogram": [
+                    {"from": int(bucket["key"]), "to": int(bucket["key"]) + interval, "resources": bucket["doc_count"]}
+                    for bucket in aggregations["document_size"]["buckets"]
+                ],
+                "nodegroups": [
+                    {"nodegroup_id": bucket["key"], "resources": bucket["doc_count"], "tile_count": int(bucket["tile_count"]["value"])}
+                    for bucket in aggregations["nodegroups"]["nodegroup"]["buckets"]
+                ],
+            }
+        )